@@ -1,4 +1,15 @@
 import xml.etree.ElementTree as et
+import base64
+import gzip
+import sys
+import tracemalloc
+import zlib
+from array import array
+from itertools import repeat
+
+from instrumentation import NULL_PROFILER
+from layerGrid import LayerGrid, PrefabSymbols
+from layerRegistry import LAYER_REGISTRY, layerNameIndex
 
 #Pi = 3.141592653589793238462643383279502884 # 180 degrees
 
@@ -32,11 +43,11 @@ import xml.etree.ElementTree as et
 #   .........
 #   TILESET #N
 #   LAYER #1 (name = "floor", "wall", "ceiling" etc)
-#      data
-#         tile 1 (gid)
-#         tile 2
-#         ......
-#         tile p
+#      data (encoding = none/"csv"/"base64", compression = none/"zlib"/"gzip")
+#         tile 1 (gid)      <-- only when there is no encoding, otherwise
+#         tile 2                the gid's are stored as the text of "data":
+#         ......                comma separated (csv) or as little-endian
+#         tile p                unsigned 32-bit integers (base64)
 #   LAYER #2
 #   .........
 #   LAYER #M
@@ -48,6 +59,51 @@ import xml.etree.ElementTree as et
 # read a dubgeon TXT file and create a blender mesh for it
 #the file has
 
+#====================================================
+# NOTE: the upper four bits of a gid are Tiled's
+# flip/rotation flags, they have to be cleared
+# before the gid is used to look up a tile
+#====================================================
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+ROTATED_HEXAGONAL_120_FLAG = 0x10000000
+GID_MASK = 0x0FFFFFFF
+
+# typecode of an array of unsigned 32-bit integers
+GID_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+# byte-wise translation tables for the highest byte of a gid:
+# one keeps the flags only (shifted down to the 0..15 range),
+# the other one clears them
+FLAGS_TABLE = bytes( b >> 4 for b in range(256) )
+CLEAR_FLAGS_TABLE = bytes( b & 0x0F for b in range(256) )
+
+# version of the reader's output (layer grids, symbols), to be bumped
+# whenever it changes, so that cached levels are not reused
+READER_VERSION = 3
+
+def layerGridProperty( layerKind ):
+    '''Creates a property exposing a grid of self.grids as an attribute'''
+    def getGrid( self ):
+        return self.grids.get( layerKind )
+    def setGrid( self, grid ):
+        self.grids[layerKind] = grid
+    return property( getGrid, setGrid )
+
+def layerMatrixProperty( gridName ):
+    '''Creates a property exposing a layer grid as the old list of
+    lists of prefab names. The lists are only built when the property is
+    read for the first time, so changing them does not change the grid'''
+    def getMatrix( self ):
+        if ( gridName not in self.layerMatrices ):
+            grid = getattr( self, gridName )
+            self.layerMatrices[gridName] = grid.toMatrix() if grid is not None else []
+        return self.layerMatrices[gridName]
+    def setMatrix( self, matrix ):
+        self.layerMatrices[gridName] = matrix
+    return property( getMatrix, setMatrix )
+
+
 class DungeonFileReader():
     '''Class responsible for reading the description of the dungeon and 
     creating structures describing the dungeon (floor, walls, ceiling etc.)'''
@@ -65,28 +121,109 @@ class DungeonFileReader():
         # however same tileset may be used in different 
         # layers
         self.tilesets = []
+        # gid -> prefab name/properties lookup tables for every tileset
+        # (see buildTilesetIndex)
+        self.tilesetIndex = {}
         
         # the list of layers (as trees) present in the map
         #NOTE!: there must one tileset per layer :!
         self.layers = []
-        self.floorLayer = []
-        # North, South, East, and West walls layers
-        self.wallLayerN = []
-        self.wallLayerS = []
-        self.wallLayerE = []
-        self.wallLayerW = []
-        
-        self.columnLayer = []
-        self.ceilingLayer = []
+        # flip/rotation flags of the layers which have any
+        # (layerName -> bytes, one value per cell, see FLAGS_TABLE)
+        self.layerFlags = {}
+        # decoded gid arrays of all the layers (layerName -> array),
+        # only filled by the streaming loader, see streamDungeonFromFile
+        self.layerGIDs = {}
+        # peak memory (in bytes) used while reading the map,
+        # only measured when asked for, see readDungeonFromFile
+        self.peakMemory = 0
+        # prefab names used by all the layer grids of the map
+        self.prefabSymbols = PrefabSymbols()
+        # gid -> symbol lookup tables (tilesetName -> dict)
+        self.gidSymbols = {}
+        # layers as compact grids of symbols (see layerGrid.py), one per
+        # kind of the layer registry: layerKind -> LayerGrid.
+        # floorGrid, wallGridN etc. are views of it and floorLayer,
+        # wallLayerN etc. are built from them on demand
+        self.grids = {}
+        # materialised lists of lists of prefab names (gridName -> matrix)
+        self.layerMatrices = {}
+        # rooms (i, j, rows, columns) of a generated dungeon, see
+        # proceduralDungeon.generateDungeon; empty for a map read from a file
+        self.rooms = []
+        # records the time/memory/counters of every stage of reading
+        # (see instrumentation.py), does nothing by default
+        self.profiler = NULL_PROFILER
         
         #"actual" size of the floor tile in meters
         self.floorTileSize = 3.67267
         self.ceilingHeight = 3.0
         
 
-    def readDungeonFromFile( self, fileName ):
+    floorGrid = layerGridProperty( "floor" )
+    # North, South, East, and West walls layers
+    wallGridN = layerGridProperty( "wallN" )
+    wallGridS = layerGridProperty( "wallS" )
+    wallGridE = layerGridProperty( "wallE" )
+    wallGridW = layerGridProperty( "wallW" )
+    columnGrid = layerGridProperty( "column" )
+    ceilingGrid = layerGridProperty( "ceiling" )
+
+    floorLayer = layerMatrixProperty( "floorGrid" )
+    wallLayerN = layerMatrixProperty( "wallGridN" )
+    wallLayerS = layerMatrixProperty( "wallGridS" )
+    wallLayerE = layerMatrixProperty( "wallGridE" )
+    wallLayerW = layerMatrixProperty( "wallGridW" )
+    columnLayer = layerMatrixProperty( "columnGrid" )
+    ceilingLayer = layerMatrixProperty( "ceilingGrid" )
+
+    def readDungeonFromFile( self, fileName, streaming = False, traceMemory = False, cache = None, profiler = None ):
         '''Process XML tree, describing the structure of the dungeon
-        in the file and create arrays of models: floor, wall, ceiling etc'''
+        in the file and create arrays of models: floor, wall, ceiling etc.
+        With streaming = True the file is read in a single forward pass
+        without keeping the XML tree (see streamDungeonFromFile).
+        With traceMemory = True the peak memory used while reading is
+        stored in self.peakMemory.
+        With a cache (see levelCache.py) the grids are loaded from it when
+        the file did not change, and stored in it otherwise.
+        With a profiler (see instrumentation.py) every stage is recorded'''
+        if ( profiler is not None ):
+            self.profiler = profiler
+        with self.profiler.stage( "read" ):
+            self.readDungeon( fileName, streaming, traceMemory, cache )
+
+    def readDungeon( self, fileName, streaming, traceMemory, cache ):
+        '''See readDungeonFromFile'''
+        if ( cache is not None ):
+            with self.profiler.stage( "cacheLoad" ):
+                hit = cache.load( self, fileName )
+            self.profiler.count( "cacheHits" if hit else "cacheMisses" )
+            if ( hit ):
+                return
+        startedTracing = False
+        if ( traceMemory and not tracemalloc.is_tracing() ):
+            tracemalloc.start()
+            startedTracing = True
+        if ( traceMemory ):
+            tracemalloc.reset_peak()
+        try:
+            with self.profiler.stage( "parse" ):
+                if ( streaming ):
+                    self.streamDungeonFromFile( fileName )
+                else:
+                    self.parseDungeonFromFile( fileName )
+            self.resolveLayers()
+        finally:
+            if ( traceMemory ):
+                self.peakMemory = tracemalloc.get_traced_memory()[1]
+            if ( startedTracing ):
+                tracemalloc.stop()
+        if ( cache is not None ):
+            with self.profiler.stage( "cacheStore" ):
+                cache.store( self, fileName )
+    
+    def parseDungeonFromFile( self, fileName ):
+        '''Reads the whole XML tree of the map and keeps it'''
         self.mapFileName = fileName
         self.mapTree = et.parse(self.mapFileName)
         self.root = self.mapTree.getroot()
@@ -94,70 +231,171 @@ class DungeonFileReader():
         self.mapHeight = int( self.root.get('height') )
         self.tilesets = self.getNodes( self.root, "tileset" )
         self.layers = self.getNodes( self.root, "layer" )
-        
-        # processing floor layer
-        #========================= FLOOR ==============================================================
-        self.floorLayer = self.readLayer( self.layers, "floorTiles" )
-        #TODO: Incorporade listToMatrix into the readLayer?
-        self.floorLayer = self.listToMatrix( self.floorLayer, self.mapWidth )
-        # Converting floor layer from matrix of id's
-        # into matrices of prefab/model names
-        firstID = self.getFirstGID( self.root, 'floorTiles' )
-        for i in range( 0, self.mapWidth ):
-            for j in range( 0, self.mapHeight ):
-                self.floorLayer[i][j] = self.getPrefabName( self.tilesets, "floorTiles", self.floorLayer[i][j] - firstID )
-        #========================= END OF FLOOR =====================================================
-        
-        # processing wall layer
-        #========================== WALLS ===========================================================
-        # reading North, South, East, and West walls layers
-        self.wallLayerN = self.readLayer( self.layers, "wallTilesN" )
-        self.wallLayerN = self.listToMatrix( self.wallLayerN, self.mapWidth )
-        
-        self.wallLayerS = self.readLayer( self.layers, "wallTilesS" )
-        self.wallLayerS = self.listToMatrix( self.wallLayerS, self.mapWidth )
-        
-        self.wallLayerE = self.readLayer( self.layers, "wallTilesE" )
-        self.wallLayerE = self.listToMatrix( self.wallLayerE, self.mapWidth )
-        
-        self.wallLayerW = self.readLayer( self.layers, "wallTilesW" )
-        self.wallLayerW = self.listToMatrix( self.wallLayerW, self.mapWidth )        
-        
-        # Converting wall layers from matrix of id's
-        # into matrices of prefab/model names
-        # ID of the first tile from the wallTiles tileset
-        firstID = self.getFirstGID( self.root, 'wallTiles' )
-        for i in range( 0, self.mapWidth ):
-            for j in range( 0, self.mapHeight ):
-                self.wallLayerN[i][j] = self.getPrefabName( self.tilesets, "wallTiles", self.wallLayerN[i][j] - firstID )
-                self.wallLayerS[i][j] = self.getPrefabName( self.tilesets, "wallTiles", self.wallLayerS[i][j] - firstID )
-                self.wallLayerE[i][j] = self.getPrefabName( self.tilesets, "wallTiles", self.wallLayerE[i][j] - firstID )
-                self.wallLayerW[i][j] = self.getPrefabName( self.tilesets, "wallTiles", self.wallLayerW[i][j] - firstID )        
-        #============================== END OF WALLS ================================================
-        
-        #processing column layer
-        #=============================== COLUMNS ====================================================
-        self.columnLayer = self.readLayer( self.layers, "columns" )
-        self.columnLayer = self.listToMatrix( self.columnLayer, self.mapWidth )
-        # Converting column layer from matrix of id's
-        # into matrices of prefab/model names
-        firstID = self.getFirstGID( self.root, 'columnTiles' )
-        for i in range( 0, self.mapWidth ):
-            for j in range( 0, self.mapHeight ):
-                self.columnLayer[i][j] = self.getPrefabName( self.tilesets, "columnTiles", self.columnLayer[i][j] - firstID )                
-        #=============================== END OF COLUMNS ==============================================
-        
-        # processing ceiling layer
-        #================================ CEILING =========================================================
-        self.ceilingLayer = self.readLayer( self.layers, "ceilingTiles" )
-        self.ceilingLayer = self.listToMatrix( self.ceilingLayer, self.mapWidth )
-        # Converting ceiling layer from matrix of id's
-        # into matrices of prefab names        
-        firstID = self.getFirstGID( self.root, 'ceilingTiles' )
-        for i in range( 0, self.mapWidth ):
-            for j in range( 0, self.mapHeight ):
-                self.ceilingLayer[i][j] = self.getPrefabName( self.tilesets, "ceilingTiles", self.ceilingLayer[i][j] - firstID )      
-        #=============================== END OF CEILING ===================================================
+        self.layerFlags = {}
+        self.layerGIDs = {}
+        # index of all tilesets, built once and shared by all the layers
+        self.tilesetIndex = self.buildTilesetIndex( self.tilesets )
+    
+    def streamDungeonFromFile( self, fileName ):
+        '''Reads tilesets and layers in one forward pass over the file,
+        clearing every element as soon as it is consumed. Only the
+        tileset index and the decoded gid arrays (self.layerGIDs) of the
+        layers of the registry (see layerRegistry.py) are kept'''
+        self.mapFileName = fileName
+        self.mapTree = 0
+        self.root = 0
+        self.tilesets = []
+        self.layers = []
+        self.layerFlags = {}
+        self.layerGIDs = {}
+        self.tilesetIndex = {}
+        root = None
+        data = None
+        gids = None
+        specs = layerNameIndex()
+        # kinds of the layers already read: as the DOM loader does, only
+        # the first layer of every kind is read
+        readKinds = set()
+        # name of the layer being read, None when it is skipped
+        layerName = None
+        # path of the tags currently open, e.g. ["map", "layer", "data"]
+        path = []
+        for event, elem in et.iterparse( fileName, events = ("start", "end") ):
+            if ( event == "start" ):
+                path.append( elem.tag )
+                if ( elem.tag == "map" and len(path) == 1 ):
+                    root = elem
+                    self.mapWidth = int( elem.get('width') )
+                    self.mapHeight = int( elem.get('height') )
+                elif ( elem.tag == "layer" and len(path) == 2 ):
+                    spec = specs.get( elem.get('name') )
+                    layerName = None
+                    if ( spec is not None and spec.kind not in readKinds ):
+                        layerName = elem.get('name')
+                        readKinds.add( spec.kind )
+                elif ( elem.tag == "data" and len(path) > 1 and path[-2] == "layer" ):
+                    data = elem
+                    gids = array( GID_TYPECODE ) if layerName is not None else None
+                continue
+            path.pop()
+            if ( data is not None and elem.tag == "tile" and len(path) == 3 ):
+                # plain XML layer: one element per cell
+                if ( gids is not None ):
+                    gids.append( int(elem.get('gid', 0)) )
+                if ( len(data) > 4096 ):
+                    del data[:]
+            elif ( elem is data ):
+                if ( layerName is not None and data.get('encoding') is not None ):
+                    gids = self.decodeLayerData( data )
+                data = None
+            elif ( elem.tag == "tileset" and len(path) == 1 ):
+                self.tilesetIndex.update( self.buildTilesetIndex( [elem] ) )
+                del root[:]
+            elif ( elem.tag == "layer" and len(path) == 1 and layerName is not None ):
+                if ( gids is None ):
+                    gids = array( GID_TYPECODE )
+                layer, flags = self.splitGIDFlags( gids )
+                self.layerGIDs[layerName] = layer
+                if ( flags is not None ):
+                    self.layerFlags[layerName] = flags
+                gids = None
+                del root[:]
+            elif ( len(path) == 1 ):
+                del root[:]
+    
+    def getLayer( self, layerName ):
+        '''Returns an array of gid's of a layer, either from the ones
+        decoded by the streaming loader or from the XML tree'''
+        if ( layerName in self.layerGIDs ):
+            return self.layerGIDs[layerName]
+        return self.readLayer( self.layers, layerName )
+    
+    def resolveLayers( self ):
+        '''Converts the gid's of all the layers of the registry (see
+        layerRegistry.py) into grids of prefab symbols: floor, walls,
+        columns, ceiling, decorations. Layers missing from the map
+        get empty grids'''
+        self.prefabSymbols = PrefabSymbols()
+        self.gidSymbols = {}
+        self.layerMatrices = {}
+        self.grids = {}
+        profiler = self.profiler
+        decoded = self.decodeLayers()
+        empty = array( GID_TYPECODE )
+        for spec in LAYER_REGISTRY:
+            with profiler.stage( "resolve", spec.kind ):
+                grid = self.resolveLayerGrid( decoded.get( spec.kind, empty ), spec.tilesetName )
+            self.grids[spec.kind] = grid
+            if ( profiler.enabled ):
+                profiler.count( "cells", len(grid), spec.kind )
+                profiler.count( "occupiedCells", grid.occupiedCount(), spec.kind )
+
+    def decodeLayers( self ):
+        '''Decodes the layers of the registry in a single pass over the
+        layers of the map, skipping all the others.
+        Returns a dictionary layerKind -> array of gid's'''
+        specs = layerNameIndex()
+        # layerKind -> name of the layer read for it
+        layerNames = {}
+        decoded = {}
+        if ( self.layerGIDs ):
+            # already decoded by the streaming loader
+            for layerName, gids in self.layerGIDs.items():
+                spec = specs.get( layerName )
+                if ( spec is not None and spec.kind not in decoded ):
+                    decoded[spec.kind] = gids
+            return decoded
+        for layer in self.layers:
+            layerName = layer.get('name')
+            spec = specs.get( layerName )
+            # only the first layer of every kind is read (see LayerSpec)
+            if ( spec is None or spec.kind in layerNames ):
+                continue
+            layerNames[spec.kind] = layerName
+            with self.profiler.stage( "decode", spec.kind ):
+                gids = decoded.setdefault( spec.kind, array( GID_TYPECODE ) )
+                for data in layer:
+                    if ( data.tag == "data" ):
+                        gids.extend( self.decodeLayerData( data ) )
+        for layerKind, gids in decoded.items():
+            decoded[layerKind], flags = self.splitGIDFlags( gids )
+            if ( flags is not None ):
+                self.layerFlags[layerNames[layerKind]] = flags
+        return decoded
+
+    def resolveLayerGrid( self, layer, tilesetName ):
+        '''Converts a whole layer (array of gid's) into a LayerGrid
+        of prefab symbols, sharing self.prefabSymbols'''
+        if ( tilesetName not in self.gidSymbols ):
+            prefabs = self.tilesetIndex.get( tilesetName, {} ).get( "prefabs", {} )
+            self.gidSymbols[tilesetName] = dict( (gid, self.prefabSymbols.add( name ))
+                                                 for gid, name in prefabs.items() )
+        gidSymbols = self.gidSymbols[tilesetName]
+        height = len(layer)//self.mapWidth if self.mapWidth else 0
+        size = height*self.mapWidth
+        typecode = LayerGrid.typecodeFor( len(self.prefabSymbols) )
+        if ( not gidSymbols or layer.tobytes().count( 0 ) == len(layer)*layer.itemsize ):
+            # empty (e.g. decoration) layers are not looked up cell by cell
+            cells = array( typecode, bytes( size*array( typecode ).itemsize ) )
+        else:
+            cells = array( typecode, map( gidSymbols.get, layer[:size], repeat(0) ) )
+        return LayerGrid( self.mapWidth, height, self.prefabSymbols, cells )
+
+    def getGrids( self ):
+        '''Returns a dictionary of all the layer grids of the map'''
+        return dict( (spec.kind, self.grids.get( spec.kind )) for spec in LAYER_REGISTRY )
+
+    def setGrids( self, grids, prefabSymbols ):
+        '''Replaces the layer grids (layerKind -> LayerGrid) of the map,
+        all of them sharing the given PrefabSymbols'''
+        self.prefabSymbols = prefabSymbols
+        self.layerMatrices = {}
+        self.grids = dict( grids )
+
+    def gridChanged( self, gridName ):
+        '''Must be called after the cells of a grid (e.g. "wallGridN") were
+        changed, so that its list of lists view is rebuilt'''
+        self.layerMatrices.pop( gridName, None )
 
     
     def listToMatrix( self, inList, inWidth ):
@@ -169,16 +407,72 @@ class DungeonFileReader():
         return outList
         
     def readLayer( self, layers, layerName ):
-        '''Extracts a list, representing a map of 
-        a particular layer, from a list of layers' trees '''
-        layer = []
+        '''Extracts an array of gid's, representing a map of 
+        a particular layer, from a list of layers' trees.
+        Flip/rotation flags are stripped from the gid's and kept
+        in self.layerFlags '''
+        layer = array( GID_TYPECODE )
         for i in layers:
             if (i.get('name') == layerName):
                 for j in i:
                     if (j.tag == "data"):
-                        for k in j:
-                            layer.append( int(k.get('gid')) ) # see NOTE in the head of this file
+                        layer.extend( self.decodeLayerData( j ) )
+                # only the first layer of that name is read
+                break
+        layer, flags = self.splitGIDFlags( layer )
+        if ( flags is not None ):
+            self.layerFlags[layerName] = flags
         return layer
+    
+    def decodeLayerData( self, data ):
+        '''Decodes the "data" node of a layer in any of the Tiled
+        formats (XML, csv, base64, base64+zlib, base64+gzip) into
+        an array of raw gid's (flags are not stripped)'''
+        encoding = data.get('encoding')
+        compression = data.get('compression')
+        gids = array( GID_TYPECODE )
+        if ( encoding is None ):
+            # see NOTE in the head of this file
+            gids.extend( int(k.get('gid', 0)) for k in data if k.tag == "tile" )
+        elif ( encoding == "csv" ):
+            text = data.text.strip()
+            if ( text ):
+                gids.extend( map( int, text.split(',') ) )
+        elif ( encoding == "base64" ):
+            raw = base64.b64decode( data.text.strip() )
+            if ( compression == "zlib" ):
+                raw = zlib.decompress( raw )
+            elif ( compression == "gzip" ):
+                raw = gzip.decompress( raw )
+            elif ( compression is not None ):
+                raise ValueError( "Unsupported layer compression: %s" % compression )
+            gids.frombytes( raw )
+            if ( sys.byteorder == "big" ):
+                gids.byteswap()
+        else:
+            raise ValueError( "Unsupported layer encoding: %s" % encoding )
+        return gids
+    
+    def splitGIDFlags( self, gids ):
+        '''Clears the flip/rotation flags of an array of gid's.
+        Returns the cleaned array and the flags as bytes
+        (one per cell, None if no cell has any flags set)'''
+        if ( sys.byteorder == "big" ):
+            gids.byteswap()
+        raw = bytearray( gids.tobytes() )
+        if ( sys.byteorder == "big" ):
+            gids.byteswap()
+        # flags live in the highest byte of every little-endian gid
+        highest = raw[3::4]
+        flags = bytes( highest.translate( FLAGS_TABLE ) )
+        if ( not flags.strip(b'\x00') ):
+            return gids, None
+        raw[3::4] = highest.translate( CLEAR_FLAGS_TABLE )
+        cleaned = array( GID_TYPECODE )
+        cleaned.frombytes( raw )
+        if ( sys.byteorder == "big" ):
+            cleaned.byteswap()
+        return cleaned, flags
         
     def getNodes( self, root, nodeName ):
         '''Returns a list of trees(children of root)
@@ -189,19 +483,58 @@ class DungeonFileReader():
                 nodes.append(child)
         return nodes
     
+    def buildTilesetIndex( self, tilesets ):
+        '''Walks every tileset once and returns a dictionary
+        tilesetName -> { "firstgid": int,
+                         "properties": { tileID: { propertyName: value } },
+                         "prefabs": { gid: prefabName } }
+        so that resolving a map cell is a single dictionary lookup'''
+        index = {}
+        for t in tilesets:
+            firstGID = int( t.get("firstgid") )
+            properties = {}
+            prefabs = {}
+            for i in t.findall("tile"):
+                tileID = int( i.get("id") )
+                tileProperties = {}
+                for j in i.findall("properties"):
+                    for k in j.findall("property"):
+                        tileProperties[k.get("name")] = k.get("value")
+                properties[tileID] = tileProperties
+                if ( "prefabName" in tileProperties ):
+                    prefabs[tileID + firstGID] = tileProperties["prefabName"]
+            index[t.get("name")] = { "firstgid": firstGID,
+                                     "properties": properties,
+                                     "prefabs": prefabs }
+        return index
+    
+    def resolveLayer( self, layer, tilesetName ):
+        '''Converts a whole layer (list of gid's) into a list of
+        prefab names using the tileset index. Cells without a tile
+        or without a prefab become "None"'''
+        if ( tilesetName not in self.tilesetIndex ):
+            return ["None"]*len(layer)
+        prefabs = self.tilesetIndex[tilesetName]["prefabs"]
+        return list( map( prefabs.get, layer, repeat("None") ) )
+    
     def getPrefabName( self, tilesets, layerName, tileID ):
         '''Returs a string-name of the 3D object, corresponding to
         a given tile ID. This object is used in constructing a level'''
-        prefabName = "None"
-        for t in tilesets:
-            if ( t.get("name") == layerName ):
-                for i in t.findall("tile"):
-                    if ( int(i.get("id")) == tileID ):
-                        for j in i.findall("properties"):
-                            for k in j.findall("property"):
-                                if ( k.get("name") == "prefabName" ):
-                                    prefabName = k.get("value")
-        return prefabName
+        index = self.tilesetIndex
+        if ( tilesets is not self.tilesets or not index ):
+            index = self.buildTilesetIndex( tilesets )
+        if ( layerName not in index ):
+            return "None"
+        tileset = index[layerName]
+        return tileset["prefabs"].get( tileID + tileset["firstgid"], "None" )
+    
+    def getTileProperties( self, tilesetName, gid ):
+        '''Returns a dictionary of all the properties of the tile
+        with a given gid (empty if the tile has no properties)'''
+        if ( tilesetName not in self.tilesetIndex ):
+            return {}
+        tileset = self.tilesetIndex[tilesetName]
+        return tileset["properties"].get( gid - tileset["firstgid"], {} )
     
     def getFirstGID( self, root, tilesetName ):
         '''Returns id of the first tile in the tileset.'''
@@ -0,0 +1,170 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import struct
+
+#====================================================
+# Index of the prefab models of the dungeon sets:
+# Dungeons/<set>/<kind>/models/*.blend, each holding
+# one or more prefab objects (e.g. wall01.blend holds
+# wallTile01). Object names are read straight from the
+# .blend files (no Blender needed) and kept in an index
+# file in the user's cache directory (not in the sets,
+# which are under version control), only the files
+# whose mtime or size changed are read again.
+# The generator uses it to link just the prefabs a
+# level references (see dungeonGenerator.py)
+#====================================================
+
+ASSET_INDEX_NAME = "prefabIndex.json"
+ASSET_INDEX_VERSION = 1
+
+BLEND_MAGIC = b'BLENDER'
+GZIP_MAGIC = b'\x1f\x8b'
+# ID code of the object blocks of a .blend file
+OBJECT_BLOCK = b'OB\x00\x00'
+END_BLOCK = b'ENDB'
+
+
+def indexFileNameFor( dungeonsDir ):
+    '''Default index file of a dungeons directory: one per directory, in
+    $XDG_CACHE_HOME (~/.cache by default)/dungeonGenerator'''
+    cacheDir = os.environ.get( "XDG_CACHE_HOME" ) or os.path.join( os.path.expanduser( "~" ), ".cache" )
+    key = hashlib.sha1( os.path.abspath( dungeonsDir ).encode( "utf-8" ) ).hexdigest()[:16]
+    return os.path.join( cacheDir, "dungeonGenerator", "%s-%s" % ( key, ASSET_INDEX_NAME ) )
+
+
+def blendObjectNames( fileName ):
+    '''Returns the names of all the objects of a .blend file by walking
+    its file blocks, or None if the file can not be read this way
+    (e.g. zstd-compressed files of Blender 3.0+)'''
+    with open( fileName, "rb" ) as blend:
+        magic = blend.read( 2 )
+    opener = gzip.open if magic == GZIP_MAGIC else open
+    names = []
+    with opener( fileName, "rb" ) as blend:
+        header = blend.read( 12 )
+        if ( len(header) < 12 or header[:7] != BLEND_MAGIC ):
+            return None
+        pointerSize = 8 if header[7:8] == b'-' else 4
+        endian = "<" if header[8:9] == b'v' else ">"
+        blockHeader = struct.Struct( endian + "4sI%dxII" % pointerSize )
+        while True:
+            data = blend.read( blockHeader.size )
+            if ( len(data) < blockHeader.size ):
+                break
+            code, size, sdnaIndex, count = blockHeader.unpack( data )
+            if ( code == END_BLOCK ):
+                break
+            if ( code != OBJECT_BLOCK ):
+                blend.seek( size, 1 )
+                continue
+            body = blend.read( size )
+            # the block starts with the ID: next, prev, newid, lib (and
+            # asset data since Blender 2.93) pointers, then the name
+            # prefixed by its ID code
+            for offset in ( 4*pointerSize, 5*pointerSize ):
+                if ( body[offset:offset + 2] == b'OB' ):
+                    names.append( body[offset + 2:offset + 66].split( b'\x00' )[0].decode( "utf-8", "replace" ) )
+                    break
+    return names
+
+
+class PrefabLibrary():
+    '''Prefab name -> .blend file index of the models of the dungeon sets.
+    The index is cached in indexFileName (see indexFileNameFor by default)
+    and refreshed for the files whose mtime or size changed.
+    listObjects(fileName) returns the object names of a .blend file,
+    or None when it can not read it (the file is then left out)'''
+    def __init__( self, dungeonsDir, dungeonSet = "*", indexFileName = None, listObjects = blendObjectNames ):
+        self.dungeonsDir = dungeonsDir
+        self.dungeonSet = dungeonSet
+        self.indexFileName = indexFileName or indexFileNameFor( dungeonsDir )
+        self.listObjects = listObjects
+        # prefab name -> absolute path of its .blend file
+        self.prefabs = {}
+        # relative path of a .blend file -> { "mtime", "size", "objects" }
+        self.files = {}
+        self.filesRead = 0
+
+    def modelFiles( self ):
+        '''All the .blend models of the dungeon set(s), sorted'''
+        pattern = os.path.join( self.dungeonsDir, self.dungeonSet, "*", "models", "*.blend" )
+        return sorted( glob.glob( pattern ) )
+
+    def loadIndex( self ):
+        try:
+            with open( self.indexFileName ) as indexFile:
+                index = json.load( indexFile )
+        except ( OSError, ValueError ):
+            return {}
+        if ( index.get( "version" ) != ASSET_INDEX_VERSION ):
+            return {}
+        return index.get( "files", {} )
+
+    def saveIndex( self ):
+        temporaryName = self.indexFileName + ".tmp%d" % os.getpid()
+        try:
+            os.makedirs( os.path.dirname( os.path.abspath( self.indexFileName ) ), exist_ok = True )
+            with open( temporaryName, "w" ) as indexFile:
+                json.dump( { "version": ASSET_INDEX_VERSION, "files": self.files }, indexFile, indent = 1 )
+            os.replace( temporaryName, self.indexFileName )
+        except OSError:
+            # a read-only library still works, it is just indexed every time
+            if ( os.path.exists( temporaryName ) ):
+                os.remove( temporaryName )
+
+    def scan( self ):
+        '''Builds the index, reading only the new or changed .blend files.
+        If a prefab is in several files the first one (sorted) wins.
+        Returns the dictionary prefabName -> .blend file'''
+        cached = self.loadIndex()
+        files = {}
+        self.filesRead = 0
+        for fileName in self.modelFiles():
+            key = os.path.relpath( fileName, self.dungeonsDir ).replace( os.sep, "/" )
+            stat = os.stat( fileName )
+            entry = cached.get( key )
+            if ( entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size ):
+                objects = self.listObjects( fileName )
+                self.filesRead += 1
+                if ( objects is None ):
+                    continue
+                entry = { "mtime": stat.st_mtime, "size": stat.st_size, "objects": objects }
+            files[key] = entry
+        self.files = files
+        if ( files != cached ):
+            self.saveIndex()
+        self.prefabs = {}
+        for key in sorted( files ):
+            for name in files[key]["objects"]:
+                self.prefabs.setdefault( name, os.path.join( self.dungeonsDir, *key.split( "/" ) ) )
+        return self.prefabs
+
+    def groupByFile( self, prefabNames ):
+        '''Splits prefab names by their .blend files. Returns a dictionary
+        blendFile -> sorted list of prefab names and the list of the
+        names not found in any file'''
+        if ( not self.prefabs ):
+            self.scan()
+        byFile = {}
+        missing = []
+        for name in sorted( set( prefabNames ) ):
+            blendFile = self.prefabs.get( name )
+            if ( blendFile is None ):
+                missing.append( name )
+            else:
+                byFile.setdefault( blendFile, [] ).append( name )
+        return byFile, missing
+
+
+def levelPrefabs( reader ):
+    '''Names of the prefabs a dungeon read by DungeonFileReader actually
+    uses (in any of its layers)'''
+    names = set()
+    for grid in reader.getGrids().values():
+        if ( grid is not None ):
+            names.update( grid.counts() )
+    return sorted( names )
@@ -0,0 +1,95 @@
+import random
+from array import array
+
+from layerGrid import FULL_BYTE_TABLE, LayerGrid, maskAnd, maskNot, shiftMask
+from tilePlacement import WALL_FACING
+
+#====================================================
+# Automatic walls: the four wall layers are derived
+# from the floor layer instead of being painted by
+# hand. A wall of a given kind lies on every cell
+# without floor whose neighbour in the direction the
+# wall faces (see WALL_FACING in tilePlacement.py) has
+# floor, exactly like the hand painted levels.
+# Everything is done on whole masks (one byte per cell)
+# so big maps are walled in a fraction of a second.
+# NOTE: floor cells on the border of the map get no
+# wall on that side, there is no cell to put it into.
+# Walls painted on floor cells, e.g. the four walls of a
+# free-standing pillar in a room (two of them in the
+# bundled level), can not be derived and are dropped
+#====================================================
+
+WALL_TILESET = "wallTiles"
+DEFAULT_WALL_PREFAB = "wallTile01"
+
+
+def defaultWallPrefab( reader ):
+    '''First prefab (lowest gid) of the wall tileset of the map'''
+    prefabs = reader.tilesetIndex.get( WALL_TILESET, {} ).get( "prefabs", {} )
+    if ( not prefabs ):
+        return DEFAULT_WALL_PREFAB
+    return prefabs[min( prefabs )]
+
+
+def wallMask( floorMask, width, height, wallKind ):
+    '''Mask of the cells which get a wall of a given kind'''
+    di, dj = WALL_FACING[wallKind]
+    return maskAnd( maskNot( floorMask ), shiftMask( floorMask, width, height, di, dj ) )
+
+
+def variantTable( symbols, weights ):
+    '''Translation table of random bytes to symbols, each symbol getting a
+    share of the 256 byte values proportional to its weight'''
+    total = float( sum( weights ) )
+    table = bytearray()
+    cumulative = 0.0
+    for symbol, weight in zip( symbols, weights ):
+        cumulative += weight
+        table.extend( bytes( [symbol] )*( int( round( 256*cumulative/total ) ) - len(table) ) )
+    return bytes( table[:256] )
+
+
+def fillMask( mask, symbols, weights, rng ):
+    '''Cells of mask holding the chosen symbols (one byte per cell), the
+    other cells 0. With several symbols every cell draws one at random'''
+    size = len(mask)
+    if ( len(symbols) == 1 ):
+        return mask.translate( bytes( [0] + [symbols[0]]*255 ) )
+    draws = rng.getrandbits( 8*size ).to_bytes( size, "little" ).translate( variantTable( symbols, weights ) )
+    keep = int.from_bytes( mask.translate( FULL_BYTE_TABLE ), "little" )
+    return ( int.from_bytes( draws, "little" ) & keep ).to_bytes( size, "little" )
+
+
+def deriveWalls( reader, rules = None, seed = 0 ):
+    '''Replaces the four wall layers of a dungeon read by DungeonFileReader
+    by walls derived from its floor layer.
+    rules maps a wall kind to a list of (prefabName, weight): every wall
+    cell draws one of them (with the given seed), kinds without a rule
+    use the first prefab of the wall tileset of the map.
+    Returns a dictionary wallKind -> number of walls'''
+    rules = rules or {}
+    floorGrid = reader.floorGrid
+    width = reader.mapWidth
+    height = floorGrid.height if floorGrid is not None else 0
+    floorMask = floorGrid.nonEmptyMask() if floorGrid is not None else bytearray()
+    symbols = reader.prefabSymbols
+    default = defaultWallPrefab( reader )
+    rng = random.Random( seed )
+    counts = {}
+    for wallKind in sorted( WALL_FACING ):
+        variants = rules.get( wallKind ) or [ ( default, 1 ) ]
+        kindSymbols = [ symbols.add( prefabName ) for prefabName, weight in variants ]
+        mask = wallMask( floorMask, width, height, wallKind )
+        if ( max( kindSymbols ) < 256 ):
+            cells = array( 'B', fillMask( bytes( mask ), kindSymbols, [ weight for prefabName, weight in variants ], rng ) )
+        else:
+            # more than 255 prefabs in the map: one symbol per cell, slowly
+            choices = rng.choices( kindSymbols, [ weight for prefabName, weight in variants ], k = len(mask) )
+            cells = array( 'H', ( s if m else 0 for s, m in zip( choices, mask ) ) )
+        if ( LayerGrid.typecodeFor( len(symbols) ) == 'H' and cells.typecode == 'B' ):
+            cells = array( 'H', cells )
+        reader.grids[wallKind] = LayerGrid( width, height, symbols, cells )
+        reader.gridChanged( "wallGrid" + wallKind[-1] )
+        counts[wallKind] = len(mask) - mask.count( 0 )
+    return counts
@@ -0,0 +1,242 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ReadDungeonClass import DungeonFileReader
+from gltfExporter import exportDungeon
+from levelCache import LevelCache
+from levelRegions import regionFileName, writeRegionFile
+from lightBaker import bakeLights, lightFileName
+from navigation import buildNavGraph, navFileName
+from pvsBuilder import buildPVS, pvsFileName
+from wallCulling import cullHiddenWalls
+
+#====================================================
+# Batch conversion of many TMX levels to glTF, spread
+# over all the cores with a process pool. Writes a
+# manifest (manifest.json) with the timings, the
+# options and a summary of every level (with the list
+# of its outputs) into the output directory. A level is
+# only skipped when the last manifest was written with
+# the same options and all its outputs are newer
+#====================================================
+
+MANIFEST_NAME = "manifest.json"
+# options which do not change the outputs
+NEUTRAL_OPTIONS = ( "streaming", "cacheDir" )
+
+
+def collectLevels( patterns ):
+    '''Returns a sorted list of TMX files from a list of directories
+    (searched recursively) and/or glob patterns'''
+    levels = set()
+    for pattern in patterns:
+        if ( os.path.isdir( pattern ) ):
+            levels.update( glob.glob( os.path.join( pattern, "**", "*.tmx" ), recursive = True ) )
+        else:
+            levels.update( glob.glob( pattern, recursive = True ) )
+    return sorted( os.path.abspath( level ) for level in levels )
+
+
+def outputNames( levels, outputDir, extension ):
+    '''Output file of every level, keeping the directory structure
+    of the levels below their common directory'''
+    if ( not levels ):
+        return []
+    common = os.path.commonpath( [ os.path.dirname( level ) for level in levels ] )
+    return [ os.path.join( outputDir, os.path.splitext( os.path.relpath( level, common ) )[0] + extension )
+             for level in levels ]
+
+
+def expectedOutputs( output, options ):
+    '''All the files written for a level converted to output with
+    these options'''
+    outputs = [ output ]
+    if ( os.path.splitext( output )[1] == ".gltf" ):
+        outputs.append( os.path.splitext( output )[0] + ".bin" )
+    if ( options["nav"] ):
+        outputs.append( navFileName( output ) )
+    if ( options["lights"] ):
+        outputs.append( lightFileName( output ) )
+    if ( options["pvs"] ):
+        outputs.append( pvsFileName( output ) )
+    if ( options["regions"] ):
+        outputs.append( regionFileName( output ) )
+    return outputs
+
+
+def outputOptions( options ):
+    '''The options the outputs depend on, as kept in the manifest'''
+    return dict( ( name, value ) for name, value in options.items() if name not in NEUTRAL_OPTIONS )
+
+
+def readManifest( outputDir ):
+    '''The manifest of the last conversion into outputDir, None if
+    there is none (or it can not be read)'''
+    try:
+        with open( os.path.join( outputDir, MANIFEST_NAME ) ) as manifestFile:
+            return json.load( manifestFile )
+    except ( OSError, ValueError ):
+        return None
+
+
+def isUpToDate( level, outputs, options, previous ):
+    '''True when the last conversion (previous: its manifest) used the
+    same options and did not fail on the level, and all the outputs exist
+    and are newer than the level'''
+    if ( previous is None or previous.get( "options" ) != outputOptions( options ) ):
+        return False
+    for summary in previous.get( "levels", [] ):
+        if ( summary["level"] == level and summary["status"] == "failed" ):
+            return False
+    levelTime = os.path.getmtime( level )
+    return all( os.path.isfile( output ) and os.path.getmtime( output ) >= levelTime for output in outputs )
+
+
+def convertLevel( job ):
+    '''Parses, resolves, culls and exports a single level (runs in a
+    worker process). Returns a summary dictionary of the level'''
+    level, output, options = job
+    summary = { "level": level, "output": output, "outputs": expectedOutputs( output, options ),
+                "status": "converted", "seconds": {} }
+    seconds = summary["seconds"]
+    start = time.perf_counter()
+    try:
+        reader = DungeonFileReader()
+        cache = LevelCache( options["cacheDir"] ) if options["cacheDir"] else None
+        reader.readDungeonFromFile( level, streaming = options["streaming"], cache = cache )
+        seconds["read"] = time.perf_counter() - start
+
+        stageStart = time.perf_counter()
+        if ( options["cull"] ):
+            summary["wallsCulled"] = sum( cullHiddenWalls( reader ).values() )
+        seconds["cull"] = time.perf_counter() - stageStart
+
+        stageStart = time.perf_counter()
+        outputDir = os.path.dirname( output )
+        if ( outputDir and not os.path.isdir( outputDir ) ):
+            os.makedirs( outputDir, exist_ok = True )
+        stats = exportDungeon( reader, output, options["prefabDir"], mergeQuads = options["mergeQuads"] )
+        seconds["export"] = time.perf_counter() - stageStart
+
+        graph = None
+        if ( options["nav"] ):
+            stageStart = time.perf_counter()
+            graph = buildNavGraph( reader )
+            graph.save( navFileName( output ) )
+            seconds["navigation"] = time.perf_counter() - stageStart
+
+        if ( options["lights"] ):
+            stageStart = time.perf_counter()
+            bakeLights( reader, graph = graph ).save( lightFileName( output ) )
+            seconds["lights"] = time.perf_counter() - stageStart
+
+        if ( options["pvs"] ):
+            stageStart = time.perf_counter()
+            buildPVS( reader, graph = graph ).save( pvsFileName( output ) )
+            seconds["pvs"] = time.perf_counter() - stageStart
+
+        if ( options["regions"] ):
+            stageStart = time.perf_counter()
+            writeRegionFile( reader, regionFileName( output ) )
+            seconds["regions"] = time.perf_counter() - stageStart
+
+        summary["width"] = reader.mapWidth
+        summary["height"] = reader.mapHeight
+        summary["tiles"] = stats["tiles"]
+        summary["quads"] = stats["quads"]
+        summary["prefabs"] = stats["prefabs"]
+    except Exception as error:
+        summary["status"] = "failed"
+        summary["error"] = "%s: %s" % ( type(error).__name__, error )
+    seconds["total"] = time.perf_counter() - start
+    return summary
+
+
+def convertAll( levels, outputDir, workers = None, force = False, extension = ".glb",
+                streaming = True, cull = True, prefabDir = None, nav = False, regions = False, mergeQuads = False,
+                lights = False, pvs = False, cacheDir = None ):
+    '''Converts all the levels with a pool of worker processes (one per
+    core by default). Levels whose outputs are newer are skipped unless
+    force is set or the options changed. With nav the navigation tables (see navigation.py) and
+    with regions the region file (see levelRegions.py) are written next
+    to every output, with lights the baked torch light (see lightBaker.py)
+    too, with pvs the potentially visible sets (see pvsBuilder.py),
+    mergeQuads merges the floor and ceiling tiles into big quads, with
+    cacheDir the parsed levels are kept in a LevelCache (see levelCache.py).
+    Returns the manifest (also written to outputDir)'''
+    start = time.perf_counter()
+    options = { "streaming": streaming, "cull": cull, "prefabDir": prefabDir, "nav": nav, "regions": regions,
+                "mergeQuads": mergeQuads, "lights": lights, "pvs": pvs, "cacheDir": cacheDir }
+    previous = readManifest( outputDir )
+    # a skipped level keeps the summary (timings, counts) of its conversion
+    previousSummaries = dict( ( summary["level"], summary ) for summary in ( previous or {} ).get( "levels", [] ) )
+    summaries = []
+    jobs = []
+    for level, output in zip( levels, outputNames( levels, outputDir, extension ) ):
+        outputs = expectedOutputs( output, options )
+        if ( not force and isUpToDate( level, outputs, options, previous ) ):
+            summary = dict( previousSummaries.get( level, {} ) )
+            summary.update( { "level": level, "output": output, "outputs": outputs, "status": "skipped" } )
+            summaries.append( summary )
+        else:
+            jobs.append( ( level, output, options ) )
+    # no more workers than levels to convert
+    workers = min( workers or os.cpu_count() or 1, len(jobs) )
+    if ( jobs ):
+        with ProcessPoolExecutor( max_workers = workers ) as pool:
+            # small levels are cheap, let every worker take a few at once
+            chunkSize = max( 1, len(jobs)//(workers*4) )
+            summaries.extend( pool.map( convertLevel, jobs, chunksize = chunkSize ) )
+    summaries.sort( key = lambda summary: summary["level"] )
+    manifest = { "options": outputOptions( options ),
+                 "workers": workers,
+                 "seconds": time.perf_counter() - start,
+                 "converted": sum( 1 for s in summaries if s["status"] == "converted" ),
+                 "skipped": sum( 1 for s in summaries if s["status"] == "skipped" ),
+                 "failed": sum( 1 for s in summaries if s["status"] == "failed" ),
+                 "levels": summaries }
+    if ( not os.path.isdir( outputDir ) ):
+        os.makedirs( outputDir )
+    with open( os.path.join( outputDir, MANIFEST_NAME ), "w" ) as manifestFile:
+        json.dump( manifest, manifestFile, indent = 1 )
+    return manifest
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Converts many Tiled (TMX) dungeons to glTF in parallel" )
+    parser.add_argument( "inputs", nargs = "+", help = "directories (searched recursively) or glob patterns of TMX files" )
+    parser.add_argument( "-o", "--output-dir", required = True, help = "directory for the converted levels and the manifest" )
+    parser.add_argument( "-j", "--jobs", type = int, default = None, help = "number of worker processes (default: all cores)" )
+    parser.add_argument( "-f", "--force", action = "store_true", help = "convert even the levels whose outputs are up to date" )
+    parser.add_argument( "--gltf", action = "store_true", help = "write .gltf + .bin instead of .glb" )
+    parser.add_argument( "--prefab-dir", help = "directory with <prefabName>.obj models of the prefabs" )
+    parser.add_argument( "--no-cull", action = "store_true", help = "keep the walls which can not be seen" )
+    parser.add_argument( "--merge-quads", action = "store_true", help = "merge the floor and ceiling tiles into big quads" )
+    parser.add_argument( "--nav", action = "store_true", help = "also write the navigation tables of every level (.nav)" )
+    parser.add_argument( "--lights", action = "store_true", help = "also bake the torch light of every level (.light.png)" )
+    parser.add_argument( "--pvs", action = "store_true", help = "also build the potentially visible sets of every level (.pvs)" )
+    parser.add_argument( "--regions", action = "store_true", help = "also write the region file of every level (.dmrg)" )
+    parser.add_argument( "--cache", help = "directory of the parsed level cache, shared by the workers" )
+    args = parser.parse_args( argv )
+
+    levels = collectLevels( args.inputs )
+    manifest = convertAll( levels, args.output_dir, args.jobs, args.force,
+                           ".gltf" if args.gltf else ".glb", cull = not args.no_cull,
+                           prefabDir = args.prefab_dir, nav = args.nav, regions = args.regions,
+                           mergeQuads = args.merge_quads, lights = args.lights,
+                           pvs = args.pvs, cacheDir = args.cache )
+    for summary in manifest["levels"]:
+        if ( summary["status"] == "failed" ):
+            print( "FAILED %s: %s" % ( summary["level"], summary["error"] ) )
+    print( "%d converted, %d skipped, %d failed in %.2f s with %d workers" %
+           ( manifest["converted"], manifest["skipped"], manifest["failed"], manifest["seconds"], manifest["workers"] ) )
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+
+from ReadDungeonClass import GID_TYPECODE, DungeonFileReader
+from layerRegistry import LAYER_REGISTRY
+from tilePlacement import dungeonTransforms
+from tmxSynth import ENCODINGS, writeSynthLevel
+from wallCulling import cullHiddenWalls
+
+#====================================================
+# Benchmarks of every stage of the pipeline on
+# synthetic levels (see tmxSynth.py) of growing size,
+# in every layer encoding. Results are written as JSON
+# and can be compared with the results of another run
+# to catch regressions
+#====================================================
+
+DEFAULT_SIZES = [ 40, 128, 512, 1024 ]
+# plain XML levels grow to gigabytes, they are skipped above this size
+DEFAULT_MAX_XML_SIZE = 1024
+
+
+def timeStage( function, repeats, setup = None ):
+    '''Runs function repeats times (after setup, which is not timed).
+    Returns the list of wall times'''
+    times = []
+    for k in range( repeats ):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function( argument )
+        times.append( time.perf_counter() - start )
+    return times
+
+
+def resolveAll( reader, layers ):
+    '''Resolves the decoded layers (layerKind -> gid's) of all the layers
+    of the registry, see DungeonFileReader.resolveLayers'''
+    reader.gidSymbols = {}
+    empty = array( GID_TYPECODE )
+    for spec in LAYER_REGISTRY:
+        reader.grids[spec.kind] = reader.resolveLayerGrid( layers.get( spec.kind, empty ), spec.tilesetName )
+
+
+def benchmarkLevel( fileName, repeats ):
+    '''Times every stage on a level. Returns a dictionary stage -> times'''
+    results = {}
+    reader = DungeonFileReader()
+    results["xmlParse"] = timeStage( lambda a: reader.parseDungeonFromFile( fileName ), repeats )
+    layers = {}
+    def decode( a ):
+        layers.clear()
+        layers.update( reader.decodeLayers() )
+    results["layerDecode"] = timeStage( decode, repeats )
+    results["prefabResolve"] = timeStage( lambda a: resolveAll( reader, layers ), repeats )
+    results["matrixBuild"] = timeStage( lambda a: [ g.toMatrix() for g in reader.getGrids().values() ], repeats )
+    results["placement"] = timeStage( lambda a: dungeonTransforms( reader ), repeats )
+    results["wallCull"] = timeStage( lambda a: cullHiddenWalls( reader ), repeats,
+                                     setup = lambda: resolveAll( reader, layers ) )
+    streamed = DungeonFileReader()
+    results["streamingRead"] = timeStage( lambda a: streamed.readDungeonFromFile( fileName, streaming = True ), repeats )
+    results["domRead"] = timeStage( lambda a: DungeonFileReader().readDungeonFromFile( fileName ), repeats )
+    return results
+
+
+def runBenchmarks( sizes, encodings, repeats, workDir, seed = 1, maxXMLSize = DEFAULT_MAX_XML_SIZE, log = None ):
+    '''Benchmarks all the sizes and encodings. Returns the results document'''
+    records = []
+    for size in sizes:
+        for encoding in encodings:
+            if ( encoding == "xml" and size > maxXMLSize ):
+                continue
+            fileName = os.path.join( workDir, "synth_%d_%s_%d.tmx" % ( size, encoding, seed ) )
+            if ( not os.path.isfile( fileName ) ):
+                writeSynthLevel( fileName, size, size, seed, encoding )
+            for stage, times in benchmarkLevel( fileName, repeats ).items():
+                record = { "size": size,
+                           "encoding": encoding,
+                           "stage": stage,
+                           "cells": size*size,
+                           "fileBytes": os.path.getsize( fileName ),
+                           "best": min( times ),
+                           "median": statistics.median( times ),
+                           "repeats": len(times) }
+                record["nsPerCell"] = record["best"]*1e9/record["cells"]
+                records.append( record )
+                if ( log is not None ):
+                    log( "%5d %-12s %-14s %10.4f s %10.1f ns/cell" %
+                         ( size, encoding, stage, record["best"], record["nsPerCell"] ) )
+    return { "timestamp": time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+             "python": platform.python_version(),
+             "platform": platform.platform(),
+             "machine": platform.machine(),
+             "seed": seed,
+             "records": records }
+
+
+def compareResults( baseline, current, threshold = 1.25 ):
+    '''Compares the best times of two result documents. Returns a list of
+    (size, encoding, stage, baselineBest, currentBest, ratio) of the
+    stages which got slower than threshold times the baseline'''
+    known = dict( ( ( r["size"], r["encoding"], r["stage"] ), r["best"] ) for r in baseline["records"] )
+    regressions = []
+    for record in current["records"]:
+        key = ( record["size"], record["encoding"], record["stage"] )
+        if ( key in known and known[key] > 0 ):
+            ratio = record["best"]/known[key]
+            if ( ratio > threshold ):
+                regressions.append( key + ( known[key], record["best"], ratio ) )
+    return regressions
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Benchmarks the dungeon pipeline on synthetic levels" )
+    parser.add_argument( "--sizes", default = ",".join( str(s) for s in DEFAULT_SIZES ),
+                         help = "comma separated map sizes, e.g. 40,512,4096" )
+    parser.add_argument( "--encodings", default = ",".join( ENCODINGS ),
+                         help = "comma separated layer encodings (%s)" % ", ".join( ENCODINGS ) )
+    parser.add_argument( "--repeats", type = int, default = 3 )
+    parser.add_argument( "--seed", type = int, default = 1 )
+    parser.add_argument( "--max-xml-size", type = int, default = DEFAULT_MAX_XML_SIZE,
+                         help = "skip plain XML levels bigger than this" )
+    parser.add_argument( "--work-dir", help = "directory for the synthetic levels (default: a temporary one)" )
+    parser.add_argument( "-o", "--output", help = "JSON file for the results" )
+    parser.add_argument( "--compare", help = "JSON results of an earlier run to compare with" )
+    parser.add_argument( "--threshold", type = float, default = 1.25,
+                         help = "slowdown ratio reported as a regression" )
+    args = parser.parse_args( argv )
+
+    sizes = [ int(s) for s in args.sizes.split( "," ) ]
+    encodings = args.encodings.split( "," )
+    for encoding in encodings:
+        if ( encoding not in ENCODINGS ):
+            parser.error( "unknown encoding: %s" % encoding )
+    workDir = args.work_dir or tempfile.mkdtemp( prefix = "dungeonBench" )
+    if ( not os.path.isdir( workDir ) ):
+        os.makedirs( workDir )
+    results = runBenchmarks( sizes, encodings, args.repeats, workDir, args.seed, args.max_xml_size, log = print )
+    if ( args.output ):
+        with open( args.output, "w" ) as output:
+            json.dump( results, output, indent = 1 )
+    if ( args.compare ):
+        with open( args.compare ) as baselineFile:
+            regressions = compareResults( json.load( baselineFile ), results, args.threshold )
+        for size, encoding, stage, before, after, ratio in regressions:
+            print( "REGRESSION %5d %-12s %-14s %.4f s -> %.4f s (x%.2f)" % ( size, encoding, stage, before, after, ratio ) )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
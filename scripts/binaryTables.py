@@ -0,0 +1,113 @@
+import json
+import os
+import struct
+
+#====================================================
+# Layout shared by the binary files of the tools (level
+# cache .dmlc, navigation tables .nav, region files
+# .dmrg), all little-endian:
+#   4-byte magic, u32 format version, u32 header length
+#   header: JSON, padded with spaces to its length
+#   padding up to 8 bytes
+#   tables, each 8-byte aligned
+# The header tells where the tables are. Their offsets
+# depend on the header length, which depends on the
+# offsets: room for them is reserved first (see
+# reserveHeader)
+#====================================================
+
+PREFIX = struct.Struct( "<4sII" )
+# room kept in the header for every offset written after the layout
+OFFSET_ROOM = 16
+
+
+def align8( size ):
+    return ( size + 7 ) & ~7
+
+
+def reserveHeader( header, offsetCount ):
+    '''Length of the JSON header once offsetCount offsets are filled in
+    (they have to be in it already, e.g. as 0)'''
+    return len( json.dumps( header ).encode( "utf-8" ) ) + OFFSET_ROOM*offsetCount
+
+
+def tablesStart( headerLength ):
+    '''Offset of the first table after a header of headerLength bytes'''
+    return align8( PREFIX.size + headerLength )
+
+
+def layoutTables( entries, start ):
+    '''Sets the "offset" of every entry (dictionaries with a "length")
+    to consecutive 8-byte aligned places from start.
+    Returns the offset after the last one'''
+    offset = start
+    for entry in entries:
+        entry["offset"] = offset
+        offset = align8( offset + entry["length"] )
+    return offset
+
+
+def writeHeader( stream, magic, version, header, headerLength ):
+    '''Writes the prefix and the JSON header, padded up to the first table'''
+    headerData = json.dumps( header ).encode( "utf-8" )
+    if ( len(headerData) > headerLength ):
+        raise ValueError( "header of %d bytes does not fit into %d" % ( len(headerData), headerLength ) )
+    stream.write( PREFIX.pack( magic, version, headerLength ) )
+    stream.write( headerData + b' '*( headerLength - len(headerData) ) )
+    stream.write( bytes( tablesStart( headerLength ) - PREFIX.size - headerLength ) )
+
+
+def writeAligned( stream, blob ):
+    '''Writes a table at the next 8-byte aligned position of the stream'''
+    stream.write( bytes( align8( stream.tell() ) - stream.tell() ) )
+    stream.write( blob )
+
+
+def planTableFile( header, entries ):
+    '''Gives the entries (one dictionary per table, with its "length",
+    held by the header) their "offset", after the header.
+    Returns the header length'''
+    for entry in entries:
+        entry["offset"] = 0
+    headerLength = reserveHeader( header, len(entries) )
+    layoutTables( entries, tablesStart( headerLength ) )
+    return headerLength
+
+
+def writeTableFile( fileName, magic, version, header, entries, blobs, headerLength = None ):
+    '''Writes a whole file: header holds entries (one dictionary per
+    table, with its "length"), which get the "offset" of their blob.
+    When the tables refer to each other's offsets, plan the file first
+    (see planTableFile) and give its headerLength: entries are then
+    the laid out tables, blobs written one after the other.
+    The file is written under a temporary name and renamed, so readers
+    never see a partial file'''
+    if ( headerLength is None ):
+        headerLength = planTableFile( header, entries )
+    temporaryName = fileName + ".tmp%d" % os.getpid()
+    try:
+        with open( temporaryName, "wb" ) as stream:
+            writeHeader( stream, magic, version, header, headerLength )
+            for entry, blob in zip( entries, blobs ):
+                if ( stream.tell() != entry["offset"] ):
+                    writeAligned( stream, b'' )
+                if ( stream.tell() != entry["offset"] or len(blob) != entry["length"] ):
+                    raise ValueError( "%s: table of %d bytes at %d, planned %d at %d" %
+                                      ( fileName, len(blob), stream.tell(), entry["length"], entry["offset"] ) )
+                stream.write( blob )
+        os.replace( temporaryName, fileName )
+    finally:
+        if ( os.path.exists( temporaryName ) ):
+            os.remove( temporaryName )
+
+
+def readHeader( data, magic, version, fileName, kind ):
+    '''Returns the JSON header of the data (bytes or mmap) of a file.
+    Raises ValueError when it is not a valid kind file (e.g. "region")
+    of that format version'''
+    if ( len(data) < PREFIX.size or data[:4] != magic ):
+        raise ValueError( "%s is not a %s file" % ( fileName, kind ) )
+    fileMagic, fileVersion, headerLength = PREFIX.unpack_from( data, 0 )
+    if ( fileVersion != version ):
+        raise ValueError( "%s: %s format %d, expected %d" % ( fileName, kind, fileVersion, version ) )
+    return json.loads( bytes( data[PREFIX.size:PREFIX.size + headerLength] ).decode( "utf-8" ) )
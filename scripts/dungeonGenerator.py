@@ -1,8 +1,24 @@
 import bpy
-import random
-import xml.etree.ElementTree as et
-
-Pi = 3.141592653589793238462643383279502884 # 180 degrees
+import mathutils
+import os
+import re
+import sys
+import tempfile
+import time
+
+# modules shared with the command line tools live next to this script
+sys.path.append( os.path.dirname( os.path.realpath( __file__ ) ) )
+from ReadDungeonClass import DungeonFileReader
+from assetResolver import PrefabLibrary, levelPrefabs
+from autoWalls import deriveWalls
+from instrumentation import NULL_PROFILER, StageProfiler
+from layerGrid import NO_PREFAB
+from levelCache import CACHE_SUFFIX, LevelCache
+from levelDiff import diffDungeons
+from proceduralDungeon import generateDungeon
+from layerRegistry import LAYER_REGISTRY, LAYER_SPECS
+from tilePlacement import QUAD_NORMALS, cellLocation, dungeonChunkTransforms, dungeonTransforms, layerCellTransforms, layerQuads, placementRule, prefabDisplacements
+from wallCulling import cullHiddenWalls
 
 #====================================================
 # NOTE: gid = 0 means no tile is associated with it
@@ -50,178 +66,515 @@ Pi = 3.141592653589793238462643383279502884 # 180 degrees
 # read a dubgeon TXT file and create a blender mesh for it
 #the file has
 
-def ListToMatrix( inList, inWidth ):
-    '''Reshapes the input list into a rectangular matrix'''
-    outList = []
-    for i in range(0, int(len(inList)/inWidth)):
-        outList.append( inList[i*inWidth:(i+1)*inWidth] )
-    return outList
-
-def ReadLayer( layers, layerName):
-    '''Extracts a list, representing a map of 
-    a particular layer, from a list of layers' trees '''
-    layer = []
-    for i in layers:
-        if (i.get('name') == layerName):
-            for j in i:
-                if (j.tag == "data"):
-                    for k in j:
-                        layer.append( int(k.get('gid')) ) # see NOTE in the head of this file
-    return layer
-
-
-def GetNodes( root, nodeName ):
-    '''Returns a list of trees(children of root)
-    whose tags correspond to the nodeName '''
-    nodes = []
-    for child in root:
-        if ( child.tag == nodeName ):
-            nodes.append(child)
-    return nodes
-
-
-def GetPrefabName( tilesets, layerName, tileID ):
-    '''Returs a name of the 3D object, corresponding to
-    a given tile ID. This object is used in constructing a level'''
-    prefabName = "None"
-    for t in tilesets:
-        if ( t.get("name") == layerName ):
-            for i in t.findall("tile"):
-                if ( int(i.get("id")) == tileID ):
-                    for j in i.findall("properties"):
-                        for k in j.findall("property"):
-                            if ( k.get("name") == "prefabName" ):
-                                prefabName = k.get("value")
-    return prefabName
-
-
-def getFirstGID( root, tilesetName ):
-    '''Returns id of the first tile in the tileset.'''
-    fgid = 0
-    for child in root.findall('tileset'):
-        if ( child.get('name') == tilesetName ):
-            fgid = child.get('firstgid')
-    return int(fgid)
- 
+
+def LinkPrefabs( library, prefabNames ):
+    '''Links the prefabs which are not in bpy.data.objects yet from their
+    .blend files (see assetResolver.py), opening each file once.
+    Prefabs linked for an earlier level are reused.
+    Returns the names of the prefabs which were not found'''
+    needed = [ name for name in prefabNames if name not in bpy.data.objects ]
+    byFile, missing = library.groupByFile( needed )
+    for blendFile, names in byFile.items():
+        with bpy.data.libraries.load( blendFile, link = True ) as (dataFrom, dataTo):
+            dataTo.objects = [ name for name in names if name in dataFrom.objects ]
+    return missing
+
+
+def MatrixProduct( a, b ):
+    '''a times b: the @ operator of Blender 2.8+, * in Blender 2.7x'''
+    return a @ b if bpy.app.version >= (2, 80, 0) else a*b
+
+
+def PrefabRotation( source ):
+    '''Rotation matrix of a prefab object, whatever its rotation mode'''
+    return source.matrix_basis.to_quaternion().to_matrix()
+
+
+def CellRotation( rotation, prefabRotation ):
+    '''Euler rotation of a tile: the rotation of its cell applied after
+    the prefab's own one'''
+    return MatrixProduct( mathutils.Euler( rotation ).to_matrix(), prefabRotation ).to_euler( 'XYZ' )
+
+
+def ApplyPrefab( obj, source, location, rotation, prefabRotation = None ):
+    '''Makes obj a copy of the prefab object source put into a cell, as
+    bpy.ops.object.duplicate does: its mesh, scale and object-level
+    material slots, the prefab's rotation composed with the one of the
+    cell, at the location of the cell'''
+    # bpy wrappers are created on every access, compare them with ==
+    if ( obj.data != source.data ):
+        obj.data = source.data
+    obj.location = location
+    obj.scale = source.scale
+    obj.rotation_mode = 'XYZ'
+    obj.rotation_euler = CellRotation( rotation, prefabRotation if prefabRotation is not None else PrefabRotation( source ) )
+    for slot, sourceSlot in zip( obj.material_slots, source.material_slots ):
+        slot.link = sourceSlot.link
+        if ( sourceSlot.link == 'OBJECT' ):
+            slot.material = sourceSlot.material
+
+
+def DuplicatePlaceLayer( transforms, objects ):
+    '''Places the tiles of a layer one by one with bpy.ops.object.duplicate.
+    Every operator call updates the whole scene, so this gets slow on big levels'''
+    for prefabName, location, rotation in transforms:
+        source = bpy.data.objects[prefabName]
+        source.select = True
+        bpy.ops.object.duplicate()
+        bpy.context.selected_objects[0].location = location
+        bpy.context.selected_objects[0].rotation_mode = 'XYZ'
+        bpy.context.selected_objects[0].rotation_euler = CellRotation( rotation, PrefabRotation( source ) )
+        objects.append(bpy.context.selected_objects[0])
+        bpy.ops.object.select_all(action='DESELECT')
+
+
+def GetLayerCollection( scene, collectionName ):
+    '''Returns the collection holding the objects of a dungeon layer,
+    creating it (as a child of the scene collection) if needed'''
+    collection = bpy.data.collections.get( collectionName )
+    if ( collection is None ):
+        collection = bpy.data.collections.new( collectionName )
+        scene.collection.children.link( collection )
+    return collection
+
+
+def LinkObjects( scene, newObjects, collectionName, layerMask ):
+    '''Links a batch of new objects into the scene: into the layer
+    collection (Blender 2.8+) or into the scene layer (Blender 2.7x)'''
+    if ( hasattr( bpy.data, "collections" ) ):
+        link = GetLayerCollection( scene, collectionName ).objects.link
+        for obj in newObjects:
+            link( obj )
+    else:
+        link = scene.objects.link
+        for obj in newObjects:
+            link( obj )
+            obj.layers = layerMask
+
+
+def BulkPlaceLayer( transforms, scene, collectionName, layerMask, objects, batchSize = 1000, names = None ):
+    '''Places the tiles of a layer without operators: every tile is a new
+    object sharing the mesh of its prefab (with the prefab's rotation,
+    scale and material slots, see ApplyPrefab), created with
+    bpy.data.objects.new and linked into the scene in batches. Objects are
+    named after their prefabs unless a list of names (one per transform)
+    is given'''
+    sources = {}
+    batch = []
+    for k, (prefabName, location, rotation) in enumerate( transforms ):
+        source = sources.get( prefabName )
+        if ( source is None ):
+            prefab = bpy.data.objects[prefabName]
+            source = sources[prefabName] = ( prefab, PrefabRotation( prefab ) )
+        obj = bpy.data.objects.new( names[k] if names is not None else prefabName, source[0].data )
+        ApplyPrefab( obj, source[0], location, rotation, source[1] )
+        batch.append( obj )
+        if ( len(batch) >= batchSize ):
+            LinkObjects( scene, batch, collectionName, layerMask )
+            objects.extend( batch )
+            batch = []
+    LinkObjects( scene, batch, collectionName, layerMask )
+    objects.extend( batch )
+
+
+def GetPrefabCollection( prefabName ):
+    '''Returns a collection holding only the prefab, to be instanced
+    by the tiles (Blender 2.8+)'''
+    collectionName = "prefab_" + prefabName
+    collection = bpy.data.collections.get( collectionName )
+    if ( collection is None ):
+        source = bpy.data.objects[prefabName]
+        collection = bpy.data.collections.new( collectionName )
+        collection.objects.link( source )
+        # the instances are placed relative to the prefab itself
+        collection.instance_offset = source.location
+    return collection
+
+
+def InstancePlaceLayer( transforms, scene, collectionName, objects, batchSize = 1000 ):
+    '''Places the tiles of a layer as collection instances: every tile is
+    an empty instancing the collection of its prefab (Blender 2.8+)'''
+    prefabCollections = {}
+    batch = []
+    for prefabName, location, rotation in transforms:
+        prefabCollection = prefabCollections.get( prefabName )
+        if ( prefabCollection is None ):
+            prefabCollection = prefabCollections[prefabName] = GetPrefabCollection( prefabName )
+        obj = bpy.data.objects.new( prefabName, None )
+        obj.instance_type = 'COLLECTION'
+        obj.instance_collection = prefabCollection
+        obj.location = location
+        obj.rotation_euler = rotation
+        batch.append( obj )
+        if ( len(batch) >= batchSize ):
+            LinkObjects( scene, batch, collectionName, None )
+            objects.extend( batch )
+            batch = []
+    LinkObjects( scene, batch, collectionName, None )
+    objects.extend( batch )
+
+
+def PlaceDungeon( transforms, sceneName, mode, layerGroups, sceneLayers, profiler = NULL_PROFILER ):
+    '''Populates the scene with all the layers of the dungeon.
+    mode is "operator" (bpy.ops duplicates), "bulk" (linked-data objects)
+    or "instance" (collection instances). layerGroups maps a layer kind
+    to its group, sceneLayers a group to its scene layer mask.
+    Returns a dictionary layerKind -> list of the created objects'''
+    scene = bpy.data.scenes[sceneName]
+    placed = {}
+    #making sure nothing is selected in the scene
+    if ( mode == "operator" ):
+        bpy.ops.object.select_all(action='DESELECT')
+    for layerKind in transforms:
+        placed[layerKind] = []
+        layerGroup = layerGroups[layerKind]
+        with profiler.stage( "instance", layerKind ):
+            if ( mode == "operator" ):
+                # setting active scene layer
+                scene.layers = sceneLayers[layerGroup]
+                DuplicatePlaceLayer( transforms[layerKind], placed[layerKind] )
+            elif ( mode == "bulk" ):
+                BulkPlaceLayer( transforms[layerKind], scene, layerGroup + "Objects",
+                                sceneLayers[layerGroup], placed[layerKind] )
+            elif ( mode == "instance" ):
+                InstancePlaceLayer( transforms[layerKind], scene, layerGroup + "Objects", placed[layerKind] )
+            else:
+                raise ValueError( "Unknown placement mode: %s" % mode )
+            profiler.count( "objectsCreated", len( placed[layerKind] ), layerKind )
+    if ( mode == "operator" ):
+        # selecting all the layers with the dungeon
+        layers = [False]*20
+        layers[1:6] = [True, True, True, True, True]
+        scene.layers = layers
+    return placed
+
+
+def RemovePlaced( placed ):
+    '''Deletes all the objects created by PlaceDungeon'''
+    for objects in placed.values():
+        for obj in objects:
+            bpy.data.objects.remove( obj, do_unlink = True )
+
+
+def ComparePlacementModes( transforms, sceneName, modes, layerGroups, sceneLayers ):
+    '''Builds the dungeon with every placement mode in turn (removing
+    the result in between) and prints how long each of them took'''
+    timings = {}
+    for mode in modes:
+        start = time.perf_counter()
+        placed = PlaceDungeon( transforms, sceneName, mode, layerGroups, sceneLayers )
+        timings[mode] = time.perf_counter() - start
+        count = sum( len(objects) for objects in placed.values() )
+        print( "%-10s %8d objects %10.3f s" % (mode, count, timings[mode]) )
+        RemovePlaced( placed )
+    return timings
+
+
+def ReadPrefabGeometry( prefabName ):
+    '''Reads the mesh of a prefab (scaled like the prefab object) into
+    plain lists: vertex coordinates, faces, material indices and UVs'''
+    source = bpy.data.objects[prefabName]
+    mesh = source.data
+    sx, sy, sz = source.scale
+    uvLayer = mesh.uv_layers.active
+    return { "coords": [ (v.co[0]*sx, v.co[1]*sy, v.co[2]*sz) for v in mesh.vertices ],
+             "faces": [ tuple(p.vertices) for p in mesh.polygons ],
+             "materialIndices": [ p.material_index for p in mesh.polygons ],
+             "uvs": [ tuple(l.uv) for l in uvLayer.data ] if uvLayer is not None else None,
+             "materials": list( mesh.materials ),
+             "materialKey": tuple( m.name if m is not None else "" for m in mesh.materials ) }
+
+
+def BuildMergedMesh( meshName, tiles ):
+    '''Builds a single mesh out of the tiles [(geometry, location, rotation)]
+    with their transforms applied. All the tiles must share materials'''
+    verts = []
+    faces = []
+    materialIndices = []
+    uvs = []
+    hasUVs = True
+    for geometry, location, rotation in tiles:
+        m = mathutils.Euler( rotation ).to_matrix()
+        r0, r1, r2 = tuple(m[0]), tuple(m[1]), tuple(m[2])
+        lx, ly, lz = location
+        base = len(verts)
+        verts.extend( ( r0[0]*x + r0[1]*y + r0[2]*z + lx,
+                        r1[0]*x + r1[1]*y + r1[2]*z + ly,
+                        r2[0]*x + r2[1]*y + r2[2]*z + lz ) for x, y, z in geometry["coords"] )
+        faces.extend( tuple( base + v for v in f ) for f in geometry["faces"] )
+        materialIndices.extend( geometry["materialIndices"] )
+        if ( geometry["uvs"] is None ):
+            hasUVs = False
+        elif ( hasUVs ):
+            uvs.extend( geometry["uvs"] )
+    mesh = bpy.data.meshes.new( meshName )
+    mesh.from_pydata( verts, [], faces )
+    for material in tiles[0][0]["materials"]:
+        mesh.materials.append( material )
+    mesh.polygons.foreach_set( "material_index", materialIndices )
+    if ( hasUVs and uvs ):
+        if ( hasattr( mesh, "uv_textures" ) ):
+            mesh.uv_textures.new()
+        else:
+            mesh.uv_layers.new()
+        mesh.uv_layers[0].data.foreach_set( "uv", [ c for uv in uvs for c in uv ] )
+    mesh.update()
+    return mesh
+
+
+def BakeDungeon( chunks, sceneName, collectionName, layerMask, profiler = NULL_PROFILER ):
+    '''Merges all the tiles sharing materials within a chunk into one object
+    per (chunk, materials). Returns the created objects and the statistics
+    (objects, vertices, material slots) before and after baking'''
+    scene = bpy.data.scenes[sceneName]
+    geometries = {}
+    before = { "objects": 0, "vertices": 0, "materialSlots": 0 }
+    after = { "objects": 0, "vertices": 0, "materialSlots": 0 }
+    baked = []
+    for chunkRow, chunkColumn in sorted( chunks ):
+        groups = {}
+        for prefabName, location, rotation in chunks[(chunkRow, chunkColumn)]:
+            geometry = geometries.get( prefabName )
+            if ( geometry is None ):
+                geometry = geometries[prefabName] = ReadPrefabGeometry( prefabName )
+            groups.setdefault( geometry["materialKey"], [] ).append( (geometry, location, rotation) )
+            before["objects"] += 1
+            before["vertices"] += len( geometry["coords"] )
+            before["materialSlots"] += len( geometry["materials"] )
+        with profiler.stage( "bake", "chunk_%d_%d" % (chunkRow, chunkColumn) ):
+            for k, materialKey in enumerate( sorted( groups ) ):
+                name = "chunk_%d_%d_%d" % (chunkRow, chunkColumn, k)
+                mesh = BuildMergedMesh( name, groups[materialKey] )
+                obj = bpy.data.objects.new( name, mesh )
+                baked.append( obj )
+                after["objects"] += 1
+                after["vertices"] += len( mesh.vertices )
+                after["materialSlots"] += len( mesh.materials )
+            profiler.count( "objectsCreated", len(groups) )
+    LinkObjects( scene, baked, collectionName, layerMask )
+    return baked, before, after
+
+
+def BuildQuadObjects( quads, sceneName, placed, layerGroups, sceneLayers ):
+    '''Builds one object per (layer, prefab) out of the merged floor and
+    ceiling quads (see tilePlacement.layerQuads), with the materials of
+    the prefab and its texture repeated once per cell, into the groups
+    of their layers (see PlaceDungeon)'''
+    scene = bpy.data.scenes[sceneName]
+    byPrefab = {}
+    for layerKind, layerQuadList in quads.items():
+        for quad in layerQuadList:
+            byPrefab.setdefault( (layerKind, quad[0]), [] ).append( quad )
+    for (layerKind, prefabName) in sorted( byPrefab ):
+        verts = []
+        faces = []
+        uvs = []
+        for name, corners, normal, (columns, rows) in byPrefab[(layerKind, prefabName)]:
+            base = len(verts)
+            verts.extend( corners )
+            faces.append( (base, base + 1, base + 2, base + 3) )
+            # Blender UVs start at the bottom
+            uvs.extend( [ 0.0, 0.0,  columns, 0.0,  columns, rows,  0.0, rows ] )
+        mesh = bpy.data.meshes.new( "%s_%s_quads" % (layerKind, prefabName) )
+        mesh.from_pydata( verts, [], faces )
+        for material in bpy.data.objects[prefabName].data.materials:
+            mesh.materials.append( material )
+        if ( hasattr( mesh, "uv_textures" ) ):
+            mesh.uv_textures.new()
+        else:
+            mesh.uv_layers.new()
+        mesh.uv_layers[0].data.foreach_set( "uv", uvs )
+        mesh.update()
+        obj = bpy.data.objects.new( mesh.name, mesh )
+        layerGroup = layerGroups[layerKind]
+        LinkObjects( scene, [obj], layerGroup + "Objects", sceneLayers[layerGroup] )
+        placed[layerKind].append( obj )
+
+
+def CellObjectName( layerKind, i, j ):
+    '''Name of the object of the cell (i, j) of a layer in the incremental mode'''
+    return "%s_%d_%d" % (layerKind, i, j)
+
+
+# CellObjectName, with the ".001" ... suffix Blender adds to a name in use
+CELL_OBJECT_NAME = re.compile( r"^(\w+?)_(\d+)_(\d+)(\.\d+)?$" )
+
+
+def SceneCellObjects( scene, layerGroups ):
+    '''Finds the objects of the scene placed by the incremental mode
+    (for the layer kinds of layerGroups).
+    Returns a dictionary (layerKind, i, j) -> object and a list of the
+    extra copies (named "<cell name>.001" ... by Blender)'''
+    cellObjects = {}
+    copies = []
+    for obj in scene.objects:
+        match = CELL_OBJECT_NAME.match( obj.name )
+        if ( match is None or match.group(1) not in layerGroups ):
+            continue
+        if ( match.group(4) ):
+            copies.append( obj )
+        else:
+            cellObjects[(match.group(1), int(match.group(2)), int(match.group(3)))] = obj
+    return cellObjects, copies
+
+
+def SceneMatchesState( cellObjects, copies, previous ):
+    '''True when the scene holds exactly one object per tile of the
+    dungeon "previous", showing the mesh of its prefab: the saved state
+    can only be trusted when nobody edited or reverted the scene since'''
+    if ( copies ):
+        return False
+    tiles = 0
+    for layerKind, grid in previous.getGrids().items():
+        if ( grid is None ):
+            continue
+        for i, j, prefabName in grid.occupiedCells():
+            obj = cellObjects.get( (layerKind, i, j) )
+            source = bpy.data.objects.get( prefabName )
+            if ( obj is None or source is None or obj.data != source.data ):
+                return False
+            tiles += 1
+    return tiles == len( cellObjects )
+
+
+def RemoveObjects( objects ):
+    '''Deletes a list of objects'''
+    for obj in objects:
+        bpy.data.objects.remove( obj, do_unlink = True )
+
+
+def StateFileName( sceneName ):
+    '''File keeping the grids the scene was last built from (next to the
+    .blend file, or in the temporary directory for an unsaved one)'''
+    directory = os.path.dirname( bpy.data.filepath ) if bpy.data.filepath else tempfile.gettempdir()
+    return os.path.join( directory, sceneName + ".dungeon" + CACHE_SUFFIX )
+
+
+def BuildCellObjects( reader, sceneName, layerGroups, sceneLayers ):
+    '''Places all the tiles of the dungeon as objects named after their
+    cells (see CellObjectName), so that they can be found again later.
+    layerGroups and sceneLayers are the ones of PlaceDungeon'''
+    scene = bpy.data.scenes[sceneName]
+    placed = {}
+    for layerKind, grid in reader.getGrids().items():
+        placed[layerKind] = []
+        if ( grid is None ):
+            continue
+        cells = layerCellTransforms( grid, layerKind, reader.floorTileSize, reader.ceilingHeight )
+        layerGroup = layerGroups[layerKind]
+        BulkPlaceLayer( [ cell[2:] for cell in cells ], scene, layerGroup + "Objects", sceneLayers[layerGroup],
+                        placed[layerKind], names = [ CellObjectName( layerKind, i, j ) for i, j, p, l, r in cells ] )
+    return placed
+
+
+def IncrementalUpdate( previous, reader, sceneName, cellObjects, layerGroups, sceneLayers ):
+    '''Updates a scene built from the dungeon "previous" so that it shows
+    the dungeon "reader": only the changed cells are added, removed or
+    swapped to another prefab (placed anew from it, see ApplyPrefab).
+    cellObjects are the objects of the scene (see SceneCellObjects),
+    layerGroups and sceneLayers the ones of PlaceDungeon.
+    Returns the number of each'''
+    scene = bpy.data.scenes[sceneName]
+    counts = { "added": 0, "removed": 0, "swapped": 0 }
+    for layerKind, cells in diffDungeons( previous, reader ).items():
+        displacement, rotation = placementRule( layerKind, reader.floorTileSize, reader.ceilingHeight )
+        displacements = prefabDisplacements( layerKind, displacement, reader.floorTileSize )
+        newTransforms = []
+        newNames = []
+        for i, j, oldPrefab, newPrefab in cells:
+            obj = cellObjects.get( (layerKind, i, j) )
+            if ( newPrefab == NO_PREFAB ):
+                if ( obj is not None ):
+                    bpy.data.objects.remove( obj, do_unlink = True )
+                    counts["removed"] += 1
+                continue
+            # prefabs have their own offsets, rotations and scales
+            location = cellLocation( i, j, displacements.get( newPrefab, displacement ), reader.floorTileSize )
+            if ( obj is not None ):
+                ApplyPrefab( obj, bpy.data.objects[newPrefab], location, rotation )
+                counts["swapped"] += 1
+            else:
+                newTransforms.append( ( newPrefab, location, rotation ) )
+                newNames.append( CellObjectName( layerKind, i, j ) )
+        layerGroup = layerGroups[layerKind]
+        BulkPlaceLayer( newTransforms, scene, layerGroup + "Objects", sceneLayers[layerGroup], [], names = newNames )
+        counts["added"] += len(newNames)
+    return counts
+
+
 # getting the file name to process. Should come in from the command line args
 mapFileName = "c:/Users/seldon/Documents/My Games/Design/GOLD/BGETest/tmx/testMap.tmx"
- 
-mapTree = et.parse(mapFileName)
-root = mapTree.getroot()
-# determining the size of the map
-mapWidth = int( root.get('width') )
-mapHeight = int( root.get('height') )
-
-# the list of tilesets used
-#!: there must one tileset per layer :!
-tilesets = GetNodes( root, "tileset" )
-# the list of layers present in the map
-#!: there must one tileset per layer :!
-layers = GetNodes( root, "layer")
-
-#========================= FLOOR ==============================================================
-floorLayer = ReadLayer( layers, "floorTiles" )
-floorLayer = ListToMatrix( floorLayer, mapWidth )
-# Converting floor layer from matrix of id's
-# into matrices of prefab names
-firstID = getFirstGID(root, 'floorTiles')
-for i in range(0, mapWidth):
-    for j in range(0, mapHeight):
-        floorLayer[i][j] = GetPrefabName( tilesets, "floorTiles", floorLayer[i][j] - firstID )
-#========================= END OF FLOOR =====================================================
-
-
-#========================== WALLS ===========================================================
-# reading North, South, East, and West walls layers
-wallLayerN = ReadLayer( layers, "wallTilesN" )
-wallLayerN = ListToMatrix( wallLayerN, mapWidth )
-
-wallLayerS = ReadLayer( layers, "wallTilesS" )
-wallLayerS = ListToMatrix( wallLayerS, mapWidth )
-
-wallLayerE = ReadLayer( layers, "wallTilesE" )
-wallLayerE = ListToMatrix( wallLayerE, mapWidth )
-
-wallLayerW = ReadLayer( layers, "wallTilesW" )
-wallLayerW = ListToMatrix( wallLayerW, mapWidth )
-
-#wallBoxLayer = ReadLayer( layers, "wallBoxes" )
-#wallBoxLayer = ListToMatrix( wallBoxLayer, mapWidth )
-#
-#wallChainLayer = ReadLayer( layers, "chainTiles" )
-#wallChainLayer = ListToMatrix( wallChainLayer, mapWidth )
-#
-#wallTorchLayer = ReadLayer( layers, "torchTiles" )
-#wallTorchLayer = ListToMatrix( wallTorchLayer, mapWidth )
-
-# Converting wall layers from matrix of id's
-# into matrices of prefab names
-firstID = getFirstGID(root, 'wallTiles')
-for i in range(0, mapWidth):
-    for j in range(0, mapHeight):
-        wallLayerN[i][j] = GetPrefabName( tilesets, "wallTiles", wallLayerN[i][j] - firstID )
-        wallLayerS[i][j] = GetPrefabName( tilesets, "wallTiles", wallLayerS[i][j] - firstID )
-        wallLayerE[i][j] = GetPrefabName( tilesets, "wallTiles", wallLayerE[i][j] - firstID )
-        wallLayerW[i][j] = GetPrefabName( tilesets, "wallTiles", wallLayerW[i][j] - firstID )
-        # NOTE: wall boxes are stored in the same tileset as wall tiles
-        # same goes for the torch holders
-        # I think they belong together
-        #wallBoxLayer[i][j] = GetPrefabName( tilesets, "wallTiles", wallBoxLayer[i][j] - firstID )
-        #wallTorchLayer[i][j] = GetPrefabName( tilesets, "wallTiles", wallTorchLayer[i][j] - firstID )
-
-
-# Converting wall chain layers from matrix of id's
-# into matrices of prefab names
-#firstID = getFirstGID(root, 'chainTiles')
-#for i in range(0, mapWidth):
-#    for j in range(0, mapHeight):
-#        wallChainLayer[i][j] = GetPrefabName( tilesets, "chainTiles", wallChainLayer[i][j] - firstID )
-#============================== END OF WALLS ================================================
-
-
-#=============================== COLUMNS ====================================================
-columnLayer = ReadLayer( layers, "columns" )
-columnLayer = ListToMatrix( columnLayer, mapWidth )
-# Converting column layer from matrix of id's
-# into matrices of prefab names
-firstID = getFirstGID(root, 'columnTiles')
-for i in range(0, mapWidth):
-    for j in range(0, mapHeight):
-        columnLayer[i][j] = GetPrefabName( tilesets, "columnTiles", columnLayer[i][j] - firstID )        
-
-#=============================== END OF COLUMNS ==============================================
-
-
-##=============================== CEILING BARS ===================================================
-#ceilingBarLayer = ReadLayer( layers, "ceilingBars" )
-#ceilingBarLayer = ListToMatrix( ceilingBarLayer, mapWidth )
-## Converting ceiling bar layer from matrix of id's
-## into matrices of prefab names
-#firstID = getFirstGID(root, 'ceilingBars')
-#for i in range(0, mapWidth):
-#    for j in range(0, mapHeight):
-#        ceilingBarLayer[i][j] = GetPrefabName( tilesets, "ceilingBars", ceilingBarLayer[i][j] - firstID )      
-##=============================== END OF CEILING BARS ===============================================
-
-
-#================================ CEILING =========================================================
-ceilingLayer = ReadLayer( layers, "ceilingTiles" )
-ceilingLayer = ListToMatrix( ceilingLayer, mapWidth )
-# Converting ceiling layer from matrix of id's
-# into matrices of prefab names
-# TODO: GetFirstID ! to subtract properly!
-firstID = getFirstGID(root, 'ceilingTiles')
-for i in range(0, mapWidth):
-    for j in range(0, mapHeight):
-        ceilingLayer[i][j] = GetPrefabName( tilesets, "ceilingTiles", ceilingLayer[i][j] - firstID )      
-#=============================== END OF CEILING ===================================================
-
-
-floorTileSize = 3.67267 #3.0
-
-duplicateLinked = False
-#making sure nothing is selected in the scene
-bpy.ops.object.select_all(action='DESELECT')
+
+# how the tiles are put into the scene: "operator", "bulk" or "instance"
+placementMode = "bulk"
+# set to True to time all the placement modes on this level
+comparePlacementModes = False
+# set to True to merge the tiles into one object per (chunk, materials)
+# instead of placing them one by one; chunks are bakeChunkSize cells wide
+bakeDungeon = False
+bakeChunkSize = 16
+# set to a seed to generate a random proceduralSize x proceduralSize
+# dungeon (see proceduralDungeon.py) instead of reading mapFileName
+proceduralSeed = None
+proceduralSize = 128
+# set to True to derive the four wall layers from the floor layer instead
+# of reading them from the map; wallRules maps a wall kind to a list of
+# (prefabName, weight) drawn at random with wallSeed, e.g.
+# { "wallN": [("wallTile01", 3), ("wallTile02", 1)] }
+autoWalls = False
+wallRules = {}
+wallSeed = 0
+# set to True to drop the walls which can not be seen from any floor cell
+cullWalls = True
+# set to True to merge the floor and ceiling tiles into big quads: every
+# rectangle of one prefab becomes a single quad with the texture repeated
+# once per cell, only the cells left alone stay tiles
+mergeFloorCeiling = False
+# set to True to only update the cells changed since the last incremental
+# run (the first run builds everything, objects are named after their cells;
+# so does a run on a scene which no longer matches the saved state)
+incrementalUpdate = False
+
+# set to a JSON file name to record the time, peak memory and counters of
+# every stage (read, decode, resolve, cull, instance ... per layer)
+profileFileName = None
+
+# set to True to link the prefabs used by the level from the models of the
+# dungeon set (Dungeons/<set>/<kind>/models/*.blend) instead of expecting
+# them in the .blend file already. Not for the "operator" placement mode,
+# which needs the prefabs in the active scene
+linkPrefabs = False
+dungeonsDir = os.path.join( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ), "Dungeons" )
+dungeonSet = "Brunstom"
+
+activeScene = 'level01'
+
+profiler = StageProfiler( traceMemory = True ) if profileFileName else NULL_PROFILER
+if ( proceduralSeed is not None ):
+    with profiler.stage( "generate" ):
+        reader = generateDungeon( proceduralSize, proceduralSize, proceduralSeed, wallRules = wallRules )
+else:
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( mapFileName, profiler = profiler )
+if ( autoWalls ):
+    with profiler.stage( "autoWalls" ):
+        wallCounts = deriveWalls( reader, wallRules, wallSeed )
+    print( "walls derived: %d" % sum( wallCounts.values() ) )
+if ( cullWalls ):
+    with profiler.stage( "cull" ):
+        removedWalls = cullHiddenWalls( reader )
+        for layerKind, removed in removedWalls.items():
+            profiler.count( "wallsRemoved", removed, layerKind )
+    print( "hidden walls removed: %d (%s)" % ( sum( removedWalls.values() ),
+           ", ".join( "%s %d" % (kind, removedWalls[kind]) for kind in sorted(removedWalls) ) ) )
+if ( linkPrefabs ):
+    with profiler.stage( "linkPrefabs" ):
+        missingPrefabs = LinkPrefabs( PrefabLibrary( dungeonsDir, dungeonSet ), levelPrefabs( reader ) )
+    if ( missingPrefabs ):
+        print( "prefabs not found in %s: %s" % (dungeonsDir, ", ".join( missingPrefabs )) )
+# (prefabName, location, rotation) of every tile, per layer
+with profiler.stage( "placement" ):
+    transforms = dungeonTransforms( reader )
 
 
 # ++++++++++++++++++++++++ POPULATING LAYERS +++++++++++++++++++++++++++++++++++++++++++++++
@@ -239,124 +592,70 @@ column[3] = True
 ceiling = [False]*20
 ceiling[4] = True
 
-# Object groups for easier mass-handling of all objects
-floorObjects = []
-wallObjects = []
-columnObjects = []
-ceilingObjects = []
-
-#---------------------------------------------------------------------------------------------
-# FLOOR: populating floor layer
-# setting active scene layer
-
-activeScene = 'level01'
-
-bpy.data.scenes[activeScene].layers = floor
-for i in range( 0, mapWidth ):
-   for j in range( 0, mapHeight ):
-        if (floorLayer[i][j] != "None"):            
-            bpy.data.objects[floorLayer[i][j]].select = True
-            bpy.ops.object.duplicate()
-            bpy.context.selected_objects[0].location = (j*floorTileSize, -i*floorTileSize, 0)
-            floorObjects.append(bpy.context.selected_objects[0])
-            # adding abject to a group
-            #bpy.ops.object.group_link( group = "floorGroup" )
-            bpy.ops.object.select_all(action='DESELECT')
-
-# END FLOOR --------------------------------------------------------------------------------
-
-
-#---------------------------------------------------------------------------------------------------------
-#WALL: populating wall layer
-# setting active scene layer
-displ = floorTileSize/2
-
-bpy.data.scenes[activeScene].layers = wall
-for wallLayer in [wallLayerN, wallLayerS, wallLayerE, wallLayerW]:#, wallBoxLayer, wallChainLayer, wallTorchLayer]:
-    for i in range( 0, mapWidth ):
-        for j in range( 0, mapHeight ):
-            if (wallLayer[i][j] != "None"):
-                bpy.data.objects[wallLayer[i][j]].select = True
-                bpy.ops.object.duplicate()
-                # calculating additional displacements for wall tiles
-                displX, displY, displZ = [0, 0, 0]
-                # checking the last two digits in the prefab name for the 
-                # correct displacement of North, West, South, and East wall tiles
-                if (wallLayer == wallLayerN):
-                    displY = -displ
-                if (wallLayer == wallLayerW):
-                    displX = displ
-                    bpy.context.selected_objects[0].rotation_euler = (0.0, 0.0, Pi/2)
-                if (wallLayer == wallLayerS):
-                    displY = displ
-                    bpy.context.selected_objects[0].rotation_euler = (0.0, 0.0, Pi)
-                if (wallLayer == wallLayerE):
-                    displX = -displ
-                    bpy.context.selected_objects[0].rotation_euler = (0.0, 0.0, -Pi/2)
-                bpy.context.selected_objects[0].location = (j*floorTileSize+displX, -i*floorTileSize+displY, displZ)
-                # walls will be occluding in game
-#                bpy.context.selected_objects[0].game.physics_type = "OCCLUDE"
-                wallObjects.append(bpy.context.selected_objects[0])
-                bpy.ops.object.select_all(action='DESELECT')
-
-# END FLOOR --------------------------------------------------------------------------------------------------
-
-
-
-# COLUMN populating column layer
-# setting active scene layer
-bpy.data.scenes[activeScene].layers = column
-for i in range( 0, mapWidth ):
-   for j in range( 0, mapHeight ):
-        if (columnLayer[i][j] != "None"):            
-            bpy.data.objects[columnLayer[i][j]].select = True
-            bpy.ops.object.duplicate()
-            displX, displY, displZ = [floorTileSize/2.0, -floorTileSize/2.0, 0]            
-            bpy.context.selected_objects[0].location = (j*floorTileSize+displX, -i*floorTileSize+displY, displZ)
-            columnObjects.append(bpy.context.selected_objects[0])
-#            bpy.context.selected_objects[0].game.physics_type = "OCCLUDE"
-            bpy.ops.object.select_all(action='DESELECT')
-
-# END COLUMN --------------------------------------------------------------------------------------------            
-            
-##---------------------------------------------------------------------------------------------------            
-## CEILING BARs populating ceiling bars layer
-## setting active scene layer
-#bpy.data.scenes['Scene'].layers = ceilingBar
-#for i in range( 0, mapWidth ):
-#   for j in range( 0, mapHeight ):
-#        if (ceilingBarLayer[i][j] != "None"):            
-#            bpy.data.objects[ceilingBarLayer[i][j]].select = True
-#            bpy.ops.object.duplicate()
-#            displX, displY, displZ = [0, 0, 0]
-#            if (ceilingBarLayer[i][j] == "ceilingBar01"):
-#                displX = -floorTileSize/2.0
-#            if (ceilingBarLayer[i][j] == "ceilingBar02"):
-#                displY = floorTileSize/2.0            
-#            bpy.context.selected_objects[0].location = (j*floorTileSize+displX, -i*floorTileSize+displY, displZ)
-#            ceilingBarObjects.append(bpy.context.selected_objects[0])
-#            bpy.ops.object.select_all(action='DESELECT')
-#
-## END CEILING BARS -----------------------------------------------------------------------------------
-            
-
-#----------------------------------------------------------------------------------------------------
-# CEILING populating ceiling layer
-# setting active scene layer
-ceilingHeight = 3.0
-bpy.data.scenes[activeScene].layers = ceiling
-for i in range( 0, mapWidth ):
-   for j in range( 0, mapHeight ):
-        if (ceilingLayer[i][j] != "None"):            
-            bpy.data.objects[ceilingLayer[i][j]].select = True
-            bpy.ops.object.duplicate()
-            bpy.context.selected_objects[0].location = (j*floorTileSize, -i*floorTileSize, ceilingHeight)
-            ceilingObjects.append(bpy.context.selected_objects[0])
-            bpy.ops.object.select_all(action='DESELECT')
-# END CEILING ---------------------------------------------------------------------------------------
-
-
-# selecting all the layers with the dungeon
-layers = [False]*20
-layers[1:5] = [True, True, True, True]
-bpy.data.scenes[activeScene].layers = layers
+ceilingBar = [False]*20
+ceilingBar[5] = True
+
+sceneLayers = { "floor": floor, "wall": wall, "column": column, "ceiling": ceiling, "ceilingBar": ceilingBar }
+# every layer of the dungeon goes to one of the groups (scene layers
+# in Blender 2.7x, collections named floorObjects, wallObjects etc in 2.8+),
+# as given by the layer registry (see layerRegistry.py): wall boxes, torch
+# holders and chains go with the walls
+layerGroups = dict( (spec.kind, spec.group) for spec in LAYER_REGISTRY )
+
+if ( comparePlacementModes ):
+    modes = ["operator", "bulk"]
+    if ( hasattr( bpy.data, "collections" ) ):
+        modes.append( "instance" )
+    ComparePlacementModes( transforms, activeScene, modes, layerGroups, sceneLayers )
+
+if ( incrementalUpdate ):
+    stateFileName = StateFileName( activeScene )
+    stateCache = LevelCache( os.path.dirname( stateFileName ) )
+    previous = DungeonFileReader()
+    cellObjects, copies = SceneCellObjects( bpy.data.scenes[activeScene], layerGroups )
+    if ( stateCache.readEntry( previous, stateFileName ) and SceneMatchesState( cellObjects, copies, previous ) ):
+        counts = IncrementalUpdate( previous, reader, activeScene, cellObjects, layerGroups, sceneLayers )
+        print( "cells added %d, removed %d, swapped %d" % (counts["added"], counts["removed"], counts["swapped"]) )
+    else:
+        # no saved state, or a scene which does not match it: the cell
+        # objects already there are replaced, not built on
+        if ( cellObjects or copies ):
+            print( "rebuilding %d cell objects" % ( len(cellObjects) + len(copies) ) )
+        RemoveObjects( list( cellObjects.values() ) + copies )
+        BuildCellObjects( reader, activeScene, layerGroups, sceneLayers )
+    stateCache.writeEntry( reader, stateFileName )
+elif ( bakeDungeon ):
+    chunks = dungeonChunkTransforms( reader, bakeChunkSize )
+    bakedObjects, before, after = BakeDungeon( chunks, activeScene, "bakedObjects", floor, profiler )
+    print( "baked %d chunks of %dx%d cells" % (len(chunks), bakeChunkSize, bakeChunkSize) )
+    for statistic in ["objects", "vertices", "materialSlots"]:
+        print( "%-14s %10d -> %10d" % (statistic, before[statistic], after[statistic]) )
+else:
+    if ( mergeFloorCeiling ):
+        quads = {}
+        with profiler.stage( "greedyMesh" ):
+            for layerKind, grid in reader.getGrids().items():
+                if ( grid is not None and LAYER_SPECS[layerKind].placement in QUAD_NORMALS ):
+                    cells = len( transforms[layerKind] )
+                    quads[layerKind], transforms[layerKind] = layerQuads( grid, layerKind, reader.floorTileSize, reader.ceilingHeight )
+                    print( "%s: %d tiles -> %d quads + %d tiles" % (layerKind, cells, len(quads[layerKind]), len(transforms[layerKind])) )
+    placed = PlaceDungeon( transforms, activeScene, placementMode, layerGroups, sceneLayers, profiler )
+    if ( mergeFloorCeiling ):
+        BuildQuadObjects( quads, activeScene, placed, layerGroups, sceneLayers )
+
+    # Object groups for easier mass-handling of all objects
+    floorObjects = placed["floor"]
+    wallObjects = placed["wallN"] + placed["wallS"] + placed["wallE"] + placed["wallW"]
+    columnObjects = placed["column"]
+    ceilingObjects = placed["ceiling"]
+    decorationObjects = placed["wallBox"] + placed["torch"] + placed["chain"] + placed["ceilingBar"]
+
+    # walls will be occluding in game
+    #for obj in wallObjects + columnObjects:
+    #    obj.game.physics_type = "OCCLUDE"
+
+if ( profileFileName ):
+    profiler.stop()
+    profiler.save( profileFileName )
+    for stage, total in sorted( profiler.report()["totals"].items() ):
+        print( "%-12s %6d calls %10.3f s" % (stage, total["calls"], total["seconds"]) )
@@ -0,0 +1,468 @@
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+from array import array
+
+from ReadDungeonClass import DungeonFileReader
+from assetResolver import PrefabLibrary
+from autoWalls import deriveWalls
+from instrumentation import NULL_PROFILER, StageProfiler
+from layerRegistry import LAYER_SPECS
+from levelCache import LevelCache
+from lightBaker import bakeLights, lightFileName
+from navigation import buildNavGraph, navFileName
+from pvsBuilder import buildPVS, pvsFileName
+from textureAtlas import AtlasParameters, levelAtlas, remapUVs, uvTransform
+from tilePlacement import QUAD_NORMALS, dungeonTransforms, layerQuads
+from wallCulling import cullHiddenWalls
+
+#====================================================
+# Headless TMX -> glTF 2.0 exporter (no Blender needed)
+#
+# Every prefab becomes a single mesh, referenced by a
+# single node; the tiles using the prefab are placed
+# with EXT_mesh_gpu_instancing (one translation and
+# one rotation per tile).
+#
+# The prefab models are .blend files which can not be
+# read without Blender, so the geometry of a prefab is
+# taken from <prefabDir>/<prefabName>.obj (exported
+# from Blender with the default Y-up axes) when it
+# exists, otherwise a placeholder (a quad or a box of
+# the right size) named after the prefab is written,
+# to be replaced by the real model in the engine.
+#
+# With mergeQuads the floor and ceiling rectangles of
+# one prefab (see tilePlacement.layerQuads) become a
+# single mesh of big quads with tiled UVs, which keeps
+# a (repeating) material of its own even with an atlas.
+#
+# With texture atlases (see textureAtlas.py) the UVs
+# of the prefabs found in them are moved into their
+# atlas slots and all of them share one material.
+#
+# NOTE: Blender is Z-up, glTF is Y-up:
+# glTF (x, y, z) = Blender (x, z, -y)
+#====================================================
+
+GLTF_FLOAT = 5126
+GLTF_UNSIGNED_INT = 5125
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+GLTF_LINEAR = 9729
+GLTF_LINEAR_MIPMAP_LINEAR = 9987
+GLTF_CLAMP_TO_EDGE = 33071
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+
+
+def blenderToGltf( location ):
+    '''Converts a Blender (Z-up) position into a glTF (Y-up) one'''
+    x, y, z = location
+    return ( x, z, -y )
+
+
+def eulerToGltfQuaternion( rotation ):
+    '''Converts a Blender XYZ Euler rotation into a glTF quaternion (x, y, z, w)'''
+    rx, ry, rz = rotation
+    cx, sx = math.cos( rx/2.0 ), math.sin( rx/2.0 )
+    cy, sy = math.cos( ry/2.0 ), math.sin( ry/2.0 )
+    cz, sz = math.cos( rz/2.0 ), math.sin( rz/2.0 )
+    # q = qz * qy * qx
+    w = cz*cy*cx + sz*sy*sx
+    x = cz*cy*sx - sz*sy*cx
+    y = cz*sy*cx + sz*cy*sx
+    z = sz*cy*cx - cz*sy*sx
+    # the vector part is converted like a position
+    return ( x, z, -y, w )
+
+
+class PrefabMesh():
+    '''Triangle mesh of a prefab in glTF axes: flat lists of
+    positions (3 per vertex), normals (3), uvs (2) and indices'''
+    def __init__( self, name, positions, normals, uvs, indices ):
+        self.name = name
+        self.positions = positions
+        self.normals = normals
+        self.uvs = uvs
+        self.indices = indices
+
+    def vertexCount( self ):
+        return len( self.positions )//3
+
+
+def quadMesh( name, corners, normal ):
+    '''A single quad (4 Blender-space corners, counter-clockwise
+    seen from the front) with a given Blender-space normal'''
+    positions = []
+    for corner in corners:
+        positions.extend( blenderToGltf( corner ) )
+    normals = list( blenderToGltf( normal ) )*4
+    uvs = [ 0.0, 1.0,  1.0, 1.0,  1.0, 0.0,  0.0, 0.0 ]
+    return PrefabMesh( name, positions, normals, uvs, [ 0, 1, 2, 0, 2, 3 ] )
+
+
+def boxMesh( name, halfSize, height ):
+    '''An axis-aligned box standing on z = 0 (Blender space)'''
+    h = halfSize
+    positions = []
+    normals = []
+    uvs = []
+    indices = []
+    faces = [ ( (0, 0, 1), [ (-h, -h, height), (h, -h, height), (h, h, height), (-h, h, height) ] ),
+              ( (0, 0, -1), [ (-h, h, 0), (h, h, 0), (h, -h, 0), (-h, -h, 0) ] ),
+              ( (0, -1, 0), [ (-h, -h, 0), (h, -h, 0), (h, -h, height), (-h, -h, height) ] ),
+              ( (0, 1, 0), [ (h, h, 0), (-h, h, 0), (-h, h, height), (h, h, height) ] ),
+              ( (1, 0, 0), [ (h, -h, 0), (h, h, 0), (h, h, height), (h, -h, height) ] ),
+              ( (-1, 0, 0), [ (-h, h, 0), (-h, -h, 0), (-h, -h, height), (-h, h, height) ] ) ]
+    for normal, corners in faces:
+        base = len(positions)//3
+        for corner in corners:
+            positions.extend( blenderToGltf( corner ) )
+            normals.extend( blenderToGltf( normal ) )
+        uvs.extend( [ 0.0, 1.0,  1.0, 1.0,  1.0, 0.0,  0.0, 0.0 ] )
+        indices.extend( [ base, base + 1, base + 2, base, base + 2, base + 3 ] )
+    return PrefabMesh( name, positions, normals, uvs, indices )
+
+
+def placeholderMesh( name, layerKind, floorTileSize, ceilingHeight ):
+    '''Placeholder geometry of a prefab used in a given layer'''
+    h = floorTileSize/2.0
+    if ( layerKind == "floor" ):
+        return quadMesh( name, [ (-h, -h, 0), (h, -h, 0), (h, h, 0), (-h, h, 0) ], (0, 0, 1) )
+    if ( layerKind == "ceiling" ):
+        return quadMesh( name, [ (-h, h, 0), (h, h, 0), (h, -h, 0), (-h, -h, 0) ], (0, 0, -1) )
+    if ( layerKind == "column" ):
+        return boxMesh( name, floorTileSize*0.05, ceilingHeight )
+    # walls: without rotation a wall faces -Y (see WALL_FACING in tilePlacement.py)
+    return quadMesh( name, [ (-h, 0, 0), (h, 0, 0), (h, 0, ceilingHeight), (-h, 0, ceilingHeight) ], (0, -1, 0) )
+
+
+def readObjMesh( name, fileName ):
+    '''Reads a Wavefront OBJ file (Y-up, i.e. already in glTF axes)
+    into a PrefabMesh. Polygons are triangulated as fans'''
+    coords = []
+    texCoords = []
+    normalsIn = []
+    positions = []
+    normals = []
+    uvs = []
+    indices = []
+    vertexIndex = {}
+    with open( fileName ) as objFile:
+        for line in objFile:
+            parts = line.split()
+            if ( not parts ):
+                continue
+            if ( parts[0] == "v" ):
+                coords.append( tuple( float(c) for c in parts[1:4] ) )
+            elif ( parts[0] == "vt" ):
+                texCoords.append( ( float(parts[1]), 1.0 - float(parts[2]) ) )
+            elif ( parts[0] == "vn" ):
+                normalsIn.append( tuple( float(c) for c in parts[1:4] ) )
+            elif ( parts[0] == "f" ):
+                face = []
+                for corner in parts[1:]:
+                    key = tuple( int(c) if c else 0 for c in ( corner.split('/') + ['', ''] )[:3] )
+                    index = vertexIndex.get( key )
+                    if ( index is None ):
+                        v, t, n = key
+                        index = vertexIndex[key] = len(positions)//3
+                        positions.extend( coords[v - 1 if v > 0 else v] )
+                        uvs.extend( texCoords[t - 1 if t > 0 else t] if t else ( 0.0, 0.0 ) )
+                        normals.extend( normalsIn[n - 1 if n > 0 else n] if n else ( 0.0, 1.0, 0.0 ) )
+                    face.append( index )
+                for k in range( 1, len(face) - 1 ):
+                    indices.extend( [ face[0], face[k], face[k + 1] ] )
+    return PrefabMesh( name, positions, normals, uvs, indices )
+
+
+def tiledQuadsMesh( name, quads ):
+    '''One mesh of the quads of layerQuads, the texture repeated once per cell'''
+    positions = []
+    normals = []
+    uvs = []
+    indices = []
+    for prefabName, corners, normal, ( columns, rows ) in quads:
+        base = len(positions)//3
+        for corner in corners:
+            positions.extend( blenderToGltf( corner ) )
+        normals.extend( list( blenderToGltf( normal ) )*4 )
+        uvs.extend( [ 0.0, float(rows),  float(columns), float(rows),  float(columns), 0.0,  0.0, 0.0 ] )
+        indices.extend( [ base, base + 1, base + 2, base, base + 2, base + 3 ] )
+    return PrefabMesh( name, positions, normals, uvs, indices )
+
+
+class GltfBuilder():
+    '''Collects the glTF JSON and its binary buffer'''
+    def __init__( self ):
+        self.gltf = { "asset": { "version": "2.0", "generator": "DungeonMore gltfExporter" },
+                      "scene": 0,
+                      "scenes": [ { "nodes": [] } ],
+                      "nodes": [],
+                      "meshes": [],
+                      "materials": [],
+                      "accessors": [],
+                      "bufferViews": [],
+                      "buffers": [] }
+        self.buffer = bytearray()
+
+    def addBufferView( self, data, target = None ):
+        '''Appends raw little-endian data to the buffer, returns the view index'''
+        while ( len(self.buffer) % 4 ):
+            self.buffer.append( 0 )
+        view = { "buffer": 0, "byteOffset": len(self.buffer), "byteLength": len(data) }
+        if ( target is not None ):
+            view["target"] = target
+        self.buffer.extend( data )
+        self.gltf["bufferViews"].append( view )
+        return len( self.gltf["bufferViews"] ) - 1
+
+    def addAccessor( self, values, accessorType, width, target = None, bounds = False ):
+        '''Stores a flat list of floats (or unsigned ints for indices)
+        and returns the accessor index'''
+        integer = ( accessorType == "SCALAR" and target == GLTF_ELEMENT_ARRAY_BUFFER )
+        data = array( 'I' if integer else 'f', values )
+        if ( sys.byteorder == "big" ):
+            data.byteswap()
+        accessor = { "bufferView": self.addBufferView( data.tobytes(), target ),
+                     "componentType": GLTF_UNSIGNED_INT if integer else GLTF_FLOAT,
+                     "count": len(values)//width,
+                     "type": accessorType }
+        if ( bounds and values ):
+            accessor["min"] = [ min( values[k::width] ) for k in range( width ) ]
+            accessor["max"] = [ max( values[k::width] ) for k in range( width ) ]
+        self.gltf["accessors"].append( accessor )
+        return len( self.gltf["accessors"] ) - 1
+
+    def addMaterial( self, name ):
+        self.gltf["materials"].append( { "name": name,
+                                         "pbrMetallicRoughness": { "metallicFactor": 0.0 } } )
+        return len( self.gltf["materials"] ) - 1
+
+    def addTexture( self, uri ):
+        '''Adds an image file (mipmapped, clamped) and returns the texture index'''
+        if ( "samplers" not in self.gltf ):
+            self.gltf["samplers"] = [ { "magFilter": GLTF_LINEAR, "minFilter": GLTF_LINEAR_MIPMAP_LINEAR,
+                                        "wrapS": GLTF_CLAMP_TO_EDGE, "wrapT": GLTF_CLAMP_TO_EDGE } ]
+        images = self.gltf.setdefault( "images", [] )
+        images.append( { "uri": uri } )
+        textures = self.gltf.setdefault( "textures", [] )
+        textures.append( { "sampler": 0, "source": len(images) - 1 } )
+        return len(textures) - 1
+
+    def addAtlasMaterial( self, name, atlasFiles ):
+        '''Material using the D (base colour), N (normal) and S (specular,
+        KHR_materials_specular) atlases of a dict channel -> image uri'''
+        material = { "name": name, "pbrMetallicRoughness": { "metallicFactor": 0.0 } }
+        if ( "D" in atlasFiles ):
+            material["pbrMetallicRoughness"]["baseColorTexture"] = { "index": self.addTexture( atlasFiles["D"] ) }
+        if ( "N" in atlasFiles ):
+            material["normalTexture"] = { "index": self.addTexture( atlasFiles["N"] ) }
+        if ( "S" in atlasFiles ):
+            extensionsUsed = self.gltf.setdefault( "extensionsUsed", [] )
+            if ( "KHR_materials_specular" not in extensionsUsed ):
+                extensionsUsed.append( "KHR_materials_specular" )
+            material["extensions"] = { "KHR_materials_specular": { "specularColorTexture": { "index": self.addTexture( atlasFiles["S"] ) } } }
+        self.gltf["materials"].append( material )
+        return len( self.gltf["materials"] ) - 1
+
+    def addMesh( self, mesh, material ):
+        attributes = { "POSITION": self.addAccessor( mesh.positions, "VEC3", 3, GLTF_ARRAY_BUFFER, True ),
+                       "NORMAL": self.addAccessor( mesh.normals, "VEC3", 3, GLTF_ARRAY_BUFFER ),
+                       "TEXCOORD_0": self.addAccessor( mesh.uvs, "VEC2", 2, GLTF_ARRAY_BUFFER ) }
+        primitive = { "attributes": attributes,
+                      "indices": self.addAccessor( mesh.indices, "SCALAR", 1, GLTF_ELEMENT_ARRAY_BUFFER ),
+                      "material": material }
+        self.gltf["meshes"].append( { "name": mesh.name, "primitives": [ primitive ] } )
+        return len( self.gltf["meshes"] ) - 1
+
+    def addInstancedNode( self, name, mesh, translations, rotations ):
+        '''Adds a node drawing the mesh once per (translation, rotation)'''
+        extensionsUsed = self.gltf.setdefault( "extensionsUsed", [] )
+        if ( "EXT_mesh_gpu_instancing" not in extensionsUsed ):
+            extensionsUsed.append( "EXT_mesh_gpu_instancing" )
+        attributes = { "TRANSLATION": self.addAccessor( translations, "VEC3", 3 ),
+                       "ROTATION": self.addAccessor( rotations, "VEC4", 4 ) }
+        node = { "name": name, "mesh": mesh,
+                 "extensions": { "EXT_mesh_gpu_instancing": { "attributes": attributes } } }
+        self.gltf["nodes"].append( node )
+        return len( self.gltf["nodes"] ) - 1
+
+    def addMeshNode( self, name, mesh ):
+        self.gltf["nodes"].append( { "name": name, "mesh": mesh } )
+        return len( self.gltf["nodes"] ) - 1
+
+    def addNode( self, name, children ):
+        self.gltf["nodes"].append( { "name": name, "children": children } )
+        return len( self.gltf["nodes"] ) - 1
+
+    def save( self, fileName ):
+        '''Writes a .glb (single binary file) or a .gltf with a .bin next to it'''
+        while ( len(self.buffer) % 4 ):
+            self.buffer.append( 0 )
+        if ( fileName.lower().endswith( ".glb" ) ):
+            self.gltf["buffers"] = [ { "byteLength": len(self.buffer) } ]
+            jsonData = json.dumps( self.gltf, separators=(',', ':') ).encode( "utf-8" )
+            jsonData += b' '*( (4 - len(jsonData) % 4) % 4 )
+            with open( fileName, "wb" ) as glb:
+                glb.write( struct.pack( "<III", GLB_MAGIC, 2, 12 + 8 + len(jsonData) + 8 + len(self.buffer) ) )
+                glb.write( struct.pack( "<II", len(jsonData), GLB_JSON_CHUNK ) )
+                glb.write( jsonData )
+                glb.write( struct.pack( "<II", len(self.buffer), GLB_BIN_CHUNK ) )
+                glb.write( self.buffer )
+            return
+        binName = os.path.splitext( os.path.basename( fileName ) )[0] + ".bin"
+        self.gltf["buffers"] = [ { "byteLength": len(self.buffer), "uri": binName } ]
+        with open( os.path.join( os.path.dirname( fileName ), binName ), "wb" ) as binFile:
+            binFile.write( self.buffer )
+        with open( fileName, "w" ) as gltfFile:
+            json.dump( self.gltf, gltfFile, indent = 1 )
+
+
+def exportDungeon( reader, fileName, prefabDir = None, atlas = None, mergeQuads = False ):
+    '''Writes a dungeon read by DungeonFileReader as a glTF scene with
+    one instanced node per prefab. atlas is a level atlas layout (see
+    textureAtlas.levelAtlas), mergeQuads merges the floor and ceiling
+    tiles into big quads. Returns a dictionary of statistics'''
+    builder = GltfBuilder()
+    # prefabName -> index of its own material
+    materials = {}
+    def prefabMaterial( prefabName ):
+        if ( prefabName not in materials ):
+            materials[prefabName] = builder.addMaterial( prefabName )
+        return materials[prefabName]
+    atlasMaterial = None
+    if ( atlas is not None ):
+        outputDir = os.path.dirname( os.path.abspath( fileName ) )
+        atlasFiles = dict( ( channel, os.path.relpath( os.path.join( atlas["dir"], name ), outputDir ).replace( os.sep, "/" ) )
+                           for channel, name in atlas["files"].items() )
+        atlasMaterial = builder.addAtlasMaterial( "dungeonAtlas", atlasFiles )
+    layerTransforms = dungeonTransforms( reader )
+    # prefabName -> quads of the merged floor and ceiling rectangles
+    quads = {}
+    if ( mergeQuads ):
+        for layerKind, grid in reader.getGrids().items():
+            if ( grid is None or LAYER_SPECS[layerKind].placement not in QUAD_NORMALS ):
+                continue
+            layerQuadList, layerTransforms[layerKind] = layerQuads( grid, layerKind, reader.floorTileSize, reader.ceilingHeight )
+            for quad in layerQuadList:
+                quads.setdefault( quad[0], [] ).append( quad )
+    # prefabName -> [layerKind, translations, rotations]
+    prefabs = {}
+    quaternions = {}
+    for layerKind, transforms in layerTransforms.items():
+        for prefabName, location, rotation in transforms:
+            prefab = prefabs.get( prefabName )
+            if ( prefab is None ):
+                prefab = prefabs[prefabName] = [ layerKind, [], [] ]
+            quaternion = quaternions.get( rotation )
+            if ( quaternion is None ):
+                quaternion = quaternions[rotation] = eulerToGltfQuaternion( rotation )
+            prefab[1].extend( blenderToGltf( location ) )
+            prefab[2].extend( quaternion )
+    children = []
+    vertices = 0
+    drawnVertices = 0
+    for prefabName in sorted( prefabs ):
+        layerKind, translations, rotations = prefabs[prefabName]
+        objFileName = os.path.join( prefabDir, prefabName + ".obj" ) if prefabDir else None
+        if ( objFileName and os.path.isfile( objFileName ) ):
+            mesh = readObjMesh( prefabName, objFileName )
+        else:
+            mesh = placeholderMesh( prefabName, layerKind, reader.floorTileSize, reader.ceilingHeight )
+        transform = uvTransform( atlas, prefabName ) if atlas is not None else None
+        if ( transform is not None ):
+            mesh.uvs = remapUVs( mesh.uvs, transform )
+            material = atlasMaterial
+        else:
+            material = prefabMaterial( prefabName )
+        meshIndex = builder.addMesh( mesh, material )
+        children.append( builder.addInstancedNode( prefabName, meshIndex, translations, rotations ) )
+        vertices += mesh.vertexCount()
+        drawnVertices += mesh.vertexCount()*( len(translations)//3 )
+    for prefabName in sorted( quads ):
+        mesh = tiledQuadsMesh( prefabName + "_quads", quads[prefabName] )
+        children.append( builder.addMeshNode( mesh.name, builder.addMesh( mesh, prefabMaterial( prefabName ) ) ) )
+        vertices += mesh.vertexCount()
+        drawnVertices += mesh.vertexCount()
+    builder.gltf["scenes"][0]["nodes"].append( builder.addNode( "dungeon", children ) )
+    builder.save( fileName )
+    return { "prefabs": len( set( prefabs ) | set( quads ) ),
+             "materials": len( builder.gltf["materials"] ),
+             "tiles": sum( len(p[1])//3 for p in prefabs.values() ),
+             "quads": sum( len(q) for q in quads.values() ),
+             "meshVertices": vertices,
+             "drawnVertices": drawnVertices,
+             "bytes": len(builder.buffer) }
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Converts a Tiled (TMX) dungeon into a glTF 2.0 scene" )
+    parser.add_argument( "tmx", help = "TMX file to convert" )
+    parser.add_argument( "-o", "--output", help = "output .gltf or .glb file (default: next to the TMX file, .glb)" )
+    parser.add_argument( "--prefab-dir", help = "directory with <prefabName>.obj models of the prefabs" )
+    parser.add_argument( "--no-cull", action = "store_true", help = "keep the walls which can not be seen" )
+    parser.add_argument( "--streaming", action = "store_true", help = "read the TMX file with the streaming loader" )
+    parser.add_argument( "--auto-walls", action = "store_true", help = "derive the wall layers from the floor layer" )
+    parser.add_argument( "--nav", action = "store_true", help = "also write the navigation tables next to the output (.nav)" )
+    parser.add_argument( "--lights", action = "store_true", help = "also bake the torch light next to the output (.light.png)" )
+    parser.add_argument( "--pvs", action = "store_true", help = "also write the potentially visible sets next to the output (.pvs)" )
+    parser.add_argument( "--merge-quads", action = "store_true", help = "merge the floor and ceiling tiles into big quads" )
+    parser.add_argument( "--atlas", help = "pack the prefab textures into atlases cached in this directory (one material)" )
+    parser.add_argument( "--dungeons", default = os.path.join( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ), "Dungeons" ),
+                         help = "directory of the dungeon sets (prefab textures of --atlas)" )
+    parser.add_argument( "--max-texture-size", type = int, help = "halve the atlas textures bigger than this" )
+    parser.add_argument( "--cache", help = "directory of the parsed level cache (see levelCache.py)" )
+    parser.add_argument( "--profile", help = "JSON file for the time, peak memory and counters of every stage" )
+    parser.add_argument( "-j", "--jobs", type = int, default = 1, help = "number of worker processes of the light baking and the PVS" )
+    args = parser.parse_args( argv )
+
+    output = args.output or os.path.splitext( args.tmx )[0] + ".glb"
+    start = time.perf_counter()
+    profiler = StageProfiler( traceMemory = True ) if args.profile else NULL_PROFILER
+    reader = DungeonFileReader()
+    cache = LevelCache( args.cache ) if args.cache else None
+    reader.readDungeonFromFile( args.tmx, streaming = args.streaming, cache = cache, profiler = profiler )
+    if ( args.auto_walls ):
+        with profiler.stage( "autoWalls" ):
+            deriveWalls( reader )
+    if ( not args.no_cull ):
+        with profiler.stage( "cull" ):
+            for layerKind, removed in cullHiddenWalls( reader ).items():
+                profiler.count( "wallsRemoved", removed, layerKind )
+    atlas = None
+    if ( args.atlas ):
+        with profiler.stage( "atlas" ):
+            atlas = levelAtlas( reader, PrefabLibrary( args.dungeons ), args.atlas,
+                                AtlasParameters( maxTextureSize = args.max_texture_size ), profiler )
+    with profiler.stage( "export" ):
+        stats = exportDungeon( reader, output, args.prefab_dir, atlas, args.merge_quads )
+        profiler.count( "tiles", stats["tiles"] )
+    graph = None
+    if ( args.nav ):
+        with profiler.stage( "navigation" ):
+            graph = buildNavGraph( reader )
+            graph.save( navFileName( output ) )
+    if ( args.lights ):
+        with profiler.stage( "lights" ):
+            bakeLights( reader, workers = args.jobs, graph = graph ).save( lightFileName( output ) )
+    if ( args.pvs ):
+        with profiler.stage( "pvs" ):
+            buildPVS( reader, workers = args.jobs, graph = graph ).save( pvsFileName( output ) )
+    if ( args.profile ):
+        profiler.stop()
+        profiler.save( args.profile )
+    print( "%s: %d tiles and %d quads of %d prefabs, %d materials -> %s (%.3f s)" %
+           ( args.tmx, stats["tiles"], stats["quads"], stats["prefabs"], stats["materials"], output, time.perf_counter() - start ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
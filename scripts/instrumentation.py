@@ -0,0 +1,137 @@
+import json
+import time
+import tracemalloc
+
+#====================================================
+# Opt-in instrumentation of the pipeline: wall time,
+# peak memory and counters of every stage (parse,
+# decode, resolve, cull, instancing ...), optionally
+# split per layer (floor, wallN, ..., ceiling).
+# The reader and the generator use NULL_PROFILER by
+# default, whose methods do nothing, so instrumentation
+# costs a couple of method calls per stage when it is
+# disabled
+#====================================================
+
+
+class NullStage():
+    '''Context manager of a stage which is not recorded'''
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class NullProfiler():
+    '''Profiler which records nothing'''
+    enabled = False
+
+    def stage( self, name, layer = None ):
+        return NULL_STAGE
+
+    def count( self, name, value = 1, layer = None ):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class ProfiledStage():
+    '''Context manager recording a single stage of a StageProfiler'''
+    def __init__( self, profiler, name, layer ):
+        self.profiler = profiler
+        self.record = { "stage": name, "layer": layer, "seconds": 0.0, "peakBytes": None, "counters": {} }
+        self.childPeak = 0
+
+    def __enter__( self ):
+        profiler = self.profiler
+        if ( profiler.traceMemory ):
+            if ( profiler.stack ):
+                # the peak reached so far belongs to the enclosing stage
+                parent = profiler.stack[-1]
+                parent.childPeak = max( parent.childPeak, tracemalloc.get_traced_memory()[1] )
+            tracemalloc.reset_peak()
+        profiler.stack.append( self )
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        self.record["seconds"] = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        if ( profiler.traceMemory ):
+            peak = max( self.childPeak, tracemalloc.get_traced_memory()[1] )
+            self.record["peakBytes"] = peak
+            if ( profiler.stack ):
+                parent = profiler.stack[-1]
+                parent.childPeak = max( parent.childPeak, peak )
+        profiler.records.append( self.record )
+        if ( profiler.callback is not None ):
+            profiler.callback( self.record )
+        return False
+
+
+class StageProfiler():
+    '''Records wall time, peak memory (with traceMemory = True, through
+    tracemalloc) and counters of the stages of the pipeline.
+    callback, if given, is called with the record of every finished stage'''
+    enabled = True
+
+    def __init__( self, traceMemory = False, callback = None ):
+        self.traceMemory = traceMemory
+        self.callback = callback
+        self.records = []
+        self.stack = []
+        # counters not belonging to any stage: (name, layer) -> value
+        self.counters = {}
+        self.startedTracing = False
+        if ( traceMemory and not tracemalloc.is_tracing() ):
+            tracemalloc.start()
+            self.startedTracing = True
+
+    def stage( self, name, layer = None ):
+        '''Context manager timing a stage, e.g.
+        with profiler.stage( "decode", "floor" ): ...'''
+        return ProfiledStage( self, name, layer )
+
+    def count( self, name, value = 1, layer = None ):
+        '''Adds value to a counter of the innermost running stage, split
+        per layer when a layer is given'''
+        key = name if layer is None else "%s.%s" % ( name, layer )
+        if ( self.stack ):
+            counters = self.stack[-1].record["counters"]
+        else:
+            counters = self.counters
+        counters[key] = counters.get( key, 0 ) + value
+
+    def stop( self ):
+        '''Stops tracing memory if this profiler started it'''
+        if ( self.startedTracing ):
+            tracemalloc.stop()
+            self.startedTracing = False
+
+    def report( self ):
+        '''Returns the structured report: every stage record in the order
+        the stages finished, totals per stage name and all the counters'''
+        totals = {}
+        counters = dict( self.counters )
+        for record in self.records:
+            total = totals.setdefault( record["stage"], { "seconds": 0.0, "calls": 0, "peakBytes": None } )
+            total["seconds"] += record["seconds"]
+            total["calls"] += 1
+            if ( record["peakBytes"] is not None ):
+                total["peakBytes"] = max( total["peakBytes"] or 0, record["peakBytes"] )
+            for key, value in record["counters"].items():
+                counters[key] = counters.get( key, 0 ) + value
+        return { "stages": list( self.records ), "totals": totals, "counters": counters }
+
+    def toJSON( self, indent = 1 ):
+        return json.dumps( self.report(), indent = indent )
+
+    def save( self, fileName ):
+        with open( fileName, "w" ) as reportFile:
+            reportFile.write( self.toJSON() )
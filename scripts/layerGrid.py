@@ -0,0 +1,232 @@
+import re
+from array import array
+
+#====================================================
+# NOTE: a layer grid stores one small integer (symbol)
+# per cell instead of a prefab name. Symbols index a
+# PrefabSymbols table shared by all the layers of a map.
+# Symbol 0 is always "None", i.e. an empty cell
+#====================================================
+
+NO_PREFAB = "None"
+
+# matches every non-empty cell of a grid stored as bytes
+OCCUPIED_PATTERN = re.compile( b'[^\x00]' )
+# matches a run of cells holding the same prefab in a grid stored as bytes
+RUN_PATTERN = re.compile( b'([^\x00])\\1*', re.DOTALL )
+# maps every non-zero byte to 1
+MASK_TABLE = bytes( [0] + [1]*255 )
+# maps every non-zero byte to 0xFF, turns a 0/1 mask into a byte mask
+FULL_BYTE_TABLE = bytes( [0] + [0xFF]*255 )
+
+
+class PrefabSymbols():
+    '''Table of prefab names shared by the layer grids of a map.
+    Converts names to small integers (symbols) and back'''
+    def __init__(self):
+        self.names = [NO_PREFAB]
+        self.symbols = { NO_PREFAB: 0 }
+
+    def __len__( self ):
+        return len( self.names )
+
+    def add( self, prefabName ):
+        '''Returns the symbol of a prefab name, adding it if needed'''
+        symbol = self.symbols.get( prefabName )
+        if ( symbol is None ):
+            symbol = len( self.names )
+            self.names.append( prefabName )
+            self.symbols[prefabName] = symbol
+        return symbol
+
+    def get( self, prefabName ):
+        '''Returns the symbol of a prefab name or None if it is unknown'''
+        return self.symbols.get( prefabName )
+
+    def name( self, symbol ):
+        '''Returns the prefab name of a symbol'''
+        return self.names[symbol]
+
+
+class LayerGrid():
+    '''A layer of the map stored as a row-major array of symbols
+    (one byte per cell as long as there are less than 256 prefabs)'''
+    def __init__( self, width, height, symbols, cells = None ):
+        self.width = width
+        self.height = height
+        self.symbols = symbols
+        if ( cells is None ):
+            cells = array( self.typecodeFor( len(symbols) ), [0] )*( width*height )
+        self.cells = cells
+
+    @staticmethod
+    def typecodeFor( symbolCount ):
+        '''Smallest array typecode able to store symbolCount symbols'''
+        return 'B' if symbolCount <= 256 else 'H'
+
+    def __len__( self ):
+        return len( self.cells )
+
+    def index( self, i, j ):
+        '''Position of the cell in row i, column j within self.cells'''
+        return i*self.width + j
+
+    def cell( self, i, j ):
+        '''Prefab name of the cell in row i, column j'''
+        return self.symbols.names[self.cells[i*self.width + j]]
+
+    def setCell( self, i, j, prefabName ):
+        '''Puts a prefab into the cell in row i, column j'''
+        symbol = self.symbols.add( prefabName )
+        if ( symbol > 255 and self.cells.typecode == 'B' ):
+            self.cells = array( 'H', self.cells )
+        self.cells[i*self.width + j] = symbol
+
+    def occupiedIndices( self ):
+        '''Iterates over the positions (in self.cells) of non-empty cells'''
+        if ( self.cells.typecode == 'B' ):
+            return ( m.start() for m in OCCUPIED_PATTERN.finditer( self.cells.tobytes() ) )
+        return ( k for k, s in enumerate( self.cells ) if s )
+
+    def occupiedCells( self ):
+        '''Iterates over (row, column, prefabName) of non-empty cells only'''
+        names = self.symbols.names
+        cells = self.cells
+        width = self.width
+        for k in self.occupiedIndices():
+            i, j = divmod( k, width )
+            yield i, j, names[cells[k]]
+
+    def cellsWithPrefab( self, prefabName ):
+        '''Returns a list of (row, column) of all the cells with a given prefab'''
+        symbol = self.symbols.get( prefabName )
+        if ( symbol is None ):
+            return []
+        width = self.width
+        if ( self.cells.typecode == 'B' ):
+            buf = self.cells.tobytes()
+            needle = bytes( [symbol] )
+            found = []
+            k = buf.find( needle )
+            while ( k != -1 ):
+                found.append( divmod( k, width ) )
+                k = buf.find( needle, k + 1 )
+            return found
+        return [ divmod( k, width ) for k, s in enumerate( self.cells ) if s == symbol ]
+
+    def counts( self ):
+        '''Returns a dictionary prefabName -> number of cells
+        (empty cells are not counted)'''
+        names = self.symbols.names
+        result = {}
+        if ( self.cells.typecode == 'B' ):
+            buf = self.cells.tobytes()
+            for symbol in range( 1, min( len(names), 256 ) ):
+                count = buf.count( bytes( [symbol] ) )
+                if ( count ):
+                    result[names[symbol]] = count
+            return result
+        for s in self.cells:
+            if ( s ):
+                result[names[s]] = result.get( names[s], 0 ) + 1
+        return result
+
+    def nonEmptyMask( self ):
+        '''Returns a bytearray with 1 for every non-empty cell and 0 otherwise'''
+        if ( self.cells.typecode == 'B' ):
+            return bytearray( self.cells.tobytes().translate( MASK_TABLE ) )
+        return bytearray( 1 if s else 0 for s in self.cells )
+
+    def occupiedCount( self ):
+        '''Number of non-empty cells'''
+        if ( self.cells.typecode == 'B' ):
+            return len( self.cells ) - self.cells.tobytes().count( b'\x00' )
+        return len( self.cells ) - self.cells.count( 0 )
+
+    def rectangles( self ):
+        '''Greedy meshing: covers the non-empty cells with rectangles of a
+        single prefab each, every rectangle first as wide and then as high
+        as possible. Returns a list of (row, column, rows, columns, prefabName)'''
+        width = self.width
+        remaining = array( self.cells.typecode, self.cells )
+        names = self.symbols.names
+        byteCells = ( remaining.typecode == 'B' )
+        found = []
+        for i in range( self.height ):
+            rowEnd = ( i + 1 )*width
+            j = i*width
+            while True:
+                if ( byteCells ):
+                    m = RUN_PATTERN.search( remaining, j, rowEnd )
+                    if ( m is None ):
+                        break
+                    j, runEnd = m.span()
+                else:
+                    while ( j < rowEnd and not remaining[j] ):
+                        j += 1
+                    if ( j == rowEnd ):
+                        break
+                    runEnd = j + 1
+                    while ( runEnd < rowEnd and remaining[runEnd] == remaining[j] ):
+                        runEnd += 1
+                run = remaining[j:runEnd]
+                # rows below holding the same run, compared a whole run at once
+                below = j + width
+                while ( below < len(remaining) and remaining[below:below + len(run)] == run ):
+                    below += width
+                rows = ( below - j )//width
+                empty = array( remaining.typecode, bytes( len(run)*remaining.itemsize ) )
+                for k in range( j, below, width ):
+                    remaining[k:k + len(run)] = empty
+                found.append( ( i, j - i*width, rows, len(run), names[run[0]] ) )
+                j = runEnd
+        return found
+
+    def toMatrix( self ):
+        '''Materialises the grid as a list of lists of prefab names'''
+        names = self.symbols.names
+        width = self.width
+        rowNames = [ names[s] for s in self.cells ]
+        return [ rowNames[i*width:(i+1)*width] for i in range( 0, len(rowNames)//width if width else 0 ) ]
+
+
+#====================================================
+# Cell masks: one byte (0 or 1) per cell, row-major,
+# as returned by LayerGrid.nonEmptyMask. Whole masks
+# are combined at once (as big integers) instead of
+# cell by cell
+#====================================================
+
+def shiftMask( mask, width, height, di, dj ):
+    '''Mask of the cells whose neighbour (i+di, j+dj) is set in mask
+    (cells outside of the map count as not set). di, dj are -1, 0 or 1'''
+    size = width*height
+    offset = di*width + dj
+    # (a shift may be longer than a map of a single row or column)
+    if ( offset >= 0 ):
+        shifted = mask[offset:size] + bytearray( min( offset, size ) )
+    else:
+        shifted = bytearray( min( -offset, size ) ) + mask[:max( size + offset, 0 )]
+    if ( dj == 1 ):
+        shifted[width - 1::width] = bytes( height )
+    elif ( dj == -1 ):
+        shifted[0::width] = bytes( height )
+    return shifted
+
+
+def maskAnd( a, *others ):
+    value = int.from_bytes( a, "little" )
+    for b in others:
+        value &= int.from_bytes( b, "little" )
+    return bytearray( value.to_bytes( len(a), "little" ) )
+
+
+def maskOr( a, *others ):
+    value = int.from_bytes( a, "little" )
+    for b in others:
+        value |= int.from_bytes( b, "little" )
+    return bytearray( value.to_bytes( len(a), "little" ) )
+
+
+def maskNot( a ):
+    return bytearray( a.translate( bytes( [1] + [0]*255 ) ) )
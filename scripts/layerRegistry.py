@@ -0,0 +1,65 @@
+#====================================================
+# Declarative registry of the layers of a dungeon map.
+# Every entry tells which TMX layer(s) to read, the
+# tileset resolving its gid's into prefab names, how
+# its tiles are placed (see tilePlacement.py) and the
+# group (scene layer/collection) they go to.
+# Adding a layer only takes a new entry: all the layers
+# are decoded in the same pass over the map
+#====================================================
+
+
+class LayerSpec():
+    '''Description of a single layer of the map'''
+    def __init__( self, kind, layerNames, tilesetName, placement, group, prefabOffsets = None ):
+        # key of the layer grid, e.g. "wallN" (see DungeonFileReader.getGrids)
+        self.kind = kind
+        # names of the layer in the TMX files, the first one found is read
+        self.layerNames = layerNames
+        self.tilesetName = tilesetName
+        # placement rule of the tiles (see tilePlacement.placementRule)
+        self.placement = placement
+        # scene layer (2.7x) or collection (2.8+, <group>Objects) of the tiles
+        self.group = group
+        # prefabName -> (x, y, z) displacement in floor tile sizes, added
+        # to the placement rule for the prefabs which need their own
+        self.prefabOffsets = prefabOffsets or {}
+
+
+# NOTE: wall boxes and torch holders are stored in the same tileset as
+# the wall tiles. Ceiling bars are moved to the edge of their cell
+# depending on the prefab
+LAYER_REGISTRY = [ LayerSpec( "floor", ( "floorTiles", "floor" ), "floorTiles", "floor", "floor" ),
+                   LayerSpec( "wallN", ( "wallTilesN", "wallsN" ), "wallTiles", "wallN", "wall" ),
+                   LayerSpec( "wallS", ( "wallTilesS", "wallsS" ), "wallTiles", "wallS", "wall" ),
+                   LayerSpec( "wallE", ( "wallTilesE", "wallsE" ), "wallTiles", "wallE", "wall" ),
+                   LayerSpec( "wallW", ( "wallTilesW", "wallsW" ), "wallTiles", "wallW", "wall" ),
+                   LayerSpec( "column", ( "columns", ), "columnTiles", "column", "column" ),
+                   LayerSpec( "ceiling", ( "ceilingTiles", "ceiling" ), "ceilingTiles", "ceiling", "ceiling" ),
+                   LayerSpec( "wallBox", ( "wallBoxes", ), "wallTiles", "decoration", "wall" ),
+                   LayerSpec( "torch", ( "torchTiles", ), "wallTiles", "decoration", "wall" ),
+                   LayerSpec( "chain", ( "chainTiles", ), "chainTiles", "decoration", "wall" ),
+                   LayerSpec( "ceilingBar", ( "ceilingBars", ), "ceilingBars", "decoration", "ceilingBar",
+                              prefabOffsets = { "ceilingBar01": ( -0.5, 0.0, 0.0 ),
+                                                "ceilingBar02": ( 0.0, 0.5, 0.0 ) } ) ]
+
+# layer kind -> LayerSpec
+LAYER_SPECS = dict( ( spec.kind, spec ) for spec in LAYER_REGISTRY )
+
+
+def registerLayer( spec ):
+    '''Adds a layer to the registry (or replaces the one of the same kind)'''
+    if ( spec.kind in LAYER_SPECS ):
+        LAYER_REGISTRY[LAYER_REGISTRY.index( LAYER_SPECS[spec.kind] )] = spec
+    else:
+        LAYER_REGISTRY.append( spec )
+    LAYER_SPECS[spec.kind] = spec
+
+
+def layerNameIndex( registry = None ):
+    '''Returns a dictionary TMX layer name -> LayerSpec'''
+    index = {}
+    for spec in ( registry if registry is not None else LAYER_REGISTRY ):
+        for layerName in spec.layerNames:
+            index.setdefault( layerName, spec )
+    return index
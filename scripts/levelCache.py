@@ -0,0 +1,220 @@
+import hashlib
+import mmap
+import os
+from array import array
+
+from ReadDungeonClass import READER_VERSION
+from binaryTables import readHeader, writeTableFile
+from layerGrid import LayerGrid, PrefabSymbols
+from layerRegistry import LAYER_REGISTRY
+
+#====================================================
+# On-disk cache of parsed levels.
+# An entry is keyed by the hash of the TMX file content,
+# READER_VERSION and the layer registry, so an edited
+# file, a changed reader or a registered layer never
+# hits a stale entry.
+#
+# Entry file layout (see binaryTables.py), magic "DMLC":
+#   header: JSON (map size, prefab names, tileset index,
+#           offset/length/typecode of every layer grid and
+#           offset/length of the flip flags of every layer)
+#   tables: raw cells of every layer grid and flags of
+#   every layer
+# The file is memory-mapped and every grid is copied
+# out of it with a single memcpy, no per-cell objects
+#====================================================
+
+CACHE_MAGIC = b'DMLC'
+CACHE_FORMAT_VERSION = 2
+CACHE_SUFFIX = ".dmlc"
+
+
+def registryDescription():
+    '''The parts of the layer registry the cached grids depend on: the
+    kind, TMX layer names and tileset of every layer'''
+    return repr( [ ( spec.kind, tuple( spec.layerNames ), spec.tilesetName ) for spec in LAYER_REGISTRY ] )
+
+
+class LevelCache():
+    '''Content-hashed cache of the layer grids (and flip flags) of parsed levels,
+    limited to maxBytes in total (least recently used entries are
+    evicted first)'''
+    def __init__( self, cacheDir, maxBytes = 256*1024*1024 ):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # file name -> (size, mtime, registry, key) of the last hashed files
+        self.keys = {}
+        if ( not os.path.isdir( cacheDir ) ):
+            os.makedirs( cacheDir )
+
+    def key( self, fileName ):
+        '''Hash of the file content, of the reader version and of the layer
+        registry. Files which did not change (same size and mtime) are not
+        rehashed as long as the registry did not change either'''
+        info = os.stat( fileName )
+        registry = registryDescription()
+        known = self.keys.get( fileName )
+        if ( known is not None and known[:3] == ( info.st_size, info.st_mtime_ns, registry ) ):
+            return known[3]
+        digest = hashlib.blake2b( digest_size = 20 )
+        digest.update( b'reader%d/cache%d;' % ( READER_VERSION, CACHE_FORMAT_VERSION ) )
+        digest.update( registry.encode( "utf-8" ) )
+        with open( fileName, "rb" ) as tmx:
+            for block in iter( lambda: tmx.read( 1 << 20 ), b'' ):
+                digest.update( block )
+        key = digest.hexdigest()
+        self.keys[fileName] = ( info.st_size, info.st_mtime_ns, registry, key )
+        return key
+
+    def entryName( self, key ):
+        return os.path.join( self.cacheDir, key + CACHE_SUFFIX )
+
+    def load( self, reader, fileName ):
+        '''Fills a DungeonFileReader from the cache.
+        Returns False (and leaves the reader untouched) on a miss'''
+        entryName = self.entryName( self.key( fileName ) )
+        if ( not self.readEntry( reader, entryName ) ):
+            self.misses += 1
+            return False
+        reader.mapFileName = fileName
+        # mark the entry as recently used
+        os.utime( entryName )
+        self.hits += 1
+        return True
+
+    def readEntry( self, reader, entryName ):
+        '''Fills a DungeonFileReader from an entry file.
+        Returns False if there is no valid entry (missing, corrupt or
+        truncated)'''
+        try:
+            entry = open( entryName, "rb" )
+        except OSError:
+            return False
+        with entry:
+            if ( os.fstat( entry.fileno() ).st_size == 0 ):
+                return False
+            with mmap.mmap( entry.fileno(), 0, access = mmap.ACCESS_READ ) as data:
+                try:
+                    header = readHeader( data, CACHE_MAGIC, CACHE_FORMAT_VERSION, entryName, "level cache" )
+                except ValueError:
+                    return False
+                symbols = PrefabSymbols()
+                for name in header["symbols"][1:]:
+                    symbols.add( name )
+                size = len(data)
+                if ( any( table["offset"] + table["length"] > size for table in header["layers"] + header["flags"] ) ):
+                    return False
+                view = memoryview( data )
+                grids = {}
+                try:
+                    for layer in header["layers"]:
+                        cells = array( layer["typecode"] )
+                        cells.frombytes( view[layer["offset"]:layer["offset"] + layer["length"]] )
+                        if ( len(cells) != header["width"]*layer["height"] ):
+                            return False
+                        grids[layer["kind"]] = LayerGrid( header["width"], layer["height"], symbols, cells )
+                except ValueError:
+                    # not a whole number of cells
+                    return False
+                finally:
+                    view.release()
+                layerFlags = dict( ( flags["name"], bytes( data[flags["offset"]:flags["offset"] + flags["length"]] ) )
+                                   for flags in header["flags"] )
+        reader.mapWidth = header["width"]
+        reader.mapHeight = header["height"]
+        reader.tilesetIndex = self.decodeTilesetIndex( header["tilesetIndex"] )
+        reader.layerFlags = layerFlags
+        # nothing of a previous read may be left over
+        reader.layerGIDs = {}
+        reader.tilesets = []
+        reader.layers = []
+        reader.setGrids( grids, symbols )
+        return True
+
+    def store( self, reader, fileName ):
+        '''Writes the layer grids and flags of a DungeonFileReader into the cache'''
+        self.writeEntry( reader, self.entryName( self.key( fileName ) ) )
+        self.stores += 1
+        self.evict()
+
+    def writeEntry( self, reader, entryName ):
+        '''Writes the layer grids and flags of a DungeonFileReader into an entry file'''
+        layers = []
+        blobs = []
+        for layerKind, grid in reader.getGrids().items():
+            if ( grid is None ):
+                continue
+            blob = grid.cells.tobytes()
+            layers.append( { "kind": layerKind, "typecode": grid.cells.typecode,
+                             "height": grid.height, "length": len(blob) } )
+            blobs.append( blob )
+        flags = []
+        for layerName in sorted( reader.layerFlags ):
+            blob = bytes( reader.layerFlags[layerName] )
+            flags.append( { "name": layerName, "length": len(blob) } )
+            blobs.append( blob )
+        header = { "width": reader.mapWidth,
+                   "height": reader.mapHeight,
+                   "symbols": reader.prefabSymbols.names,
+                   "tilesetIndex": self.encodeTilesetIndex( reader.tilesetIndex ),
+                   "layers": layers,
+                   "flags": flags }
+        writeTableFile( entryName, CACHE_MAGIC, CACHE_FORMAT_VERSION, header, layers + flags, blobs )
+
+    def encodeTilesetIndex( self, tilesetIndex ):
+        '''Tileset index with its integer keys turned into strings (for JSON)'''
+        return dict( (name, { "firstgid": tileset["firstgid"],
+                              "properties": dict( (str(k), v) for k, v in tileset["properties"].items() ),
+                              "prefabs": dict( (str(k), v) for k, v in tileset["prefabs"].items() ) })
+                     for name, tileset in tilesetIndex.items() )
+
+    def decodeTilesetIndex( self, encoded ):
+        return dict( (name, { "firstgid": tileset["firstgid"],
+                              "properties": dict( (int(k), v) for k, v in tileset["properties"].items() ),
+                              "prefabs": dict( (int(k), v) for k, v in tileset["prefabs"].items() ) })
+                     for name, tileset in encoded.items() )
+
+    def entries( self ):
+        '''Returns a list of (lastUse, size, fileName) of all the entries'''
+        result = []
+        for name in os.listdir( self.cacheDir ):
+            if ( name.endswith( CACHE_SUFFIX ) ):
+                fileName = os.path.join( self.cacheDir, name )
+                info = os.stat( fileName )
+                result.append( ( info.st_mtime, info.st_size, fileName ) )
+        return result
+
+    def evict( self ):
+        '''Removes the least recently used entries until the cache
+        fits into maxBytes'''
+        entries = sorted( self.entries() )
+        total = sum( size for lastUse, size, fileName in entries )
+        for lastUse, size, fileName in entries:
+            if ( total <= self.maxBytes ):
+                break
+            os.remove( fileName )
+            total -= size
+            self.evictions += 1
+
+    def clear( self ):
+        '''Removes all the entries'''
+        for lastUse, size, fileName in self.entries():
+            os.remove( fileName )
+
+    def statistics( self ):
+        '''Returns a dictionary of cache statistics'''
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return { "hits": self.hits,
+                 "misses": self.misses,
+                 "hitRate": float(self.hits)/lookups if lookups else 0.0,
+                 "stores": self.stores,
+                 "evictions": self.evictions,
+                 "entries": len(entries),
+                 "bytes": sum( size for lastUse, size, fileName in entries ),
+                 "maxBytes": self.maxBytes }
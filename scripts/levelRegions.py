@@ -0,0 +1,303 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from ReadDungeonClass import DungeonFileReader
+from binaryTables import layoutTables, planTableFile, readHeader, tablesStart, writeTableFile
+from layerGrid import NO_PREFAB, OCCUPIED_PATTERN, LayerGrid, PrefabSymbols
+from layerRegistry import LAYER_REGISTRY
+
+#====================================================
+# Region queries over a level without loading it: the
+# decoded layer grids are written once into a tiled
+# binary file which is memory-mapped, so reading a
+# cell or a small window only touches the pages of the
+# tiles it overlaps. Opening a file reads its header
+# only, whatever the size of the map.
+#
+# File layout (see binaryTables.py), magic "DMRG":
+#   header: JSON (map size, tile size, prefab names,
+#           typecode, offset and length of the tile
+#           table of every layer)
+#   per layer, a tile table: u64 offset of every tile
+#   (rows of tiles, 0 for a tile without any prefab)
+#   tiles: tileSize x tileSize cells (row-major, the
+#   tiles on the right and bottom borders padded with
+#   empty cells), 8-byte aligned. Identical tiles
+#   (e.g. a filled ceiling) are stored once.
+#
+# Coordinates are x (column) and y (row), rectangles
+# are [x0, x1) x [y0, y1)
+#====================================================
+
+REGION_MAGIC = b'DMRG'
+REGION_FORMAT_VERSION = 2
+REGION_SUFFIX = ".dmrg"
+DEFAULT_TILE_SIZE = 64
+
+
+def regionFileName( fileName ):
+    '''Region file of a TMX (or exported) level: same name, .dmrg'''
+    return os.path.splitext( fileName )[0] + REGION_SUFFIX
+
+
+def layerTiles( grid, tileSize ):
+    '''Raw bytes of every tile of a layer grid (rows of tiles), None
+    for the tiles without any prefab. The grid has the size of the map'''
+    itemSize = grid.cells.itemsize
+    cells = grid.cells
+    if ( sys.byteorder == "big" and itemSize > 1 ):
+        cells = array( cells.typecode, cells )
+        cells.byteswap()
+    data = memoryview( cells ).cast( 'B' )
+    width, height = grid.width, grid.height
+    tileRow = tileSize*itemSize
+    tiles = []
+    for top in range( 0, height, tileSize ):
+        rows = min( tileSize, height - top )
+        for left in range( 0, width, tileSize ):
+            columns = min( tileSize, width - left )
+            rowBytes = columns*itemSize
+            padding = b'\x00'*( tileRow - rowBytes )
+            tile = b''.join( data[( ( top + k )*width + left )*itemSize:( ( top + k )*width + left )*itemSize + rowBytes].tobytes() + padding
+                             for k in range( rows ) )
+            tile += b'\x00'*( tileRow*( tileSize - rows ) )
+            tiles.append( tile if tile.count( 0 ) != len(tile) else None )
+    return tiles
+
+
+def writeRegionFile( reader, fileName, tileSize = DEFAULT_TILE_SIZE ):
+    '''Writes the layer grids of a DungeonFileReader into a region file'''
+    grids = reader.getGrids()
+    tilesWide = -( -reader.mapWidth//tileSize )
+    layers = []
+    for spec in LAYER_REGISTRY:
+        grid = grids.get( spec.kind )
+        # layers missing from the map have an empty grid
+        if ( grid is None or len(grid) == 0 ):
+            continue
+        if ( ( grid.width, grid.height ) != ( reader.mapWidth, reader.mapHeight ) ):
+            raise ValueError( "Layer %s is %dx%d, the map %dx%d" % ( spec.kind, grid.width, grid.height,
+                                                                  reader.mapWidth, reader.mapHeight ) )
+        layers.append( ( spec.kind, grid.cells.typecode, layerTiles( grid, tileSize ) ) )
+    entries = [ { "kind": kind, "typecode": typecode, "length": 8*len(tiles) } for kind, typecode, tiles in layers ]
+    header = { "width": reader.mapWidth,
+               "height": reader.mapHeight,
+               "tileSize": tileSize,
+               "tilesWide": tilesWide,
+               "symbols": reader.prefabSymbols.names,
+               "layers": entries }
+    headerLength = planTableFile( header, entries )
+    # the distinct tiles follow the tile tables, which hold their offsets
+    tileEntries = {}
+    tables = []
+    for kind, typecode, tiles in layers:
+        for tile in tiles:
+            if ( tile is not None and tile not in tileEntries ):
+                tileEntries[tile] = { "length": len(tile) }
+    tilesStart = entries[-1]["offset"] + entries[-1]["length"] if entries else tablesStart( headerLength )
+    end = layoutTables( list( tileEntries.values() ), tilesStart )
+    for kind, typecode, tiles in layers:
+        table = array( 'Q', ( 0 if tile is None else tileEntries[tile]["offset"] for tile in tiles ) )
+        if ( sys.byteorder == "big" ):
+            table.byteswap()
+        tables.append( table.tobytes() )
+    writeTableFile( fileName, REGION_MAGIC, REGION_FORMAT_VERSION, header, entries + list( tileEntries.values() ),
+                    tables + list( tileEntries ), headerLength )
+    return { "layers": len(layers), "tiles": sum( len(tiles) for kind, typecode, tiles in layers ),
+             "storedTiles": len(tileEntries), "bytes": end }
+
+
+class LevelRegions():
+    '''Read-only, memory-mapped view of a region file answering cell,
+    window and occupied cell queries without loading whole layers'''
+    def __init__( self, fileName ):
+        self.fileName = fileName
+        self.file = open( fileName, "rb" )
+        try:
+            self.data = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+        except ValueError:
+            self.file.close()
+            raise ValueError( "%s: empty region file" % fileName )
+        try:
+            header = readHeader( self.data, REGION_MAGIC, REGION_FORMAT_VERSION, fileName, "region" )
+        except ValueError:
+            self.close()
+            raise
+        self.width = header["width"]
+        self.height = header["height"]
+        self.tileSize = header["tileSize"]
+        self.tilesWide = header["tilesWide"]
+        self.symbols = PrefabSymbols()
+        for name in header["symbols"][1:]:
+            self.symbols.add( name )
+        tileCount = self.tilesWide*-( -self.height//self.tileSize )
+        self.view = memoryview( self.data )
+        # layerKind -> (typecode, tile table)
+        self.layers = {}
+        for layer in header["layers"]:
+            if ( layer["length"] != 8*tileCount or layer["offset"] + layer["length"] > len(self.data) ):
+                self.close()
+                raise ValueError( "%s: bad tile table of layer %s" % ( fileName, layer["kind"] ) )
+            table = self.view[layer["offset"]:layer["offset"] + layer["length"]].cast( 'Q' )
+            if ( sys.byteorder == "big" ):
+                table = array( 'Q', table )
+                table.byteswap()
+            self.layers[layer["kind"]] = ( layer["typecode"], table )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exception ):
+        self.close()
+
+    def close( self ):
+        if ( getattr( self, "layers", None ) ):
+            for typecode, table in self.layers.values():
+                if ( isinstance( table, memoryview ) ):
+                    table.release()
+            self.layers = {}
+        if ( getattr( self, "view", None ) is not None ):
+            self.view.release()
+            self.view = None
+        if ( not self.data.closed ):
+            self.data.close()
+        self.file.close()
+
+    def layerKinds( self, layers = None ):
+        '''Kinds of the requested layers which the file holds'''
+        if ( layers is None ):
+            return list( self.layers )
+        return [ kind for kind in layers if kind in self.layers ]
+
+    def tileOffset( self, table, tileI, tileJ ):
+        '''Offset of a tile in the file (0 for an empty tile)'''
+        return table[tileI*self.tilesWide + tileJ]
+
+    def layerCell( self, layerKind, x, y ):
+        '''Prefab name of the cell in column x, row y of a layer'''
+        layer = self.layers.get( layerKind )
+        if ( layer is None or not ( 0 <= x < self.width and 0 <= y < self.height ) ):
+            return NO_PREFAB
+        typecode, table = layer
+        tileSize = self.tileSize
+        offset = self.tileOffset( table, y//tileSize, x//tileSize )
+        if ( not offset ):
+            return NO_PREFAB
+        k = ( y % tileSize )*tileSize + x % tileSize
+        if ( typecode == 'B' ):
+            return self.symbols.names[self.data[offset + k]]
+        return self.symbols.names[struct.unpack_from( "<H", self.data, offset + 2*k )[0]]
+
+    def cell( self, x, y, layers = None ):
+        '''Dictionary layerKind -> prefab name of the cell in column x, row y'''
+        return dict( ( kind, self.layerCell( kind, x, y ) ) for kind in self.layerKinds( layers ) )
+
+    def clip( self, x0, y0, x1, y1 ):
+        return max( 0, x0 ), max( 0, y0 ), min( self.width, x1 ), min( self.height, y1 )
+
+    def overlappingTiles( self, x0, y0, x1, y1 ):
+        '''(tileI, tileJ, rows, columns) of the tiles overlapping a clipped
+        rectangle, rows and columns being ranges within the tile'''
+        tileSize = self.tileSize
+        for tileI in range( y0//tileSize, ( y1 - 1 )//tileSize + 1 ):
+            top = tileI*tileSize
+            rows = range( max( y0, top ) - top, min( y1, top + tileSize ) - top )
+            for tileJ in range( x0//tileSize, ( x1 - 1 )//tileSize + 1 ):
+                left = tileJ*tileSize
+                yield tileI, tileJ, rows, range( max( x0, left ) - left, min( x1, left + tileSize ) - left )
+
+    def region( self, x0, y0, x1, y1, layers = None ):
+        '''Dictionary layerKind -> LayerGrid of the window [x0, x1) x [y0, y1)
+        (its cells outside the map are empty)'''
+        width, height = max( 0, x1 - x0 ), max( 0, y1 - y0 )
+        cx0, cy0, cx1, cy1 = self.clip( x0, y0, x1, y1 )
+        tileSize = self.tileSize
+        grids = {}
+        for kind in self.layerKinds( layers ):
+            typecode, table = self.layers[kind]
+            itemSize = 1 if typecode == 'B' else 2
+            window = bytearray( width*height*itemSize )
+            if ( cx0 < cx1 and cy0 < cy1 ):
+                for tileI, tileJ, rows, columns in self.overlappingTiles( cx0, cy0, cx1, cy1 ):
+                    offset = self.tileOffset( table, tileI, tileJ )
+                    if ( not offset ):
+                        continue
+                    length = len(columns)*itemSize
+                    for r in rows:
+                        source = offset + ( r*tileSize + columns.start )*itemSize
+                        target = ( ( tileI*tileSize + r - y0 )*width + tileJ*tileSize + columns.start - x0 )*itemSize
+                        window[target:target + length] = self.view[source:source + length]
+            cells = array( typecode )
+            cells.frombytes( window )
+            if ( sys.byteorder == "big" and typecode != 'B' ):
+                cells.byteswap()
+            grids[kind] = LayerGrid( width, height, self.symbols, cells )
+        return grids
+
+    def occupiedCells( self, x0, y0, x1, y1, layers = None ):
+        '''Iterates over (layerKind, x, y, prefabName) of the non-empty cells
+        of the rectangle [x0, x1) x [y0, y1), tile by tile'''
+        cx0, cy0, cx1, cy1 = self.clip( x0, y0, x1, y1 )
+        if ( cx0 >= cx1 or cy0 >= cy1 ):
+            return
+        tileSize = self.tileSize
+        names = self.symbols.names
+        data = self.data
+        for kind in self.layerKinds( layers ):
+            typecode, table = self.layers[kind]
+            for tileI, tileJ, rows, columns in self.overlappingTiles( cx0, cy0, cx1, cy1 ):
+                offset = self.tileOffset( table, tileI, tileJ )
+                if ( not offset ):
+                    continue
+                top, left = tileI*tileSize, tileJ*tileSize
+                for r in rows:
+                    start = offset + r*tileSize
+                    if ( typecode == 'B' ):
+                        for m in OCCUPIED_PATTERN.finditer( data, start + columns.start, start + columns.stop ):
+                            yield kind, left + m.start() - start, top + r, names[data[m.start()]]
+                        continue
+                    for c in columns:
+                        symbol = struct.unpack_from( "<H", data, offset + 2*( r*tileSize + c ) )[0]
+                        if ( symbol ):
+                            yield kind, left + c, top + r, names[symbol]
+
+
+def openLevelRegions( fileName, tileSize = DEFAULT_TILE_SIZE ):
+    '''LevelRegions of a TMX file, (re)writing its region file first
+    when it is missing or older than the TMX file'''
+    regionsName = regionFileName( fileName )
+    if ( not os.path.isfile( regionsName ) or os.path.getmtime( regionsName ) < os.path.getmtime( fileName ) ):
+        reader = DungeonFileReader()
+        reader.readDungeonFromFile( fileName )
+        writeRegionFile( reader, regionsName, tileSize )
+    return LevelRegions( regionsName )
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Writes the region file of a TMX level and queries it" )
+    parser.add_argument( "tmx", help = "TMX file of the level" )
+    parser.add_argument( "--tile-size", type = int, default = DEFAULT_TILE_SIZE )
+    parser.add_argument( "--region", type = int, nargs = 4, metavar = ( "X0", "Y0", "X1", "Y1" ),
+                         help = "prints the prefab counts of a rectangle" )
+    args = parser.parse_args( argv )
+    start = time.perf_counter()
+    with openLevelRegions( args.tmx, args.tile_size ) as regions:
+        opened = time.perf_counter() - start
+        print( "%s: %dx%d, %d layers, opened in %.3f s" % ( regionFileName( args.tmx ), regions.width, regions.height,
+                                                           len(regions.layers), opened ) )
+        if ( args.region ):
+            counts = {}
+            for kind, x, y, prefabName in regions.occupiedCells( *args.region ):
+                counts[( kind, prefabName )] = counts.get( ( kind, prefabName ), 0 ) + 1
+            for ( kind, prefabName ), count in sorted( counts.items() ):
+                print( "  %-8s %-20s %d" % ( kind, prefabName, count ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,230 @@
+import argparse
+import heapq
+import math
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from ReadDungeonClass import DungeonFileReader
+from navigation import DIAGONAL_STEPS, SQRT2, STRAIGHT_STEPS, buildNavGraph
+from pngImage import Image, averageBytes, readPNG, writePNG
+from tilePlacement import WALL_FACING
+
+#====================================================
+# Baked torch light: instead of one dynamic light per
+# torch, the light of all the torches is added up into
+# one brightness level (0..255) per cell, saved next to
+# the level as an 8-bit gray PNG (one pixel per cell,
+# row i at the top) the game samples as a lightmap or
+# turns into vertex colours (see LightGrid.vertexLevels).
+#
+# Light spreads from a torch over the edges of the
+# navigation graph (see navigation.py), so it does not
+# go through the wall layers nor diagonally past a
+# column, and fades out with the walked distance:
+#   intensity*(1 - distance/radius)^falloff
+# A torch hangs on a wall: it lights the floor cells
+# its cell's walls face (or its own cell if it stands
+# on floor). Torches come from the torch layer and/or
+# a list of (row, column[, intensity, radius]).
+# Every torch only visits the cells within its radius;
+# big levels are split over a process pool
+#====================================================
+
+LIGHT_SUFFIX = ".light.png"
+
+
+class LightParameters():
+    '''Knobs of the light baker'''
+    def __init__( self, radius = 8.0, intensity = 1.0, falloff = 2.0, ambient = 0.05 ):
+        # default reach (in cells) and brightness of a torch
+        self.radius = radius
+        self.intensity = intensity
+        # exponent of the fading with the distance
+        self.falloff = falloff
+        # brightness of the floor cells no torch reaches
+        self.ambient = ambient
+
+
+class LightGrid():
+    '''Brightness level (0..255) of every cell, row-major'''
+    def __init__( self, width, height, levels ):
+        self.width = width
+        self.height = height
+        self.levels = levels
+
+    def level( self, cell ):
+        return self.levels[cell[0]*self.width + cell[1]]
+
+    def vertexLevels( self ):
+        '''Levels of the (height + 1) x (width + 1) cell corners, each the
+        average of the (up to 4) cells around it, whole rows at once'''
+        width, height = self.width, self.height
+        levels = self.levels
+        # the grid with its border cells repeated once around it
+        rows = [ levels[i*width:( i + 1 )*width] for i in range( height ) ]
+        rows = [ rows[0] ] + rows + [ rows[-1] ]
+        padded = b''.join( bytes( row[:1] ) + bytes( row ) + bytes( row[-1:] ) for row in rows )
+        stride = width + 2
+        left = b''.join( padded[r*stride:r*stride + width + 1] for r in range( height + 2 ) )
+        right = b''.join( padded[r*stride + 1:r*stride + width + 2] for r in range( height + 2 ) )
+        across = averageBytes( left, right )
+        return bytearray( averageBytes( across[:-( width + 1 )], across[width + 1:], roundUp = True ) )
+
+    def save( self, fileName ):
+        '''Writes the levels as an 8-bit gray PNG file'''
+        writePNG( fileName, Image( self.width, self.height, 1, self.levels ), 9 )
+
+    @classmethod
+    def load( cls, fileName ):
+        image = readPNG( fileName )
+        return cls( image.width, image.height, image.pixels[0::image.channels] )
+
+
+def lightFileName( levelFileName ):
+    '''Light file of a level: same name, .light.png'''
+    return os.path.splitext( levelFileName )[0] + LIGHT_SUFFIX
+
+
+def torchSeeds( walkable, width, wallGrids, i, j ):
+    '''Cells (positions) a torch in the cell (i, j) lights first and their
+    distance to it: the cell itself on floor, the floor cells faced by the
+    walls of the cell otherwise (all its floor neighbours without walls).
+    wallGrids is a list of ((row, column) offset faced, wall grid)'''
+    height = len(walkable)//width if width else 0
+    k = i*width + j
+    if ( walkable[k] ):
+        return [ ( k, 0.0 ) ]
+    def seed( di, dj ):
+        ni, nj = i + di, j + dj
+        if ( 0 <= ni < height and 0 <= nj < width and walkable[ni*width + nj] ):
+            return [ ( ni*width + nj, 0.5 ) ]
+        return []
+    seeds = []
+    for ( di, dj ), grid in wallGrids:
+        if ( grid.cells[k] ):
+            seeds.extend( seed( di, dj ) )
+    if ( not seeds ):
+        for bit, di, dj in STRAIGHT_STEPS:
+            seeds.extend( seed( di, dj ) )
+    return seeds
+
+
+def lightSources( reader, walkable, lights = None, parameters = None, useTorchLayer = True ):
+    '''(seeds, intensity, radius) of every torch of the torch layer and of
+    lights, a list of (row, column[, intensity, radius])'''
+    parameters = parameters or LightParameters()
+    grids = reader.getGrids()
+    wallGrids = [ ( WALL_FACING[wallKind], grids[wallKind] ) for wallKind in sorted( WALL_FACING )
+                  if grids.get( wallKind ) is not None and len( grids[wallKind] ) ]
+    cells = []
+    torchGrid = grids.get( "torch" ) if useTorchLayer else None
+    if ( torchGrid is not None and len(torchGrid) ):
+        cells.extend( ( i, j, parameters.intensity, parameters.radius ) for i, j, prefabName in torchGrid.occupiedCells() )
+    for light in lights or []:
+        i, j = light[0], light[1]
+        intensity = light[2] if len(light) > 2 else parameters.intensity
+        radius = light[3] if len(light) > 3 else parameters.radius
+        cells.append( ( i, j, intensity, radius ) )
+    sources = []
+    for i, j, intensity, radius in cells:
+        if ( not ( 0 <= i < len(walkable)//reader.mapWidth and 0 <= j < reader.mapWidth ) ):
+            raise ValueError( "Light (%d, %d) is outside the map" % ( i, j ) )
+        seeds = torchSeeds( walkable, reader.mapWidth, wallGrids, i, j )
+        if ( seeds ):
+            sources.append( ( seeds, intensity, radius ) )
+    return sources
+
+
+def spreadLight( edges, width, seeds, radius ):
+    '''Walked distance (orthogonal steps 1, diagonal ones sqrt(2)) from the
+    seeds to every cell closer than radius. Returns cell -> distance'''
+    distances = {}
+    heap = []
+    for k, distance in seeds:
+        if ( distance < distances.get( k, math.inf ) ):
+            distances[k] = distance
+            heapq.heappush( heap, ( distance, k ) )
+    steps = [ ( bit, di*width + dj, 1.0 ) for bit, di, dj in STRAIGHT_STEPS ] + \
+            [ ( bit, di*width + dj, SQRT2 ) for bit, di, dj in DIAGONAL_STEPS ]
+    while ( heap ):
+        distance, k = heapq.heappop( heap )
+        if ( distance > distances[k] ):
+            continue
+        mask = edges[k]
+        for bit, offset, cost in steps:
+            if ( mask & bit ):
+                n = k + offset
+                nDistance = distance + cost
+                if ( nDistance < radius and nDistance < distances.get( n, math.inf ) ):
+                    distances[n] = nDistance
+                    heapq.heappush( heap, ( nDistance, n ) )
+    return distances
+
+
+def lightJob( job ):
+    '''Light of a share of the torches (runs in a worker process).
+    Returns the lit cells and their summed intensity'''
+    edges, width, sources, falloff = job
+    total = {}
+    for seeds, intensity, radius in sources:
+        for k, distance in spreadLight( edges, width, seeds, radius ).items():
+            total[k] = total.get( k, 0.0 ) + intensity*( 1.0 - distance/radius )**falloff
+    return array( 'I', total.keys() ), array( 'f', total.values() )
+
+
+def bakeLights( reader, lights = None, parameters = None, workers = 1, graph = None, useTorchLayer = True ):
+    '''Bakes the light of the torches of a dungeon read by DungeonFileReader
+    (see lightSources) into a LightGrid: ambient on every floor cell plus
+    the light of the torches reaching it, 0 elsewhere. With more than one
+    worker the torches are shared out over a process pool'''
+    parameters = parameters or LightParameters()
+    graph = graph or buildNavGraph( reader )
+    width = graph.width
+    sources = lightSources( reader, graph.walkable, lights, parameters, useTorchLayer )
+    shares = max( 1, min( workers, len(sources) ) )
+    jobs = [ ( graph.edges, width, sources[k::shares], parameters.falloff ) for k in range( shares ) ]
+    if ( shares > 1 ):
+        with ProcessPoolExecutor( max_workers = shares ) as pool:
+            results = list( pool.map( lightJob, jobs ) )
+    else:
+        results = [ lightJob( job ) for job in jobs ]
+    total = {}
+    for cells, values in results:
+        for k, value in zip( cells, values ):
+            total[k] = total.get( k, 0.0 ) + value
+    ambient = min( 255, int( round( parameters.ambient*255 ) ) )
+    levels = bytearray( bytes( graph.walkable ).translate( bytes( [0] + [ambient]*255 ) ) )
+    for k, value in total.items():
+        levels[k] = min( 255, int( round( ( parameters.ambient + value )*255 ) ) )
+    return LightGrid( width, graph.height, levels )
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Bakes the torch light of a TMX level into a lightmap (.light.png)" )
+    parser.add_argument( "tmx", help = "TMX file of the level" )
+    parser.add_argument( "-o", "--output", help = "lightmap file (default: next to the TMX file)" )
+    parser.add_argument( "--light", type = int, nargs = 2, action = "append", default = [], metavar = ( "ROW", "COLUMN" ),
+                         help = "an extra light (besides the torch layer), may be repeated" )
+    parser.add_argument( "--radius", type = float, default = 8.0 )
+    parser.add_argument( "--falloff", type = float, default = 2.0 )
+    parser.add_argument( "--ambient", type = float, default = 0.05 )
+    parser.add_argument( "-j", "--jobs", type = int, default = 1, help = "number of worker processes" )
+    args = parser.parse_args( argv )
+    start = time.perf_counter()
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( args.tmx )
+    lights = [ tuple( light ) for light in args.light ]
+    parameters = LightParameters( radius = args.radius, falloff = args.falloff, ambient = args.ambient )
+    lightGrid = bakeLights( reader, lights, parameters, args.jobs )
+    output = args.output or lightFileName( args.tmx )
+    lightGrid.save( output )
+    lit = len(lightGrid.levels) - lightGrid.levels.count( 0 )
+    print( "%s: %d lit cells -> %s (%.3f s)" % ( args.tmx, lit, output, time.perf_counter() - start ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,445 @@
+import argparse
+import heapq
+import math
+import os
+import re
+import sys
+from array import array
+from collections import deque
+
+from binaryTables import readHeader, writeTableFile
+from layerGrid import maskAnd, maskNot, maskOr, shiftMask
+
+#====================================================
+# Navigation graph of a dungeon: every floor cell is
+# a node, its edges to the 8 neighbours are packed into
+# one byte per cell (see the direction bits below).
+# Orthogonal edges are blocked by the wall layers (a
+# wall lies on the edge between its cell and the cell
+# it faces, see WALL_FACING in tilePlacement.py), the
+# diagonal ones also by the columns standing in the
+# corner they pass through and by the walls around it.
+# Cells are (row, column) pairs, rows grow southwards.
+# The tables (edges, connected components, distance
+# fields) can be saved next to the level and loaded by
+# the game, see NavGraph.save
+#====================================================
+
+# direction bit -> (row, column) offset
+NORTH = 1
+EAST = 2
+SOUTH = 4
+WEST = 8
+NORTH_EAST = 16
+SOUTH_EAST = 32
+SOUTH_WEST = 64
+NORTH_WEST = 128
+STRAIGHT_STEPS = [ ( NORTH, -1, 0 ), ( EAST, 0, 1 ), ( SOUTH, 1, 0 ), ( WEST, 0, -1 ) ]
+DIAGONAL_STEPS = [ ( NORTH_EAST, -1, 1 ), ( SOUTH_EAST, 1, 1 ), ( SOUTH_WEST, 1, -1 ), ( NORTH_WEST, -1, -1 ) ]
+
+NAV_MAGIC = b'DMNV'
+NAV_FORMAT_VERSION = 1
+NAV_SUFFIX = ".nav"
+# distance of the cells which can not be reached
+UNREACHABLE = 0xFFFFFFFF
+SQRT2 = math.sqrt( 2.0 )
+
+# map an edge byte to 1 when its eastern/southern edge is open
+EAST_TABLE = bytes( 1 if b & EAST else 0 for b in range( 256 ) )
+SOUTH_TABLE = bytes( 1 if b & SOUTH else 0 for b in range( 256 ) )
+# runs of cells joined along rows: cells with their eastern edge open (1)
+# up to the first one with it closed (2)
+RUN_PATTERN = re.compile( b'\x01*\x02' )
+# matches every non-zero byte
+SET_PATTERN = re.compile( b'[^\x00]' )
+
+
+class NavGraph():
+    '''Grid graph of the walkable cells of a dungeon.
+    edges holds one byte per cell: its open directions (see the
+    direction bits), walkable one byte per cell: 1 for walkable cells.
+    components holds the connected component (1, 2, ...) of every
+    cell over the orthogonal edges, 0 for cells which are not walkable.
+    fields are named distance fields (name -> array, see distanceField)'''
+    def __init__( self, width, height, edges, walkable, components = None, fields = None ):
+        self.width = width
+        self.height = height
+        self.edges = edges
+        self.walkable = walkable
+        self.components = components if components is not None else self.connectedComponents()
+        self.fields = fields if fields is not None else {}
+
+    def index( self, cell ):
+        return cell[0]*self.width + cell[1]
+
+    def cell( self, k ):
+        return divmod( k, self.width )
+
+    def isWalkable( self, cell ):
+        i, j = cell
+        return 0 <= i < self.height and 0 <= j < self.width and self.walkable[i*self.width + j] != 0
+
+    def connected( self, start, goal ):
+        '''True when goal can be reached from start (orthogonal moves)'''
+        if ( not self.isWalkable( start ) or not self.isWalkable( goal ) ):
+            return False
+        return self.components[self.index( start )] == self.components[self.index( goal )]
+
+    def connectedComponents( self ):
+        '''Labels the cells joined by orthogonal edges. Cells joined along
+        rows are taken run by run, the runs are then merged over the
+        southern edges, so the work per cell is done by C loops.
+        Returns an array with the component of every cell (0 = none)'''
+        width = self.width
+        size = len( self.edges )
+        runOf = array( 'I', bytes( 4*size ) )
+        runs = 0
+        # 2 for walkable cells minus 1 when their eastern edge is open
+        # (computed on whole masks, no byte borrows from the next one)
+        east = int.from_bytes( bytes( self.edges ).translate( EAST_TABLE ), "little" )
+        codes = ( ( int.from_bytes( self.walkable, "little" ) << 1 ) - east ).to_bytes( size, "little" )
+        for match in RUN_PATTERN.finditer( codes ):
+            runs += 1
+            runOf[match.start():match.end()] = array( 'I', [runs] )*( match.end() - match.start() )
+        parent = list( range( runs + 1 ) )
+        def find( r ):
+            while ( parent[r] != r ):
+                parent[r] = parent[parent[r]]
+                r = parent[r]
+            return r
+        south = bytes( self.edges ).translate( SOUTH_TABLE )
+        positions = [ m.start() for m in SET_PATTERN.finditer( south ) ]
+        pairs = set( zip( map( runOf.__getitem__, positions ),
+                          map( runOf.__getitem__, [ k + width for k in positions ] ) ) )
+        for a, b in pairs:
+            a, b = find( a ), find( b )
+            if ( a != b ):
+                parent[max( a, b )] = min( a, b )
+        # consecutive labels, in the order of the first cell of every component
+        labels = [0]*( runs + 1 )
+        count = 0
+        for r in range( 1, runs + 1 ):
+            root = find( r )
+            if ( labels[root] == 0 ):
+                count += 1
+                labels[root] = count
+            labels[r] = labels[root]
+        return array( 'I', map( labels.__getitem__, runOf ) )
+
+    def neighbours( self, k, diagonal = False ):
+        '''Iterates over (neighbour, step cost) of the cell k'''
+        width = self.width
+        mask = self.edges[k]
+        for bit, di, dj in STRAIGHT_STEPS:
+            if ( mask & bit ):
+                yield k + di*width + dj, 1.0
+        if ( diagonal ):
+            for bit, di, dj in DIAGONAL_STEPS:
+                if ( mask & bit ):
+                    yield k + di*width + dj, SQRT2
+
+    def findPath( self, start, goal, diagonal = False ):
+        '''Shortest path from start to goal with A* (orthogonal moves only,
+        or also diagonal ones). Returns the list of cells from start to
+        goal, or None when goal can not be reached'''
+        if ( not self.isWalkable( start ) or not self.isWalkable( goal ) ):
+            return None
+        if ( not diagonal and not self.connected( start, goal ) ):
+            return None
+        width = self.width
+        source = self.index( start )
+        target = self.index( goal )
+        gi, gj = goal
+        costs = { source: 0.0 }
+        parents = { source: -1 }
+        heap = [ ( 0.0, 0.0, source ) ]
+        while ( heap ):
+            estimate, cost, k = heapq.heappop( heap )
+            if ( k == target ):
+                return self.tracePath( parents, target )
+            if ( cost > costs[k] ):
+                continue
+            for n, step in self.neighbours( k, diagonal ):
+                nCost = cost + step
+                if ( nCost < costs.get( n, math.inf ) ):
+                    costs[n] = nCost
+                    parents[n] = k
+                    di = abs( n//width - gi )
+                    dj = abs( n % width - gj )
+                    if ( diagonal ):
+                        h = max( di, dj ) + ( SQRT2 - 1.0 )*min( di, dj )
+                    else:
+                        h = di + dj
+                    heapq.heappush( heap, ( nCost + h, nCost, n ) )
+        return None
+
+    def tracePath( self, parents, target ):
+        path = []
+        k = target
+        while ( k != -1 ):
+            path.append( divmod( k, self.width ) )
+            k = parents[k]
+        path.reverse()
+        return path
+
+    def jumpPointPath( self, start, goal ):
+        '''Shortest path from start to goal (orthogonal moves) with jump
+        point search: straight runs of cells are skipped without putting
+        them on the open list. Rows are scanned first: every cell of a
+        row scan also scans its column, a column scan only stops at the
+        cells where a row turn can not be made earlier.
+        Returns the list of cells from start to goal, or None'''
+        if ( not self.connected( start, goal ) ):
+            return None
+        width = self.width
+        source = self.index( start )
+        target = self.index( goal )
+        gi, gj = goal
+        costs = { source: 0 }
+        parents = { source: -1 }
+        heap = [ ( 0, 0, source, 0 ) ]
+        while ( heap ):
+            estimate, cost, k, direction = heapq.heappop( heap )
+            if ( k == target ):
+                return self.expandJumps( parents, target )
+            if ( cost > costs[k] ):
+                continue
+            for bit in self.jumpDirections( k, direction ):
+                jump = self.jump( k, bit, target )
+                if ( jump is None ):
+                    continue
+                n, distance = jump
+                nCost = cost + distance
+                if ( nCost < costs.get( n, UNREACHABLE ) ):
+                    costs[n] = nCost
+                    parents[n] = k
+                    h = abs( n//width - gi ) + abs( n % width - gj )
+                    heapq.heappush( heap, ( nCost + h, nCost, n, bit ) )
+        return None
+
+    def jumpDirections( self, k, direction ):
+        '''Directions to scan from a jump point reached going in direction
+        (0 for the start: all of them)'''
+        mask = self.edges[k]
+        if ( direction == 0 ):
+            return [ bit for bit, di, dj in STRAIGHT_STEPS if mask & bit ]
+        if ( direction in ( EAST, WEST ) ):
+            candidates = ( direction, NORTH, SOUTH )
+        else:
+            candidates = [ direction ] + self.forcedTurns( k, direction )
+        return [ bit for bit in candidates if mask & bit ]
+
+    def forcedTurns( self, k, direction ):
+        '''Row directions (EAST/WEST) out of the cell k, reached by a column
+        scan going in direction, which can not be taken from the previous
+        cell of the scan for the same cost'''
+        width = self.width
+        edges = self.edges
+        back = -width if direction == SOUTH else width
+        p = k + back
+        forced = []
+        for turn, dj in ( ( EAST, 1 ), ( WEST, -1 ) ):
+            if ( edges[k] & turn and not ( edges[p] & turn and edges[p + dj] & direction ) ):
+                forced.append( turn )
+        return forced
+
+    def jump( self, k, bit, target ):
+        '''Scans from the cell k in a direction. Returns (jump point,
+        number of steps) or None when the scan hits a dead end'''
+        width = self.width
+        edges = self.edges
+        step = { NORTH: -width, SOUTH: width, EAST: 1, WEST: -1 }[bit]
+        distance = 0
+        rowScan = bit in ( EAST, WEST )
+        while ( edges[k] & bit ):
+            k += step
+            distance += 1
+            if ( k == target ):
+                return k, distance
+            if ( rowScan ):
+                for turn in ( NORTH, SOUTH ):
+                    if ( edges[k] & turn and self.jump( k, turn, target ) is not None ):
+                        return k, distance
+            elif ( self.forcedTurns( k, bit ) ):
+                return k, distance
+        return None
+
+    def expandJumps( self, parents, target ):
+        '''Path through all the cells between the jump points'''
+        jumps = self.tracePath( parents, target )
+        path = jumps[:1]
+        for ( i0, j0 ), ( i1, j1 ) in zip( jumps, jumps[1:] ):
+            di = ( i1 > i0 ) - ( i1 < i0 )
+            dj = ( j1 > j0 ) - ( j1 < j0 )
+            for s in range( 1, max( abs( i1 - i0 ), abs( j1 - j0 ) ) + 1 ):
+                path.append( ( i0 + s*di, j0 + s*dj ) )
+        return path
+
+    def distanceField( self, sources, maxDistance = None ):
+        '''Number of orthogonal steps from every cell to the nearest of
+        the source cells (breadth-first, UNREACHABLE for the cells which
+        can not be reached or are farther than maxDistance).
+        Walking downhill on it from any cell leads to a source'''
+        width = self.width
+        edges = self.edges
+        distances = array( 'I', [UNREACHABLE] )*len( edges )
+        queue = deque()
+        for source in sources:
+            if ( self.isWalkable( source ) ):
+                k = self.index( source )
+                distances[k] = 0
+                queue.append( k )
+        steps = [ ( bit, di*width + dj ) for bit, di, dj in STRAIGHT_STEPS ]
+        while ( queue ):
+            k = queue.popleft()
+            d = distances[k] + 1
+            if ( maxDistance is not None and d > maxDistance ):
+                continue
+            mask = edges[k]
+            for bit, offset in steps:
+                if ( mask & bit and distances[k + offset] == UNREACHABLE ):
+                    distances[k + offset] = d
+                    queue.append( k + offset )
+        return distances
+
+    def addField( self, name, sources, maxDistance = None ):
+        '''Computes a distance field and keeps it (it is saved with the graph)'''
+        self.fields[name] = self.distanceField( sources, maxDistance )
+        return self.fields[name]
+
+    def pathFromField( self, name, start ):
+        '''Follows a stored distance field downhill from start to its
+        nearest source. Returns the list of cells or None'''
+        distances = self.fields[name]
+        k = self.index( start )
+        if ( distances[k] == UNREACHABLE ):
+            return None
+        width = self.width
+        path = [ start ]
+        steps = [ ( bit, di*width + dj ) for bit, di, dj in STRAIGHT_STEPS ]
+        while ( distances[k] ):
+            mask = self.edges[k]
+            for bit, offset in steps:
+                if ( mask & bit and distances[k + offset] < distances[k] ):
+                    k += offset
+                    break
+            path.append( divmod( k, width ) )
+        return path
+
+    def save( self, fileName ):
+        '''Writes the tables into a binary file (see binaryTables.py):
+        magic "DMNV", the JSON header (width, height, tables: name,
+        typecode, offset, length) and the tables themselves:
+        edges (uint8), walkable (uint8), components (uint32) and the
+        distance fields (uint32, "field.<name>")'''
+        tables = [ ( "edges", array( 'B', self.edges ) ),
+                   ( "walkable", array( 'B', self.walkable ) ),
+                   ( "components", self.components ) ]
+        tables += [ ( "field." + name, self.fields[name] ) for name in sorted( self.fields ) ]
+        blobs = []
+        entries = []
+        for name, table in tables:
+            if ( sys.byteorder == "big" and table.itemsize > 1 ):
+                table = array( table.typecode, table )
+                table.byteswap()
+            blob = table.tobytes()
+            entries.append( { "name": name, "typecode": table.typecode, "length": len(blob) } )
+            blobs.append( blob )
+        header = { "width": self.width, "height": self.height, "tables": entries }
+        writeTableFile( fileName, NAV_MAGIC, NAV_FORMAT_VERSION, header, entries, blobs )
+
+    @classmethod
+    def load( cls, fileName ):
+        '''Reads the tables written by save'''
+        with open( fileName, "rb" ) as navFile:
+            data = navFile.read()
+        header = readHeader( data, NAV_MAGIC, NAV_FORMAT_VERSION, fileName, "navigation" )
+        tables = {}
+        for entry in header["tables"]:
+            table = array( entry["typecode"] )
+            table.frombytes( data[entry["offset"]:entry["offset"] + entry["length"]] )
+            if ( sys.byteorder == "big" and table.itemsize > 1 ):
+                table.byteswap()
+            tables[entry["name"]] = table
+        fields = dict( ( name[6:], table ) for name, table in tables.items() if name.startswith( "field." ) )
+        return cls( header["width"], header["height"], bytearray( tables["edges"].tobytes() ),
+                    bytearray( tables["walkable"].tobytes() ), tables["components"], fields )
+
+
+def layerMask( grid, size ):
+    '''Non-empty mask of a layer grid, all zeros for a missing layer'''
+    if ( grid is None or len(grid) != size ):
+        return bytearray( size )
+    return grid.nonEmptyMask()
+
+
+def buildNavGraph( reader ):
+    '''Builds the navigation graph of a dungeon read by DungeonFileReader.
+    All the edges are computed on whole masks at once'''
+    width = reader.mapWidth
+    floorGrid = reader.floorGrid
+    height = floorGrid.height if floorGrid is not None else 0
+    size = width*height
+    floor = layerMask( floorGrid, size )
+    wallN = layerMask( reader.wallGridN, size )
+    wallS = layerMask( reader.wallGridS, size )
+    wallE = layerMask( reader.wallGridE, size )
+    wallW = layerMask( reader.wallGridW, size )
+    column = layerMask( reader.columnGrid, size )
+    def shift( mask, di, dj ):
+        return shiftMask( mask, width, height, di, dj )
+    # an edge is blocked by the wall of either of its cells lying on it:
+    # a North wall lies on the southern edge of its cell (see WALL_FACING)
+    blockedN = maskOr( wallS, shift( wallN, -1, 0 ) )
+    blockedS = maskOr( wallN, shift( wallS, 1, 0 ) )
+    blockedE = maskOr( wallW, shift( wallE, 0, 1 ) )
+    blockedW = maskOr( wallE, shift( wallW, 0, -1 ) )
+    openN = maskAnd( floor, shift( floor, -1, 0 ), maskNot( blockedN ) )
+    openS = maskAnd( floor, shift( floor, 1, 0 ), maskNot( blockedS ) )
+    openE = maskAnd( floor, shift( floor, 0, 1 ), maskNot( blockedE ) )
+    openW = maskAnd( floor, shift( floor, 0, -1 ), maskNot( blockedW ) )
+    # a diagonal move needs both orthogonal ways around the corner open
+    # and no column in the corner (a column stands in the south-eastern
+    # corner of its cell)
+    openNE = maskAnd( openN, openE, shift( openE, -1, 0 ), shift( openN, 0, 1 ), maskNot( shift( column, -1, 0 ) ) )
+    openSE = maskAnd( openS, openE, shift( openE, 1, 0 ), shift( openS, 0, 1 ), maskNot( column ) )
+    openSW = maskAnd( openS, openW, shift( openW, 1, 0 ), shift( openS, 0, -1 ), maskNot( shift( column, 0, -1 ) ) )
+    openNW = maskAnd( openN, openW, shift( openW, -1, 0 ), shift( openN, 0, -1 ), maskNot( shift( column, -1, -1 ) ) )
+    # the masks hold 0 or 1 per byte, shifting the whole integer moves
+    # the bit within every byte without carrying into the next one
+    value = 0
+    for bit, mask in ( ( 0, openN ), ( 1, openE ), ( 2, openS ), ( 3, openW ),
+                       ( 4, openNE ), ( 5, openSE ), ( 6, openSW ), ( 7, openNW ) ):
+        value |= int.from_bytes( mask, "little" ) << bit
+    edges = bytearray( value.to_bytes( size, "little" ) )
+    return NavGraph( width, height, edges, floor )
+
+
+def navFileName( levelFileName ):
+    '''Navigation file kept next to a level (or its export)'''
+    return os.path.splitext( levelFileName )[0] + NAV_SUFFIX
+
+
+def main( argv = None ):
+    from ReadDungeonClass import DungeonFileReader
+    parser = argparse.ArgumentParser( description = "Builds the navigation tables of a Tiled (TMX) dungeon" )
+    parser.add_argument( "tmx", help = "TMX file of the level" )
+    parser.add_argument( "-o", "--output", help = "navigation file (default: next to the TMX file, %s)" % NAV_SUFFIX )
+    parser.add_argument( "--field", action = "append", default = [], metavar = "NAME:ROW,COLUMN[;ROW,COLUMN...]",
+                         help = "distance field to the given cells, e.g. exit:12,30" )
+    args = parser.parse_args( argv )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( args.tmx, streaming = True )
+    graph = buildNavGraph( reader )
+    for field in args.field:
+        name, cells = field.split( ":", 1 )
+        graph.addField( name, [ tuple( int(c) for c in cell.split( "," ) ) for cell in cells.split( ";" ) ] )
+    output = args.output or navFileName( args.tmx )
+    graph.save( output )
+    print( "%s: %d walkable cells in %d components -> %s" %
+           ( args.tmx, len(graph.walkable) - bytes( graph.walkable ).count( 0 ), max( graph.components, default = 0 ), output ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,289 @@
+import functools
+import os
+import struct
+import zlib
+from itertools import accumulate
+
+#====================================================
+# 8-bit images and PNG files for the texture atlases
+# (see textureAtlas.py) and the baked light (see
+# lightBaker.py). Whole images are handled as bytes:
+# palettes are expanded with bytes.translate and the Up
+# filter is undone on big ints, a whole row at once.
+#
+# Files are always written with filter None, which
+# zlib compresses faster than (and about as well as)
+# the other filters on textures. Reading handles every
+# filter and interlaced (Adam7) files: Sub works a
+# channel at a time, Average and Paeth (written by most
+# image editors) byte by byte, so such files are slower
+# to read than the ones written here
+#====================================================
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# samples per pixel of the PNG colour types
+PNG_SAMPLES = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 }
+# PNG colour type of the images written, by channels
+PNG_COLOUR_TYPES = { 1: 0, 2: 4, 3: 2, 4: 6 }
+PNG_FILTER_NONE = 0
+PNG_FILTER_SUB = 1
+PNG_FILTER_UP = 2
+PNG_FILTER_AVERAGE = 3
+PNG_FILTER_PAETH = 4
+# (first column, first row, column step, row step) of the Adam7 passes
+ADAM7_PASSES = ( ( 0, 0, 8, 8 ), ( 4, 0, 8, 8 ), ( 0, 4, 4, 8 ), ( 2, 0, 4, 4 ), ( 0, 2, 2, 4 ), ( 1, 0, 2, 2 ), ( 0, 1, 1, 2 ) )
+# integer luma (ITU-R BT.601, 77/150/29 out of 256) of every value of the
+# red, green and blue samples, rounded; their sum is 255 at most (white)
+LUMA_TABLES = [ bytes( ( value*weight + 128 ) >> 8 for value in range( 256 ) ) for weight in ( 77, 150, 29 ) ]
+
+
+class Image():
+    '''8-bit pixels, rows from top to bottom: gray (channels = 1), gray
+    and alpha (2), RGB (3) or RGBA (4)'''
+    def __init__( self, width, height, channels, pixels ):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.pixels = pixels
+
+    def stride( self ):
+        return self.width*self.channels
+
+    def row( self, y ):
+        stride = self.width*self.channels
+        return self.pixels[y*stride:( y + 1 )*stride]
+
+
+@functools.lru_cache( maxsize = 64 )
+def byteMasks( size ):
+    '''0x7F7F... and 0x8080... as ints of size bytes'''
+    return int.from_bytes( b'\x7f'*size, "little" ), int.from_bytes( b'\x80'*size, "little" )
+
+
+def addBytes( a, b ):
+    '''Bytewise (a + b) mod 256 of two byte strings of the same size'''
+    low, high = byteMasks( len(a) )
+    x = int.from_bytes( a, "little" )
+    y = int.from_bytes( b, "little" )
+    return ( ( ( x & low ) + ( y & low ) ) ^ ( ( x ^ y ) & high ) ).to_bytes( len(a), "little" )
+
+
+def averageBytes( a, b, roundUp = False ):
+    '''Bytewise (a + b)//2 (or rounded up) of two byte strings of the same size'''
+    low, high = byteMasks( len(a) )
+    x = int.from_bytes( a, "little" )
+    y = int.from_bytes( b, "little" )
+    half = ( ( x ^ y ) >> 1 ) & low
+    return ( ( x | y ) - half if roundUp else ( x & y ) + half ).to_bytes( len(a), "little" )
+
+
+def interleave( planes ):
+    '''Interleaves planes (one byte per pixel each) into pixels'''
+    count = len(planes)
+    pixels = bytearray( len(planes[0])*count )
+    for k, plane in enumerate( planes ):
+        pixels[k::count] = plane
+    return pixels
+
+
+def splitPlanes( image ):
+    return [ image.pixels[k::image.channels] for k in range( image.channels ) ]
+
+
+def withChannels( image, channels ):
+    '''The image converted to gray (1), gray and alpha (2), RGB (3) or
+    RGBA (4): gray is repeated into red, green and blue, colour is turned
+    into gray by its luma, a missing alpha is opaque and an unwanted one
+    is dropped'''
+    if ( image.channels == channels ):
+        return image
+    planes = splitPlanes( image )
+    alpha = planes.pop() if image.channels in ( 2, 4 ) else None
+    if ( channels >= 3 ):
+        planes = planes*3 if len(planes) == 1 else planes
+    elif ( len(planes) == 3 ):
+        red, green, blue = ( plane.translate( table ) for plane, table in zip( planes, LUMA_TABLES ) )
+        planes = [ addBytes( addBytes( red, green ), blue ) ]
+    if ( channels in ( 2, 4 ) ):
+        planes.append( alpha if alpha is not None else b'\xff'*len(planes[0]) )
+    return Image( image.width, image.height, channels, interleave( planes ) )
+
+
+def readChunks( data ):
+    '''(type, body) of the chunks of a PNG file'''
+    if ( data[:8] != PNG_SIGNATURE ):
+        raise ValueError( "Not a PNG file" )
+    position = 8
+    while ( position + 8 <= len(data) ):
+        length, chunkType = struct.unpack( ">I4s", data[position:position + 8] )
+        yield chunkType, data[position + 8:position + 8 + length]
+        position += 12 + length
+        if ( chunkType == b'IEND' ):
+            break
+
+
+def pngSize( fileName ):
+    '''(width, height) of a PNG file, from its header only'''
+    with open( fileName, "rb" ) as png:
+        data = png.read( 33 )
+    for chunkType, body in readChunks( data ):
+        if ( chunkType == b'IHDR' ):
+            return struct.unpack( ">II", body[:8] )
+    raise ValueError( "%s: no PNG header" % fileName )
+
+
+def unfilterRows( data, filters, rowBytes, bytesPerPixel ):
+    '''Undoes the PNG row filters in place. None and Up, by far the most
+    common, work on whole rows, Sub a channel at a time and Average and
+    Paeth byte by byte'''
+    previous = bytes( rowBytes )
+    for y, kind in enumerate( filters ):
+        start = y*rowBytes
+        row = data[start:start + rowBytes]
+        if ( kind == PNG_FILTER_SUB ):
+            for k in range( bytesPerPixel ):
+                row[k::bytesPerPixel] = bytes( accumulate( row[k::bytesPerPixel], lambda a, b: ( a + b ) & 0xFF ) )
+        elif ( kind == PNG_FILTER_UP ):
+            row = bytearray( addBytes( row, previous ) )
+        elif ( kind == PNG_FILTER_AVERAGE ):
+            for i in range( bytesPerPixel ):
+                row[i] = ( row[i] + ( previous[i] >> 1 ) ) & 0xFF
+            for i in range( bytesPerPixel, rowBytes ):
+                row[i] = ( row[i] + ( ( row[i - bytesPerPixel] + previous[i] ) >> 1 ) ) & 0xFF
+        elif ( kind == PNG_FILTER_PAETH ):
+            for i in range( bytesPerPixel ):
+                row[i] = ( row[i] + previous[i] ) & 0xFF
+            for i in range( bytesPerPixel, rowBytes ):
+                left, up, upLeft = row[i - bytesPerPixel], previous[i], previous[i - bytesPerPixel]
+                pa, pb, pc = abs( up - upLeft ), abs( left - upLeft ), abs( left + up - 2*upLeft )
+                predictor = left if ( pa <= pb and pa <= pc ) else ( up if pb <= pc else upLeft )
+                row[i] = ( row[i] + predictor ) & 0xFF
+        elif ( kind != PNG_FILTER_NONE ):
+            raise ValueError( "Unknown PNG filter %d" % kind )
+        data[start:start + rowBytes] = row
+        previous = row
+
+
+def unpackBits( data, depth, width, height, rowBytes ):
+    '''One byte per sample of 1, 2 or 4-bit samples (single sample pixels)'''
+    perByte = 8//depth
+    mask = ( 1 << depth ) - 1
+    samples = bytearray( len(data)*perByte )
+    for k in range( perByte ):
+        shift = 8 - depth*( k + 1 )
+        samples[k::perByte] = data.translate( bytes( ( value >> shift ) & mask for value in range( 256 ) ) )
+    rowSamples = rowBytes*perByte
+    if ( rowSamples != width ):
+        # every row is padded up to a whole byte
+        view = memoryview( samples )
+        samples = bytearray( b''.join( view[y*rowSamples:y*rowSamples + width] for y in range( height ) ) )
+    return samples
+
+
+def decodePass( raw, start, width, height, samples, depth ):
+    '''Samples (one byte each, the high byte of 16-bit ones) of a width x
+    height image (or Adam7 pass) whose filtered rows begin at start in
+    the decompressed data. Returns (samples, end of its rows)'''
+    rowBytes = ( width*samples*depth + 7 )//8
+    end = start + height*( rowBytes + 1 )
+    if ( len(raw) < end ):
+        raise ValueError( "truncated image data" )
+    data = raw[start:end]
+    filters = data[::rowBytes + 1]
+    del data[::rowBytes + 1]
+    if ( filters.count( PNG_FILTER_NONE ) != height ):
+        unfilterRows( data, filters, rowBytes, max( 1, samples*depth//8 ) )
+    if ( depth == 16 ):
+        # high bytes only
+        data = data[0::2]
+    elif ( depth < 8 ):
+        data = unpackBits( data, depth, width, height, rowBytes )
+    return data, end
+
+
+def deinterlace( raw, width, height, samples, depth ):
+    '''Samples of an Adam7 interlaced image: every pass is decoded on its
+    own and its pixels are put in place a row and a channel at a time'''
+    pixels = bytearray( width*height*samples )
+    start = 0
+    for x0, y0, dx, dy in ADAM7_PASSES:
+        passWidth = -( -( width - x0 )//dx ) if width > x0 else 0
+        passHeight = -( -( height - y0 )//dy ) if height > y0 else 0
+        if ( passWidth == 0 or passHeight == 0 ):
+            continue
+        data, start = decodePass( raw, start, passWidth, passHeight, samples, depth )
+        stride = passWidth*samples
+        for r in range( passHeight ):
+            row = data[r*stride:( r + 1 )*stride]
+            first = ( ( y0 + r*dy )*width + x0 )*samples
+            for k in range( samples ):
+                target = first + k
+                pixels[target:target + ( passWidth - 1 )*dx*samples + 1:dx*samples] = row[k::samples]
+    return pixels
+
+
+def readPNG( fileName ):
+    '''Reads a PNG file into an Image (RGB, or RGBA when the file has
+    alpha). Transparency (tRNS) is honoured for palettes only'''
+    with open( fileName, "rb" ) as png:
+        data = png.read()
+    header = None
+    palette = b''
+    transparency = b''
+    compressed = []
+    for chunkType, body in readChunks( data ):
+        if ( chunkType == b'IHDR' ):
+            header = struct.unpack( ">IIBBBBB", body[:13] )
+        elif ( chunkType == b'PLTE' ):
+            palette = body
+        elif ( chunkType == b'tRNS' ):
+            transparency = body
+        elif ( chunkType == b'IDAT' ):
+            compressed.append( body )
+    if ( header is None ):
+        raise ValueError( "%s: no PNG header" % fileName )
+    width, height, depth, colourType, compression, filterMethod, interlace = header
+    if ( colourType not in PNG_SAMPLES ):
+        raise ValueError( "%s: unknown PNG colour type %d" % ( fileName, colourType ) )
+    samples = PNG_SAMPLES[colourType]
+    raw = bytearray( zlib.decompress( b''.join( compressed ) ) )
+    try:
+        if ( interlace ):
+            raw = deinterlace( raw, width, height, samples, depth )
+        else:
+            raw, end = decodePass( raw, 0, width, height, samples, depth )
+    except ValueError as error:
+        raise ValueError( "%s: %s" % ( fileName, error ) )
+    if ( colourType == 3 ):
+        palette = palette + bytes( 768 - len(palette) )
+        planes = [ raw.translate( palette[k::3] ) for k in range( 3 ) ]
+        if ( transparency ):
+            planes.append( raw.translate( transparency + b'\xff'*( 256 - len(transparency) ) ) )
+        return Image( width, height, len(planes), interleave( planes ) )
+    if ( colourType in ( 0, 4 ) ):
+        if ( depth < 8 ):
+            raw = raw.translate( bytes( min( 255, value*255//( ( 1 << depth ) - 1 ) ) for value in range( 256 ) ) )
+        return withChannels( Image( width, height, samples, raw ), samples + 2 )
+    return Image( width, height, samples, raw )
+
+
+def writePNG( fileName, image, level = 6 ):
+    '''Writes an Image as an 8-bit PNG file (gray, gray and alpha, RGB or
+    RGBA by its channels), every row with the None filter'''
+    stride = image.stride()
+    filtered = bytearray( ( stride + 1 )*image.height )
+    view = memoryview( filtered )
+    for y in range( image.height ):
+        start = y*( stride + 1 ) + 1
+        view[start:start + stride] = image.pixels[y*stride:( y + 1 )*stride]
+    view.release()
+    def chunk( chunkType, body ):
+        return struct.pack( ">I", len(body) ) + chunkType + body + struct.pack( ">I", zlib.crc32( chunkType + body ) & 0xFFFFFFFF )
+    header = struct.pack( ">IIBBBBB", image.width, image.height, 8, PNG_COLOUR_TYPES[image.channels], 0, 0, 0 )
+    temporaryName = fileName + ".tmp%d" % os.getpid()
+    with open( temporaryName, "wb" ) as png:
+        png.write( PNG_SIGNATURE )
+        png.write( chunk( b'IHDR', header ) )
+        png.write( chunk( b'IDAT', zlib.compress( filtered, level ) ) )
+        png.write( chunk( b'IEND', b'' ) )
+    os.replace( temporaryName, fileName )
@@ -0,0 +1,202 @@
+import argparse
+import random
+import sys
+import time
+from array import array
+
+from ReadDungeonClass import DungeonFileReader
+from autoWalls import deriveWalls
+from layerGrid import LayerGrid, PrefabSymbols
+from tmxSynth import ENCODINGS
+from tmxWriter import buildTilesetIndex, writeDungeonTMX
+
+#====================================================
+# Seeded procedural dungeons: the map is split into
+# square partitions, most of them get a room, the
+# others a corridor junction. A random spanning tree
+# over the partitions joins them with L-shaped
+# corridors, some more corridors make loops. Big rooms
+# get rows of columns, every floor cell a ceiling and
+# the walls are derived from the floor (see
+# autoWalls.py). Rooms and corridors are carved with
+# slice assignments, a whole row (or column) at once,
+# and the result is put straight into the grids of a
+# DungeonFileReader, so the rest of the pipeline works
+# on it unchanged. The same seed always gives the same
+# dungeon
+#====================================================
+
+# prefab of every generated layer (walls: see deriveWalls)
+DEFAULT_PREFABS = { "floor": "floorTile01",
+                    "column": "column01",
+                    "ceiling": "ceilingTile01",
+                    "wall": "wallTile01" }
+
+
+class DungeonParameters():
+    '''Knobs of the procedural generator'''
+    def __init__( self, partitionSize = 20, minRoomSize = 4, roomChance = 0.85, loopChance = 0.15,
+                  columnRoomSize = 8, columnSpacing = 3 ):
+        # rooms are carved inside partitionSize x partitionSize cells,
+        # leaving at least one cell between two rooms
+        self.partitionSize = partitionSize
+        self.minRoomSize = minRoomSize
+        # share of the partitions getting a room (the others a junction)
+        self.roomChance = roomChance
+        # share of the neighbouring partitions joined once more (loops)
+        self.loopChance = loopChance
+        # rooms at least this big in both directions get columns,
+        # columnSpacing cells apart
+        self.columnRoomSize = columnRoomSize
+        self.columnSpacing = columnSpacing
+
+
+def carveDungeon( width, height, seed, parameters = None ):
+    '''Carves rooms and corridors. Returns the floor and column masks
+    (bytearrays, one byte per cell) and the list of rooms
+    (row, column, rows, columns)'''
+    parameters = parameters or DungeonParameters()
+    rng = random.Random( seed )
+    size = parameters.partitionSize
+    partitionRows = max( 1, height//size )
+    partitionColumns = max( 1, width//size )
+    floor = bytearray( width*height )
+    columns = bytearray( width*height )
+    rooms = []
+    # centre of every partition (room or junction), row-major
+    centres = []
+    maxRoom = max( 1, min( size, height, width ) - 2 )
+    minRoom = min( parameters.minRoomSize, maxRoom )
+    for pi in range( partitionRows ):
+        for pj in range( partitionColumns ):
+            top = pi*size + 1
+            left = pj*size + 1
+            if ( rng.random() < parameters.roomChance ):
+                rows = rng.randint( minRoom, maxRoom )
+                cols = rng.randint( minRoom, maxRoom )
+                i = top + rng.randint( 0, maxRoom - rows )
+                j = left + rng.randint( 0, maxRoom - cols )
+                for r in range( i, i + rows ):
+                    floor[r*width + j:r*width + j + cols] = b'\x01'*cols
+                rooms.append( ( i, j, rows, cols ) )
+                centres.append( ( i + rows//2, j + cols//2 ) )
+                if ( rows >= parameters.columnRoomSize and cols >= parameters.columnRoomSize ):
+                    placeColumns( columns, width, i, j, rows, cols, parameters.columnSpacing )
+            else:
+                i = top + rng.randint( 0, maxRoom - 1 )
+                j = left + rng.randint( 0, maxRoom - 1 )
+                floor[i*width + j] = 1
+                centres.append( ( i, j ) )
+    for a, b in corridorLinks( partitionRows, partitionColumns, rng, parameters.loopChance ):
+        carveCorridor( floor, width, centres[a], centres[b] )
+    return floor, columns, rooms
+
+
+def placeColumns( columns, width, i, j, rows, cols, spacing ):
+    '''Rows of columns inside a room, away from its walls. A column
+    stands in the south-eastern corner of its cell'''
+    first = j + spacing - 1
+    last = j + cols - spacing
+    if ( last < first ):
+        return
+    count = ( last - first )//spacing + 1
+    for r in range( i + spacing - 1, i + rows - spacing + 1, spacing ):
+        columns[r*width + first:r*width + last + 1:spacing] = b'\x01'*count
+
+
+def corridorLinks( partitionRows, partitionColumns, rng, loopChance ):
+    '''Pairs of partitions (row-major numbers) to join: a random spanning
+    tree of the grid of partitions (Kruskal on shuffled edges) and, with
+    loopChance, the edges left out of it'''
+    links = []
+    for pi in range( partitionRows ):
+        for pj in range( partitionColumns ):
+            k = pi*partitionColumns + pj
+            if ( pj + 1 < partitionColumns ):
+                links.append( ( k, k + 1 ) )
+            if ( pi + 1 < partitionRows ):
+                links.append( ( k, k + partitionColumns ) )
+    rng.shuffle( links )
+    parent = list( range( partitionRows*partitionColumns ) )
+    def find( k ):
+        while ( parent[k] != k ):
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+    chosen = []
+    for a, b in links:
+        ra, rb = find( a ), find( b )
+        if ( ra != rb ):
+            parent[ra] = rb
+            chosen.append( ( a, b ) )
+        elif ( rng.random() < loopChance ):
+            chosen.append( ( a, b ) )
+    return chosen
+
+
+def carveCorridor( floor, width, start, end ):
+    '''L-shaped corridor: along the row of start, then along the column
+    of end, each carved by one slice assignment'''
+    i0, j0 = start
+    i1, j1 = end
+    left, right = min( j0, j1 ), max( j0, j1 )
+    floor[i0*width + left:i0*width + right + 1] = b'\x01'*( right - left + 1 )
+    top, bottom = min( i0, i1 ), max( i0, i1 )
+    floor[top*width + j1:bottom*width + j1 + 1:width] = b'\x01'*( bottom - top + 1 )
+
+
+def generateDungeon( width, height, seed = 1, parameters = None, prefabs = None, wallRules = None ):
+    '''Generates a dungeon and returns a DungeonFileReader holding its
+    grids (floor, walls N/S/E/W, columns, ceiling) and tilesets, as if
+    it had been read from a TMX file, and its rooms'''
+    prefabs = dict( DEFAULT_PREFABS, **( prefabs or {} ) )
+    floor, columns, rooms = carveDungeon( width, height, seed, parameters )
+    # columns only stand on floor
+    columns = bytearray( ( int.from_bytes( columns, "little" ) & int.from_bytes( floor, "little" ) ).to_bytes( len(floor), "little" ) )
+    symbols = PrefabSymbols()
+    def maskGrid( mask, prefabName ):
+        symbol = symbols.add( prefabName )
+        return LayerGrid( width, height, symbols, array( 'B', mask.translate( bytes( [0] + [symbol]*255 ) ) ) )
+    reader = DungeonFileReader()
+    reader.mapFileName = ""
+    reader.mapWidth = width
+    reader.mapHeight = height
+    reader.setGrids( { "floor": maskGrid( floor, prefabs["floor"] ),
+                       "column": maskGrid( columns, prefabs["column"] ),
+                       "ceiling": maskGrid( floor, prefabs["ceiling"] ) }, symbols )
+    wallPrefabs = set( [ prefabs["wall"] ] )
+    for variants in ( wallRules or {} ).values():
+        wallPrefabs.update( prefabName for prefabName, weight in variants )
+    reader.tilesetIndex = buildTilesetIndex( [ ( "floorTiles", 1, [ prefabs["floor"] ] ),
+                                               ( "wallTiles", 101, sorted( wallPrefabs, key = lambda p: ( p != prefabs["wall"], p ) ) ),
+                                               ( "ceilingTiles", 201, [ prefabs["ceiling"] ] ),
+                                               ( "columnTiles", 301, [ prefabs["column"] ] ) ] )
+    deriveWalls( reader, wallRules, seed )
+    reader.rooms = rooms
+    return reader
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Generates a random dungeon" )
+    parser.add_argument( "-o", "--output", help = "TMX file to write" )
+    parser.add_argument( "--size", type = int, default = 128, help = "width and height of the map in cells" )
+    parser.add_argument( "--seed", type = int, default = 1 )
+    parser.add_argument( "--encoding", choices = ENCODINGS, default = "base64-zlib" )
+    parser.add_argument( "--partition-size", type = int, default = 20, help = "size of the square holding one room" )
+    parser.add_argument( "--loop-chance", type = float, default = 0.15, help = "share of extra corridors making loops" )
+    args = parser.parse_args( argv )
+    start = time.perf_counter()
+    parameters = DungeonParameters( partitionSize = args.partition_size, loopChance = args.loop_chance )
+    reader = generateDungeon( args.size, args.size, args.seed, parameters )
+    seconds = time.perf_counter() - start
+    counts = dict( ( kind, grid.occupiedCount() ) for kind, grid in reader.getGrids().items() if grid is not None )
+    print( "%dx%d dungeon, seed %d: %d rooms, %d floor cells, %d walls, %d columns (%.3f s)" %
+           ( args.size, args.size, args.seed, len(reader.rooms), counts["floor"],
+             sum( counts[kind] for kind in ( "wallN", "wallS", "wallE", "wallW" ) ), counts["column"], seconds ) )
+    if ( args.output ):
+        writeDungeonTMX( reader, args.output, args.encoding, { "name": "dungeon%dx%d_%d" % ( args.size, args.size, args.seed ) } )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,388 @@
+import argparse
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from ReadDungeonClass import DungeonFileReader
+from binaryTables import readHeader, writeTableFile
+from layerGrid import maskAnd, maskNot, maskOr, shiftMask
+from navigation import DIAGONAL_STEPS, STRAIGHT_STEPS, buildNavGraph, layerMask
+from tilePlacement import WALL_FACING
+
+#====================================================
+# Potentially visible sets: the map is split into
+# square chunks and for every chunk holding floor the
+# chunks which can be seen from any of its cells are
+# precomputed, so the game only draws the chunks of
+# the PVS of the chunk the camera is in.
+#
+# Sight goes from cell centre to cell centre along the
+# cells a straight line crosses (a diagonal step where
+# it goes exactly through a corner). A step between two
+# cells is open when the navigation graph (see
+# navigation.py) has the edge: walls and cells without
+# floor stop the sight. A diagonal step only needs one
+# of the two ways around the corner open, but no column
+# standing in it.
+# The lines to every cell within the radius share their
+# first steps, they are walked as a tree. All the cells
+# of a chunk look along a line at once: the open cells
+# are bitsets held in integers (one bit per cell), a
+# step is an AND and a shift, and the branches the sight of no
+# cell gets through are dropped. A chunk sees another
+# one when sight from the centre of one of its cells
+# reaches a cell of the other (or the other way round).
+# A wall tile belongs to the cell behind the edge it
+# stands on (see tilePlacement.WALL_FACING): when the
+# cell it faces is seen, the chunk of the wall's cell
+# is seen too, even if sight never enters that cell.
+# Chunks are shared out over a process pool.
+#
+# The PVS of a chunk is a bitset over the chunks around
+# it (radius rounded up to whole chunks), see
+# PotentialVisibility; the file (see binaryTables.py)
+# keeps them zlib compressed next to the level
+#====================================================
+
+PVS_MAGIC = b'DMPV'
+PVS_FORMAT_VERSION = 2
+PVS_SUFFIX = ".pvs"
+
+# direction bit -> (row, column) offset, as in the navigation graph
+SIGHT_STEPS = STRAIGHT_STEPS + DIAGONAL_STEPS
+# map an edge byte to 1 when its given direction is open
+OPEN_TABLES = dict( ( bit, bytes( 1 if b & bit else 0 for b in range( 256 ) ) ) for bit, di, dj in STRAIGHT_STEPS )
+# map an edge byte to "1" when its given direction is open, "0" otherwise
+STEP_TABLES = dict( ( bit, bytes( b'1'[0] if b & bit else b'0'[0] for b in range( 256 ) ) ) for bit, di, dj in SIGHT_STEPS )
+# keep the orthogonal directions of an edge byte
+STRAIGHT_TABLE = bytes( b & 0x0F for b in range( 256 ) )
+DIGIT_TABLE = bytes( b'0'[0] if b == 0 else b'1'[0] for b in range( 256 ) )
+# wall kind -> its bit in the wall bytes (see wallBytes)
+WALL_BITS = dict( ( wallKind, 1 << k ) for k, wallKind in enumerate( sorted( WALL_FACING ) ) )
+# map a wall byte to "1" when it has the given wall bit, "0" otherwise
+WALL_TABLES = dict( ( bit, bytes( b'1'[0] if b & bit else b'0'[0] for b in range( 256 ) ) ) for bit in WALL_BITS.values() )
+
+
+class PVSParameters():
+    '''Knobs of the PVS builder'''
+    def __init__( self, chunkSize = 8, radius = 32 ):
+        # width and height of a chunk in cells (1: one PVS per cell)
+        self.chunkSize = chunkSize
+        # farthest cell seen, rounded up to whole chunks
+        self.radius = radius
+
+    def reach( self ):
+        '''Number of chunks seen in every direction'''
+        return max( 1, -( -self.radius//self.chunkSize ) )
+
+
+class PotentialVisibility():
+    '''Visible chunks of every chunk of a level. The PVS of a chunk is a
+    bitset of the (2*reach + 1) x (2*reach + 1) chunks centred on it
+    (row-major), held in rowBytes bytes of bits'''
+    def __init__( self, width, height, chunkSize, reach, bits ):
+        self.width = width
+        self.height = height
+        self.chunkSize = chunkSize
+        self.reach = reach
+        self.chunkColumns = -( -width//chunkSize )
+        self.chunkRows = -( -height//chunkSize )
+        self.rowBytes = windowBytes( reach )
+        self.bits = bits
+
+    def chunkOf( self, cell ):
+        return cell[0]//self.chunkSize, cell[1]//self.chunkSize
+
+    def bitset( self, chunk ):
+        '''PVS of a chunk as an integer (bit a*(2*reach + 1) + b: the chunk
+        a - reach rows and b - reach columns away)'''
+        k = ( chunk[0]*self.chunkColumns + chunk[1] )*self.rowBytes
+        return int.from_bytes( self.bits[k:k + self.rowBytes], "little" )
+
+    def visibleChunks( self, chunk ):
+        '''Chunks (row, column) seen from a chunk'''
+        side = 2*self.reach + 1
+        ci, cj = chunk
+        bitset = self.bitset( chunk )
+        chunks = []
+        while ( bitset ):
+            low = bitset & -bitset
+            a, b = divmod( low.bit_length() - 1, side )
+            chunks.append( ( ci + a - self.reach, cj + b - self.reach ) )
+            bitset ^= low
+        return chunks
+
+    def chunkVisible( self, chunk, other ):
+        a = other[0] - chunk[0] + self.reach
+        b = other[1] - chunk[1] + self.reach
+        side = 2*self.reach + 1
+        if ( not ( 0 <= a < side and 0 <= b < side ) ):
+            return False
+        return ( self.bitset( chunk ) >> ( a*side + b ) ) & 1 == 1
+
+    def cellVisible( self, cell, other ):
+        '''True when the chunk of other is in the PVS of the chunk of cell'''
+        return self.chunkVisible( self.chunkOf( cell ), self.chunkOf( other ) )
+
+    def save( self, fileName ):
+        '''Writes the PVS into a binary file (see binaryTables.py): magic
+        "DMPV", the JSON header (width, height, chunkSize, reach, tables)
+        and a single table, the bitsets zlib compressed'''
+        blob = zlib.compress( bytes( self.bits ), 9 )
+        entries = [ { "name": "bitsets", "compression": "zlib", "length": len(blob) } ]
+        header = { "width": self.width, "height": self.height,
+                   "chunkSize": self.chunkSize, "reach": self.reach, "tables": entries }
+        writeTableFile( fileName, PVS_MAGIC, PVS_FORMAT_VERSION, header, entries, [ blob ] )
+
+    @classmethod
+    def load( cls, fileName ):
+        '''Reads the PVS written by save'''
+        with open( fileName, "rb" ) as pvsFile:
+            data = pvsFile.read()
+        header = readHeader( data, PVS_MAGIC, PVS_FORMAT_VERSION, fileName, "PVS" )
+        entry = header["tables"][0]
+        bits = zlib.decompress( data[entry["offset"]:entry["offset"] + entry["length"]] )
+        pvs = cls( header["width"], header["height"], header["chunkSize"], header["reach"], bits )
+        if ( len(bits) != pvs.chunkRows*pvs.chunkColumns*pvs.rowBytes ):
+            raise ValueError( "%s: %d bytes of bitsets, expected %d" % ( fileName, len(bits), pvs.chunkRows*pvs.chunkColumns*pvs.rowBytes ) )
+        return pvs
+
+
+def windowBytes( reach ):
+    side = 2*reach + 1
+    return ( side*side + 7 )//8
+
+
+def pvsFileName( levelFileName ):
+    '''PVS file kept next to a level (or its export)'''
+    return os.path.splitext( levelFileName )[0] + PVS_SUFFIX
+
+
+def sightLine( di, dj ):
+    '''Steps (direction bits) from a cell to the cell (di, dj) away: the
+    cells the line between their centres crosses, a diagonal step where
+    it goes exactly through a corner'''
+    rows, columns = abs( di ), abs( dj )
+    si = ( di > 0 ) - ( di < 0 )
+    sj = ( dj > 0 ) - ( dj < 0 )
+    bits = dict( ( ( i, j ), bit ) for bit, i, j in SIGHT_STEPS )
+    i = j = 0
+    steps = []
+    while ( i < rows or j < columns ):
+        # compare where the line leaves the current cell across a column
+        # border and across a row border
+        across = ( 2*j + 1 )*rows
+        down = ( 2*i + 1 )*columns
+        if ( across == down ):
+            steps.append( bits[( si, sj )] )
+            i += 1
+            j += 1
+        elif ( across < down ):
+            steps.append( bits[( 0, sj )] )
+            j += 1
+        else:
+            steps.append( bits[( si, 0 )] )
+            i += 1
+    return steps
+
+
+@lru_cache( maxsize = None )
+def sightTree( radius ):
+    '''The sight lines to every cell within radius (in both directions) as
+    a tree: node = {direction bit: child node}'''
+    root = {}
+    for di in range( -radius, radius + 1 ):
+        for dj in range( -radius, radius + 1 ):
+            node = root
+            for bit in sightLine( di, dj ):
+                node = node.setdefault( bit, {} )
+    return root
+
+
+def sightEdges( reader, graph ):
+    '''One byte per cell with the directions sight goes through (see the
+    direction bits of navigation.py): the orthogonal edges of the
+    navigation graph, a diagonal one when either way around the corner
+    is open and no column stands in it'''
+    width, height = graph.width, graph.height
+    size = width*height
+    edges = bytes( graph.edges )
+    column = layerMask( reader.columnGrid, size )
+    def shift( mask, di, dj ):
+        return shiftMask( mask, width, height, di, dj )
+    opens = dict( ( bit, bytearray( edges.translate( OPEN_TABLES[bit] ) ) ) for bit, di, dj in STRAIGHT_STEPS )
+    value = int.from_bytes( edges.translate( STRAIGHT_TABLE ), "little" )
+    # a column stands in the south-eastern corner of its cell
+    for bit, di, dj, corner in ( ( 16, -1, 1, shift( column, -1, 0 ) ), ( 32, 1, 1, column ),
+                                 ( 64, 1, -1, shift( column, 0, -1 ) ), ( 128, -1, -1, shift( column, -1, -1 ) ) ):
+        vertical = 1 if di < 0 else 4
+        horizontal = 2 if dj > 0 else 8
+        # the way (vertical then horizontal) or (horizontal then vertical)
+        way = maskOr( maskAnd( opens[vertical], shift( opens[horizontal], di, 0 ) ),
+                      maskAnd( opens[horizontal], shift( opens[vertical], 0, dj ) ) )
+        value |= int.from_bytes( maskAnd( way, maskNot( corner ) ), "little" ) << ( bit.bit_length() - 1 )
+    return value.to_bytes( size, "little" )
+
+
+def wallBytes( reader, size ):
+    '''One byte per cell with the bits (see WALL_BITS) of the wall layers
+    holding a tile in it'''
+    grids = reader.getGrids()
+    value = 0
+    for wallKind, bit in WALL_BITS.items():
+        value |= int.from_bytes( layerMask( grids.get( wallKind ), size ), "little" ) << ( bit.bit_length() - 1 )
+    return value.to_bytes( size, "little" )
+
+
+def paddedGrid( cells, width, height, paddedWidth, paddedHeight, pad ):
+    '''Copy of a byte grid with pad empty cells all around it (and
+    more on the east and south up to paddedWidth x paddedHeight)'''
+    padded = bytearray( paddedWidth*paddedHeight )
+    for i in range( height ):
+        start = ( i + pad )*paddedWidth + pad
+        padded[start:start + width] = cells[i*width:( i + 1 )*width]
+    return bytes( padded )
+
+
+def pvsJob( job ):
+    '''PVS of a share of the chunks (runs in a worker process). sight and
+    walkable and walls are the padded grids (see buildPVS). Returns the
+    bitsets of the chunks, one after the other'''
+    sight, walkable, walls, paddedWidth, chunkSize, reach, chunks = job
+    pad = reach*chunkSize
+    size = chunkSize + 2*pad
+    # window rows end with an empty guard cell, so a step east or west
+    # out of the window never lands on the next row
+    stride = size + 1
+    side = 2*reach + 1
+    rowBytes = windowBytes( reach )
+    tree = sightTree( pad )
+    shifts = dict( ( bit, di*stride + dj ) for bit, di, dj in SIGHT_STEPS )
+    # wall bit -> offset from the cell a wall faces back to its own cell
+    wallShifts = dict( ( WALL_BITS[wallKind], -( di*stride + dj ) ) for wallKind, ( di, dj ) in WALL_FACING.items() )
+    def bitset( digits ):
+        # bit k for the cell k of a window of "0"/"1" digits
+        return int( digits[::-1], 2 )
+    def chunkMask( a, b ):
+        row = b'0'*( b*chunkSize ) + b'1'*chunkSize + b'0'*( stride - ( b + 1 )*chunkSize )
+        return bitset( b'0'*( a*chunkSize*stride ) + row*chunkSize )
+    chunkMasks = [ chunkMask( a, b ) for a in range( side ) for b in range( side ) ]
+    centre = chunkMasks[reach*side + reach]
+    bitsets = []
+    for ci, cj in chunks:
+        top = ci*chunkSize*paddedWidth + cj*chunkSize
+        def window( grid ):
+            return b''.join( grid[top + r*paddedWidth:top + r*paddedWidth + size] + b'\x00' for r in range( size ) )
+        source = bitset( window( walkable ).translate( DIGIT_TABLE ) ) & centre
+        if ( not source ):
+            bitsets.append( bytes( rowBytes ) )
+            continue
+        sightWindow = window( sight )
+        opens = dict( ( bit, ( bitset( sightWindow.translate( STEP_TABLES[bit] ) ), shifts[bit] ) )
+                      for bit in shifts )
+        visible = source
+        stack = [ ( tree, source ) ]
+        while ( stack ):
+            node, cells = stack.pop()
+            for bit, child in node.items():
+                openCells, shift = opens[bit]
+                reached = cells & openCells
+                if ( reached ):
+                    reached = reached << shift if shift > 0 else reached >> -shift
+                    visible |= reached
+                    if ( child ):
+                        stack.append( ( child, reached ) )
+        # the walls facing the cells seen, not the walls facing those
+        # walls (guard cells and the cells out of the window have no
+        # wall, so the shifts never wrap around)
+        wallWindow = window( walls )
+        seenWalls = 0
+        for bit, shift in wallShifts.items():
+            faced = visible << shift if shift > 0 else visible >> -shift
+            seenWalls |= faced & bitset( wallWindow.translate( WALL_TABLES[bit] ) )
+        visible |= seenWalls
+        seen = 0
+        for index, mask in enumerate( chunkMasks ):
+            if ( visible & mask ):
+                seen |= 1 << index
+        bitsets.append( seen.to_bytes( rowBytes, "little" ) )
+    return b''.join( bitsets )
+
+
+def buildPVS( reader, parameters = None, workers = 1, graph = None ):
+    '''Builds the PotentialVisibility of a dungeon read by DungeonFileReader.
+    With more than one worker the chunk rows are shared out over a
+    process pool'''
+    parameters = parameters or PVSParameters()
+    graph = graph or buildNavGraph( reader )
+    width, height = graph.width, graph.height
+    chunkSize = parameters.chunkSize
+    reach = parameters.reach()
+    pad = reach*chunkSize
+    chunkColumns = -( -width//chunkSize )
+    chunkRows = -( -height//chunkSize )
+    paddedWidth = chunkColumns*chunkSize + 2*pad
+    paddedHeight = chunkRows*chunkSize + 2*pad
+    sight = paddedGrid( sightEdges( reader, graph ), width, height, paddedWidth, paddedHeight, pad )
+    walkable = paddedGrid( bytes( graph.walkable ), width, height, paddedWidth, paddedHeight, pad )
+    walls = paddedGrid( wallBytes( reader, width*height ), width, height, paddedWidth, paddedHeight, pad )
+    shares = max( 1, min( workers, chunkRows ) )
+    rows = [ range( chunkRows*k//shares, chunkRows*( k + 1 )//shares ) for k in range( shares ) ]
+    jobs = [ ( sight, walkable, walls, paddedWidth, chunkSize, reach, [ ( ci, cj ) for ci in share for cj in range( chunkColumns ) ] )
+             for share in rows ]
+    if ( shares > 1 ):
+        with ProcessPoolExecutor( max_workers = shares ) as pool:
+            results = list( pool.map( pvsJob, jobs ) )
+    else:
+        results = [ pvsJob( job ) for job in jobs ]
+    return PotentialVisibility( width, height, chunkSize, reach,
+                                symmetricBitsets( b''.join( results ), chunkColumns, reach ) )
+
+
+def symmetricBitsets( bits, chunkColumns, reach ):
+    '''Adds B to the PVS of A when A is in the PVS of B: a line from the
+    centre of a cell of A may cross a cell of B without the way back'''
+    side = 2*reach + 1
+    last = side*side - 1
+    rowBytes = windowBytes( reach )
+    bitsets = [ int.from_bytes( bits[k:k + rowBytes], "little" ) for k in range( 0, len(bits), rowBytes ) ]
+    result = list( bitsets )
+    for k, bitset in enumerate( bitsets ):
+        ci, cj = divmod( k, chunkColumns )
+        while ( bitset ):
+            low = bitset & -bitset
+            index = low.bit_length() - 1
+            a, b = divmod( index, side )
+            # the offset back is the mirrored bit
+            result[( ci + a - reach )*chunkColumns + cj + b - reach] |= 1 << ( last - index )
+            bitset ^= low
+    return b''.join( bitset.to_bytes( rowBytes, "little" ) for bitset in result )
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Builds the potentially visible sets of a TMX level (%s)" % PVS_SUFFIX )
+    parser.add_argument( "tmx", help = "TMX file of the level" )
+    parser.add_argument( "-o", "--output", help = "PVS file (default: next to the TMX file)" )
+    parser.add_argument( "--chunk-size", type = int, default = 8, help = "width and height of a chunk in cells" )
+    parser.add_argument( "--radius", type = int, default = 32, help = "farthest cell seen" )
+    parser.add_argument( "-j", "--jobs", type = int, default = 1, help = "number of worker processes" )
+    args = parser.parse_args( argv )
+    start = time.perf_counter()
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( args.tmx, streaming = True )
+    pvs = buildPVS( reader, PVSParameters( args.chunk_size, args.radius ), args.jobs )
+    output = args.output or pvsFileName( args.tmx )
+    pvs.save( output )
+    counts = [ bin( pvs.bitset( ( ci, cj ) ) ).count( "1" ) for ci in range( pvs.chunkRows ) for cj in range( pvs.chunkColumns ) ]
+    seen = [ count for count in counts if count ]
+    print( "%s: %d chunks with floor, %.1f visible on average (of %d in reach) -> %s, %d bytes (%.3f s)" %
+           ( args.tmx, len(seen), sum( seen )/max( 1, len(seen) ), ( 2*pvs.reach + 1 )**2, output,
+             os.path.getsize( output ), time.perf_counter() - start ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,410 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from ReadDungeonClass import DungeonFileReader
+from assetResolver import PrefabLibrary, levelPrefabs
+from instrumentation import NULL_PROFILER, StageProfiler
+from pngImage import Image, averageBytes, interleave, pngSize, readPNG, splitPlanes, withChannels, writePNG
+
+#====================================================
+# Texture atlases: the diffuse, normal and specular
+# textures of every prefab a level uses
+# (<kind>/textures/<name>D.png, N.png, S.png) are
+# packed into three shared atlases, D, N and S, with
+# the same layout, so the whole level renders with a
+# single material.
+#
+# Every texture gets a gutter (its border repeated,
+# wrapped around by default since the tiles are
+# seamless) and its slot is aligned to 2^mipLevels
+# pixels, so mip levels down to mipLevels never blend
+# two textures. A prefab's UVs (0..1, top-left origin
+# like glTF) map into its slot with
+#   uv' = uv*scale + offset
+# (see uvTransform and gltfExporter.py).
+#
+# The PNG files are read and written by pngImage.py,
+# mip halving works on big ints, a whole image at once.
+#
+# Atlases are cached in <atlasDir>/<key>/, key being
+# the hash of the input images and of the parameters,
+# so a level using the same textures reuses them
+#====================================================
+
+TEXTURE_CHANNELS = ( "D", "N", "S" )
+# colour of the slots (and of the free space) with no texture
+DEFAULT_FILL = { "D": ( 255, 255, 255, 255 ),
+                 "N": ( 128, 128, 255, 255 ),
+                 "S": ( 0, 0, 0, 255 ) }
+ATLAS_CACHE_VERSION = 2
+ATLAS_LAYOUT_NAME = "atlas.json"
+
+
+#====================================================
+# Image resizing
+#====================================================
+
+def halveImage( image ):
+    '''Image of half the size, every pixel the average of 2x2 pixels
+    (an odd last row or column is dropped)'''
+    width, height, channels = image.width//2, image.height//2, image.channels
+    if ( width == 0 or height == 0 ):
+        raise ValueError( "Image too small to be halved" )
+    stride = image.stride()
+    view = memoryview( image.pixels )
+    used = 2*width*channels
+    top = b''.join( view[2*y*stride:2*y*stride + used] for y in range( height ) )
+    bottom = b''.join( view[( 2*y + 1 )*stride:( 2*y + 1 )*stride + used] for y in range( height ) )
+    # round up one way and down the other so the image keeps its brightness
+    rows = averageBytes( top, bottom, roundUp = True )
+    planes = []
+    for k in range( channels ):
+        plane = rows[k::channels]
+        planes.append( averageBytes( plane[0::2], plane[1::2] ) )
+    return Image( width, height, channels, interleave( planes ) )
+
+
+def doubleImage( image ):
+    '''Image of twice the size, every pixel repeated 2x2 times'''
+    planes = []
+    for plane in splitPlanes( image ):
+        doubled = bytearray( 2*len(plane) )
+        doubled[0::2] = plane
+        doubled[1::2] = plane
+        planes.append( doubled )
+    pixels = interleave( planes )
+    stride = 2*image.stride()
+    view = memoryview( pixels )
+    rows = b''.join( view[y*stride:( y + 1 )*stride].tobytes()*2 for y in range( image.height ) )
+    return Image( 2*image.width, 2*image.height, image.channels, bytearray( rows ) )
+
+
+def resizeImage( image, width, height ):
+    '''Halves or doubles an image until it has the given size, which must
+    differ from its own by a power of two'''
+    while ( image.width > width and image.height > height ):
+        image = halveImage( image )
+    while ( image.width < width and image.height < height ):
+        image = doubleImage( image )
+    if ( image.width != width or image.height != height ):
+        raise ValueError( "Can not resize a %dx%d image to %dx%d" % ( image.width, image.height, width, height ) )
+    return image
+
+
+def gutterRows( image, gutter, mode = "wrap" ):
+    '''Rows of the image surrounded by a gutter of gutter pixels: the
+    opposite border of the image ("wrap", right for seamless textures)
+    or its own border repeated ("clamp")'''
+    channels = image.channels
+    rows = [ bytes( image.row( y ) ) for y in range( image.height ) ]
+    if ( gutter == 0 ):
+        return rows
+    side = gutter*channels
+    if ( mode == "wrap" and gutter <= min( image.width, image.height ) ):
+        rows = [ row[-side:] + row + row[:side] for row in rows ]
+        return rows[-gutter:] + rows + rows[:gutter]
+    rows = [ row[:channels]*gutter + row + row[-channels:]*gutter for row in rows ]
+    return [ rows[0] ]*gutter + rows + [ rows[-1] ]*gutter
+
+
+#====================================================
+# Packing
+#====================================================
+
+def nextPowerOfTwo( value ):
+    return 1 << max( 0, value - 1 ).bit_length()
+
+
+def packSlots( sizes, maxSize, powerOfTwo = False ):
+    '''Shelf packing of (width, height) slots, highest first. Every power
+    of two width from the widest slot up to maxSize is tried and the
+    smallest atlas is kept. Returns (width, height, [(x, y) of every slot])
+    or None if the slots do not fit in maxSize x maxSize'''
+    if ( not sizes ):
+        return ( 0, 0, [] )
+    order = sorted( range( len(sizes) ), key = lambda k: ( -sizes[k][1], -sizes[k][0], k ) )
+    best = None
+    width = nextPowerOfTwo( max( w for w, h in sizes ) )
+    while ( width <= maxSize ):
+        positions = [None]*len(sizes)
+        x = y = shelfHeight = 0
+        for k in order:
+            w, h = sizes[k]
+            if ( x + w > width ):
+                x, y, shelfHeight = 0, y + shelfHeight, 0
+            positions[k] = ( x, y )
+            x += w
+            shelfHeight = max( shelfHeight, h )
+        height = y + shelfHeight
+        if ( powerOfTwo ):
+            height = nextPowerOfTwo( height )
+        if ( height <= maxSize and ( best is None or ( width*height, max( width, height ) ) < ( best[0]*best[1], max( best[0], best[1] ) ) ) ):
+            best = ( width, height, positions )
+        width *= 2
+    return best
+
+
+class AtlasParameters():
+    '''Knobs of the atlas builder'''
+    def __init__( self, mipLevels = 4, gutter = None, gutterMode = "wrap", padding = 0, maxSize = 8192,
+                  maxTextureSize = None, powerOfTwo = False, compressLevel = 1 ):
+        # slots are aligned to 2^mipLevels pixels and the gutter is as
+        # wide by default, so mip level mipLevels still has 1 pixel of it
+        self.mipLevels = mipLevels
+        self.gutter = ( 1 << mipLevels ) if gutter is None else gutter
+        self.gutterMode = gutterMode
+        # free pixels between two slots (beyond the gutters)
+        self.padding = padding
+        # textures are halved until the atlas fits in maxSize x maxSize
+        # and each of them in maxTextureSize
+        self.maxSize = maxSize
+        self.maxTextureSize = maxTextureSize
+        self.powerOfTwo = powerOfTwo
+        # zlib level of the atlas files: they are a cache, level 1 is
+        # three times faster than 6 on textures for about the same size
+        self.compressLevel = compressLevel
+
+    def alignment( self ):
+        return 1 << self.mipLevels
+
+    def key( self ):
+        return "mip%d/gutter%d%s/padding%d/max%d/%s/pot%d" % ( self.mipLevels, self.gutter, self.gutterMode, self.padding,
+                                                               self.maxSize, self.maxTextureSize, self.powerOfTwo )
+
+
+def slotSize( width, height, parameters ):
+    '''Size of the slot of a texture: texture, gutters and padding,
+    rounded up to the mip alignment'''
+    align = parameters.alignment()
+    extra = 2*parameters.gutter + parameters.padding
+    return ( -( -( width + extra )//align )*align, -( -( height + extra )//align )*align )
+
+
+#====================================================
+# Texture sets and atlases
+#====================================================
+
+def prefabTextureSets( library, prefabNames ):
+    '''Finds the textures of prefabs: <kind>/textures/<name>D.png (N, S),
+    <kind> being the directory holding the models directory of the prefab's
+    .blend file and <name> the prefab name or else the .blend file name
+    (wall01.blend holds wallTile01 and ships wall01D.png ...).
+    Returns prefabName -> texture set name and texture set name ->
+    { channel: PNG file }; prefabs without textures are left out'''
+    byFile, missing = library.groupByFile( prefabNames )
+    prefabs = {}
+    textureSets = {}
+    for blendFile in sorted( byFile ):
+        texturesDir = os.path.join( os.path.dirname( os.path.dirname( blendFile ) ), "textures" )
+        for name in byFile[blendFile]:
+            for base in ( name, os.path.splitext( os.path.basename( blendFile ) )[0] ):
+                files = {}
+                for channel in TEXTURE_CHANNELS:
+                    fileName = os.path.join( texturesDir, base + channel + ".png" )
+                    if ( os.path.isfile( fileName ) ):
+                        files[channel] = fileName
+                if ( files ):
+                    setName = os.path.relpath( os.path.join( texturesDir, base ), library.dungeonsDir ).replace( os.sep, "/" )
+                    textureSets[setName] = files
+                    prefabs[name] = setName
+                    break
+    return prefabs, textureSets
+
+
+def atlasKey( textureSets, parameters ):
+    '''Hash of the input images (their content) and of the parameters'''
+    digest = hashlib.blake2b( digest_size = 20 )
+    digest.update( b'atlas%d;%s;' % ( ATLAS_CACHE_VERSION, parameters.key().encode( "utf-8" ) ) )
+    for setName in sorted( textureSets ):
+        for channel in sorted( textureSets[setName] ):
+            digest.update( ( "%s/%s;" % ( setName, channel ) ).encode( "utf-8" ) )
+            with open( textureSets[setName][channel], "rb" ) as png:
+                for block in iter( lambda: png.read( 1 << 20 ), b'' ):
+                    digest.update( block )
+    return digest.hexdigest()
+
+
+def loadLayout( entryDir ):
+    try:
+        with open( os.path.join( entryDir, ATLAS_LAYOUT_NAME ) ) as layoutFile:
+            layout = json.load( layoutFile )
+    except ( OSError, ValueError ):
+        return None
+    if ( layout.get( "version" ) != ATLAS_CACHE_VERSION ):
+        return None
+    if ( not all( os.path.isfile( os.path.join( entryDir, fileName ) ) for fileName in layout["files"].values() ) ):
+        return None
+    return layout
+
+
+def planAtlas( textureSets, parameters ):
+    '''Texture size of every set (the size of its D texture, halved as many
+    times as needed) and the packed slots. Returns (halvings, sizes, packing)'''
+    baseSizes = {}
+    for setName, files in textureSets.items():
+        reference = files.get( "D" ) or files[sorted( files )[0]]
+        baseSizes[setName] = pngSize( reference )
+    names = sorted( textureSets )
+    halvings = 0
+    if ( parameters.maxTextureSize ):
+        while ( any( max( w, h ) >> halvings > parameters.maxTextureSize for w, h in baseSizes.values() ) ):
+            halvings += 1
+    while True:
+        sizes = dict( ( name, ( baseSizes[name][0] >> halvings, baseSizes[name][1] >> halvings ) ) for name in names )
+        if ( any( w == 0 or h == 0 for w, h in sizes.values() ) ):
+            raise ValueError( "The textures do not fit in a %dx%d atlas" % ( parameters.maxSize, parameters.maxSize ) )
+        packing = packSlots( [ slotSize( w, h, parameters ) for w, h in ( sizes[name] for name in names ) ],
+                             parameters.maxSize, parameters.powerOfTwo )
+        if ( packing is not None ):
+            width, height, positions = packing
+            return halvings, sizes, ( width, height, dict( zip( names, positions ) ) )
+        halvings += 1
+
+
+def buildAtlases( textureSets, atlasDir, parameters = None, profiler = NULL_PROFILER ):
+    '''Packs texture sets (name -> { channel: PNG file }) into one atlas
+    per channel, or takes them from the cache in atlasDir.
+    Returns the layout: atlas size, files (channel -> PNG file name),
+    slots (set name -> [x, y, width, height] of its texture), uv (set
+    name -> [scaleU, scaleV, offsetU, offsetV]) and dir (where the files are)'''
+    parameters = parameters or AtlasParameters()
+    key = atlasKey( textureSets, parameters )
+    entryDir = os.path.join( atlasDir, key )
+    layout = loadLayout( entryDir )
+    profiler.count( "atlasCacheHit", int( layout is not None ) )
+    if ( layout is not None ):
+        layout["dir"] = entryDir
+        return layout
+    with profiler.stage( "atlasPack" ):
+        halvings, sizes, ( width, height, positions ) = planAtlas( textureSets, parameters )
+    gutter = parameters.gutter
+    channelsUsed = [ channel for channel in TEXTURE_CHANNELS if any( channel in files for files in textureSets.values() ) ]
+    if ( not os.path.isdir( entryDir ) ):
+        os.makedirs( entryDir )
+    files = {}
+    for channel in channelsUsed:
+        with profiler.stage( "atlasDecode", channel ):
+            images = {}
+            for setName in sorted( textureSets ):
+                fileName = textureSets[setName].get( channel )
+                if ( fileName is not None ):
+                    images[setName] = resizeImage( readPNG( fileName ), *sizes[setName] )
+        channels = max( [3] + [ image.channels for image in images.values() ] )
+        fill = bytes( DEFAULT_FILL[channel][:channels] )
+        with profiler.stage( "atlasBlit", channel ):
+            atlas = Image( width, height, channels, bytearray( fill*( width*height ) ) )
+            stride = atlas.stride()
+            for setName, ( x, y ) in positions.items():
+                image = images.get( setName )
+                if ( image is None ):
+                    continue
+                for k, row in enumerate( gutterRows( withChannels( image, channels ), gutter, parameters.gutterMode ) ):
+                    start = ( y + k )*stride + x*channels
+                    atlas.pixels[start:start + len(row)] = row
+        with profiler.stage( "atlasEncode", channel ):
+            files[channel] = "atlas%s.png" % channel
+            writePNG( os.path.join( entryDir, files[channel] ), atlas, parameters.compressLevel )
+    slots = {}
+    uv = {}
+    for setName, ( x, y ) in positions.items():
+        w, h = sizes[setName]
+        slots[setName] = [ x + gutter, y + gutter, w, h ]
+        uv[setName] = [ w/float( width ), h/float( height ), ( x + gutter )/float( width ), ( y + gutter )/float( height ) ]
+    layout = { "version": ATLAS_CACHE_VERSION,
+               "width": width,
+               "height": height,
+               "halvings": halvings,
+               "mipLevels": parameters.mipLevels,
+               "files": files,
+               "slots": slots,
+               "uv": uv }
+    temporaryName = os.path.join( entryDir, ATLAS_LAYOUT_NAME + ".tmp%d" % os.getpid() )
+    with open( temporaryName, "w" ) as layoutFile:
+        json.dump( layout, layoutFile, indent = 1, sort_keys = True )
+    os.replace( temporaryName, os.path.join( entryDir, ATLAS_LAYOUT_NAME ) )
+    layout["dir"] = entryDir
+    return layout
+
+
+def levelAtlas( reader, library, atlasDir, parameters = None, profiler = NULL_PROFILER ):
+    '''Atlases of the textures of the prefabs a dungeon read by
+    DungeonFileReader uses. The layout gets prefabs: prefabName ->
+    texture set name'''
+    prefabs, textureSets = prefabTextureSets( library, levelPrefabs( reader ) )
+    layout = buildAtlases( textureSets, atlasDir, parameters, profiler )
+    layout["prefabs"] = prefabs
+    return layout
+
+
+def uvTransform( layout, prefabName ):
+    '''(scaleU, scaleV, offsetU, offsetV) of a prefab in an atlas layout,
+    None for prefabs which are not in the atlas'''
+    setName = layout.get( "prefabs", {} ).get( prefabName )
+    return tuple( layout["uv"][setName] ) if setName is not None else None
+
+
+def remapUVs( uvs, transform ):
+    '''Flat list of (u, v) moved into an atlas slot'''
+    scaleU, scaleV, offsetU, offsetV = transform
+    remapped = list( uvs )
+    remapped[0::2] = [ u*scaleU + offsetU for u in uvs[0::2] ]
+    remapped[1::2] = [ v*scaleV + offsetV for v in uvs[1::2] ]
+    return remapped
+
+
+def remapTable( layout ):
+    '''UV remap table of every prefab of a level atlas (JSON ready)'''
+    return { "uvOrigin": "top-left",
+             "atlas": dict( ( channel, os.path.join( layout["dir"], fileName ) ) for channel, fileName in layout["files"].items() ),
+             "prefabs": dict( ( prefabName, dict( zip( ( "scaleU", "scaleV", "offsetU", "offsetV" ), uvTransform( layout, prefabName ) ) ) )
+                              for prefabName in sorted( layout.get( "prefabs", {} ) ) ) }
+
+
+def main( argv = None ):
+    defaultDungeons = os.path.join( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ), "Dungeons" )
+    parser = argparse.ArgumentParser( description = "Packs the textures of the prefabs of a level into D, N and S atlases" )
+    parser.add_argument( "tmx", help = "TMX file of the level" )
+    parser.add_argument( "-o", "--output", help = "directory to copy the atlases and their UV remap table (atlasUV.json) to" )
+    parser.add_argument( "--dungeons", default = defaultDungeons, help = "directory of the dungeon sets" )
+    parser.add_argument( "--set", default = "*", help = "dungeon set (default: all)" )
+    parser.add_argument( "--cache", help = "atlas cache directory (default: <dungeons>/atlasCache)" )
+    parser.add_argument( "--mip-levels", type = int, default = 4 )
+    parser.add_argument( "--gutter-mode", choices = ( "wrap", "clamp" ), default = "wrap" )
+    parser.add_argument( "--padding", type = int, default = 0 )
+    parser.add_argument( "--max-size", type = int, default = 8192, help = "largest atlas width and height" )
+    parser.add_argument( "--max-texture-size", type = int, help = "halve the textures bigger than this" )
+    parser.add_argument( "--power-of-two", action = "store_true", help = "power of two atlas sizes" )
+    parser.add_argument( "--profile", help = "JSON file for the time, peak memory and counters of every stage" )
+    args = parser.parse_args( argv )
+    start = time.perf_counter()
+    profiler = StageProfiler( traceMemory = True ) if args.profile else NULL_PROFILER
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( args.tmx, profiler = profiler )
+    parameters = AtlasParameters( mipLevels = args.mip_levels, gutterMode = args.gutter_mode, padding = args.padding,
+                                  maxSize = args.max_size, maxTextureSize = args.max_texture_size, powerOfTwo = args.power_of_two )
+    library = PrefabLibrary( args.dungeons, args.set )
+    layout = levelAtlas( reader, library, args.cache or os.path.join( args.dungeons, "atlasCache" ), parameters, profiler )
+    table = remapTable( layout )
+    if ( args.output ):
+        if ( not os.path.isdir( args.output ) ):
+            os.makedirs( args.output )
+        for channel, fileName in layout["files"].items():
+            shutil.copyfile( os.path.join( layout["dir"], fileName ), os.path.join( args.output, fileName ) )
+            table["atlas"][channel] = fileName
+        with open( os.path.join( args.output, "atlasUV.json" ), "w" ) as tableFile:
+            json.dump( table, tableFile, indent = 1 )
+    if ( args.profile ):
+        profiler.stop()
+        profiler.save( args.profile )
+    print( "%s: %d prefabs in %d texture sets -> %dx%d atlases (%.3f s)" %
+           ( args.tmx, len(layout["prefabs"]), len(layout["slots"]), layout["width"], layout["height"], time.perf_counter() - start ) )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
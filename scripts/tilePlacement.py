@@ -0,0 +1,163 @@
+#====================================================
+# Placement rules of the dungeon tiles: where (and how
+# rotated) the 3D model of a cell in row i, column j
+# of a layer is put in the scene.
+# Floor tile of the cell (i, j) is at (j*size, -i*size, 0)
+# i.e. rows go along -Y and columns along +X.
+#====================================================
+
+from layerRegistry import LAYER_REGISTRY, LAYER_SPECS
+
+Pi = 3.141592653589793238462643383279502884 # 180 degrees
+
+#"actual" size of the floor tile in meters
+FLOOR_TILE_SIZE = 3.67267
+CEILING_HEIGHT = 3.0
+
+# Wall layers: a wall tile in the cell (i, j) lies on the edge between
+# (i, j) and its walkable neighbour and faces that neighbour.
+# E.g. a North wall is the northern wall of a room: it is put on the
+# southern edge of its cell and is seen from the cell below it.
+# wall kind -> (row, column) offset of the cell the wall faces
+WALL_FACING = { "wallN": ( 1, 0 ),
+                "wallS": ( -1, 0 ),
+                "wallE": ( 0, -1 ),
+                "wallW": ( 0, 1 ) }
+
+LAYER_KINDS = [ spec.kind for spec in LAYER_REGISTRY ]
+
+# placement rules of the layers whose tiles are flat squares centred on
+# their cells, which can be merged into bigger quads (see layerQuads),
+# and the Blender-space normal of their tiles
+QUAD_NORMALS = { "floor": ( 0.0, 0.0, 1.0 ),
+                 "ceiling": ( 0.0, 0.0, -1.0 ) }
+
+
+def placementRule( layerKind, floorTileSize = FLOOR_TILE_SIZE, ceilingHeight = CEILING_HEIGHT ):
+    '''Returns (displacement, rotation) applied to every tile of a layer
+    on top of the position of its cell. layerKind is a kind of the layer
+    registry (see layerRegistry.py) or directly the name of a rule'''
+    spec = LAYER_SPECS.get( layerKind )
+    rule = spec.placement if spec is not None else layerKind
+    displ = floorTileSize/2.0
+    rules = { "floor":   ( (0.0, 0.0, 0.0), (0.0, 0.0, 0.0) ),
+              "wallN":   ( (0.0, -displ, 0.0), (0.0, 0.0, 0.0) ),
+              "wallW":   ( (displ, 0.0, 0.0), (0.0, 0.0, Pi/2) ),
+              "wallS":   ( (0.0, displ, 0.0), (0.0, 0.0, Pi) ),
+              "wallE":   ( (-displ, 0.0, 0.0), (0.0, 0.0, -Pi/2) ),
+              "column":  ( (displ, -displ, 0.0), (0.0, 0.0, 0.0) ),
+              "ceiling": ( (0.0, 0.0, ceilingHeight), (0.0, 0.0, 0.0) ),
+              # wall boxes, torch holders, chains, ceiling bars: models are
+              # already offset within their cells
+              "decoration": ( (0.0, 0.0, 0.0), (0.0, 0.0, 0.0) ) }
+    return rules[rule]
+
+
+def prefabDisplacements( layerKind, displacement, floorTileSize = FLOOR_TILE_SIZE ):
+    '''Returns a dictionary prefabName -> displacement of the prefabs of
+    a layer which have their own offsets on top of the displacement of
+    the layer (see LayerSpec.prefabOffsets), empty for most layers'''
+    spec = LAYER_SPECS.get( layerKind )
+    if ( spec is None ):
+        return {}
+    return dict( ( prefabName, tuple( d + o*floorTileSize for d, o in zip( displacement, offset ) ) )
+                 for prefabName, offset in spec.prefabOffsets.items() )
+
+
+def cellLocation( i, j, displacement, floorTileSize = FLOOR_TILE_SIZE ):
+    '''Location of a tile of the cell (i, j)'''
+    displX, displY, displZ = displacement
+    return ( j*floorTileSize + displX, -i*floorTileSize + displY, displZ )
+
+
+def layerTransforms( grid, layerKind, floorTileSize = FLOOR_TILE_SIZE, ceilingHeight = CEILING_HEIGHT ):
+    '''Computes the placement of every non-empty cell of a layer grid.
+    Returns a list of (prefabName, location, rotation), only occupied
+    cells are visited'''
+    displacement, rotation = placementRule( layerKind, floorTileSize, ceilingHeight )
+    displacements = prefabDisplacements( layerKind, displacement, floorTileSize )
+    if ( displacements ):
+        return [ ( prefabName, cellLocation( i, j, displacements.get( prefabName, displacement ), floorTileSize ), rotation )
+                 for i, j, prefabName in grid.occupiedCells() ]
+    displX, displY, displZ = displacement
+    return [ ( prefabName, ( j*floorTileSize + displX, -i*floorTileSize + displY, displZ ), rotation )
+             for i, j, prefabName in grid.occupiedCells() ]
+
+
+def dungeonTransforms( reader ):
+    '''Computes the placement of all the tiles of a dungeon read by
+    DungeonFileReader. Returns a dictionary layerKind -> transforms'''
+    transforms = {}
+    for layerKind, grid in reader.getGrids().items():
+        if ( grid is None ):
+            transforms[layerKind] = []
+        else:
+            transforms[layerKind] = layerTransforms( grid, layerKind, reader.floorTileSize, reader.ceilingHeight )
+    return transforms
+
+
+def dungeonChunkTransforms( reader, chunkSize = 16 ):
+    '''Splits the map into square chunks of chunkSize x chunkSize cells and
+    computes the placement of all the tiles (of all the layers) of every chunk.
+    Returns a dictionary (chunkRow, chunkColumn) -> list of
+    (prefabName, location, rotation)'''
+    chunks = {}
+    floorTileSize = reader.floorTileSize
+    for layerKind, grid in reader.getGrids().items():
+        if ( grid is None ):
+            continue
+        displacement, rotation = placementRule( layerKind, floorTileSize, reader.ceilingHeight )
+        displacements = prefabDisplacements( layerKind, displacement, floorTileSize )
+        for i, j, prefabName in grid.occupiedCells():
+            key = ( i//chunkSize, j//chunkSize )
+            tiles = chunks.get( key )
+            if ( tiles is None ):
+                tiles = chunks[key] = []
+            location = cellLocation( i, j, displacements.get( prefabName, displacement ), floorTileSize )
+            tiles.append( ( prefabName, location, rotation ) )
+    return chunks
+
+
+def layerCellTransforms( grid, layerKind, floorTileSize = FLOOR_TILE_SIZE, ceilingHeight = CEILING_HEIGHT ):
+    '''Same as layerTransforms, but keeps the cell of every tile.
+    Returns a list of (row, column, prefabName, location, rotation)'''
+    displacement, rotation = placementRule( layerKind, floorTileSize, ceilingHeight )
+    displacements = prefabDisplacements( layerKind, displacement, floorTileSize )
+    return [ ( i, j, prefabName, cellLocation( i, j, displacements.get( prefabName, displacement ), floorTileSize ), rotation )
+             for i, j, prefabName in grid.occupiedCells() ]
+
+
+def layerQuads( grid, layerKind, floorTileSize = FLOOR_TILE_SIZE, ceilingHeight = CEILING_HEIGHT, minCells = 2 ):
+    '''Greedy meshing of a floor or ceiling layer: every rectangle of at
+    least minCells cells holding one prefab (see LayerGrid.rectangles)
+    becomes a single quad, the other cells stay tiles.
+    Returns (quads, transforms): quads are (prefabName, corners, normal,
+    (columns, rows)), corners being the 4 Blender-space corners counter-
+    clockwise seen from the side the quad faces, to be given the tiled
+    UVs (0, rows), (columns, rows), (columns, 0), (0, 0) (top-left
+    origin); transforms are (prefabName, location, rotation) like the
+    ones of layerTransforms'''
+    spec = LAYER_SPECS.get( layerKind )
+    normal = QUAD_NORMALS.get( spec.placement if spec is not None else layerKind )
+    if ( normal is None ):
+        raise ValueError( "The tiles of layer %s can not be merged into quads" % layerKind )
+    displacement, rotation = placementRule( layerKind, floorTileSize, ceilingHeight )
+    displX, displY, z = displacement
+    half = floorTileSize/2.0
+    quads = []
+    transforms = []
+    for i, j, rows, columns, prefabName in grid.rectangles():
+        if ( rows*columns < minCells ):
+            transforms.extend( ( prefabName, cellLocation( i + a, j + b, displacement, floorTileSize ), rotation )
+                               for a in range( rows ) for b in range( columns ) )
+            continue
+        left = j*floorTileSize - half + displX
+        right = ( j + columns )*floorTileSize - half + displX
+        top = -i*floorTileSize + half + displY
+        bottom = -( i + rows )*floorTileSize + half + displY
+        if ( normal[2] > 0 ):
+            corners = [ ( left, bottom, z ), ( right, bottom, z ), ( right, top, z ), ( left, top, z ) ]
+        else:
+            corners = [ ( left, top, z ), ( right, top, z ), ( right, bottom, z ), ( left, bottom, z ) ]
+        quads.append( ( prefabName, corners, normal, ( columns, rows ) ) )
+    return quads, transforms
@@ -0,0 +1,153 @@
+import argparse
+import base64
+import gzip
+import random
+import struct
+import sys
+import zlib
+
+from layerGrid import maskAnd, maskNot, shiftMask
+
+#====================================================
+# Seeded generator of synthetic, but realistic TMX
+# levels for benchmarks: rooms joined by corridors,
+# all four wall layers, columns in the corners of the
+# rooms and a ceiling over every floor cell.
+# Layer and tileset names follow the conventions of
+# DungeonFileReader (see ReadDungeonClass.py)
+#====================================================
+
+ENCODINGS = [ "xml", "csv", "base64", "base64-zlib", "base64-gzip" ]
+
+# tilesets: (name, firstgid, prefab names of the tiles)
+SYNTH_TILESETS = [ ( "floorTiles", 1, [ "floorTile01" ] ),
+                   ( "wallTiles", 101, [ "wallTile01", "wallTile01", "wallTile01", "wallTile01" ] ),
+                   ( "ceilingTiles", 201, [ "ceilingTile01" ] ),
+                   ( "columnTiles", 301, [ "column01" ] ) ]
+
+# layers: (name, gid of the tiles in the layer)
+SYNTH_LAYERS = [ ( "floorTiles", 1 ),
+                 ( "wallTilesN", 101 ),
+                 ( "wallTilesS", 103 ),
+                 ( "wallTilesE", 104 ),
+                 ( "wallTilesW", 102 ),
+                 ( "columns", 301 ),
+                 ( "ceilingTiles", 201 ) ]
+
+
+def carveRooms( width, height, seed, cellsPerRoom = 150 ):
+    '''Returns the floor mask (bytearray, 1 = floor) with rooms joined by
+    L-shaped corridors, and the list of rooms (row, column, rows, columns)'''
+    rng = random.Random( seed )
+    floor = bytearray( width*height )
+    rooms = []
+    roomCount = max( 2, width*height//cellsPerRoom )
+    for k in range( roomCount ):
+        rows = rng.randint( 3, 10 )
+        columns = rng.randint( 3, 10 )
+        if ( rows + 2 >= height or columns + 2 >= width ):
+            continue
+        i = rng.randint( 1, height - rows - 1 )
+        j = rng.randint( 1, width - columns - 1 )
+        rooms.append( ( i, j, rows, columns ) )
+        for r in range( i, i + rows ):
+            floor[r*width + j:r*width + j + columns] = b'\x01'*columns
+    # joining the rooms in a serpentine order over bands of 16 rows
+    # keeps the corridors short
+    rooms.sort( key = lambda room: ( room[0]//16, room[1] if ( room[0]//16 ) % 2 == 0 else -room[1] ) )
+    for a, b in zip( rooms, rooms[1:] ):
+        i0, j0 = a[0] + a[2]//2, a[1] + a[3]//2
+        i1, j1 = b[0] + b[2]//2, b[1] + b[3]//2
+        left, right = min( j0, j1 ), max( j0, j1 )
+        floor[i0*width + left:i0*width + right + 1] = b'\x01'*( right - left + 1 )
+        for r in range( min( i0, i1 ), max( i0, i1 ) + 1 ):
+            floor[r*width + j1] = 1
+    return floor, rooms
+
+
+def synthLayers( width, height, seed ):
+    '''Returns a dictionary layerName -> mask (bytearray, one byte per cell)'''
+    floor, rooms = carveRooms( width, height, seed )
+    solid = maskNot( floor )
+    layers = { "floorTiles": floor, "ceilingTiles": bytearray( floor ) }
+    # a wall lies on a solid cell facing a floor cell (see WALL_FACING in tilePlacement.py)
+    layers["wallTilesN"] = maskAnd( solid, shiftMask( floor, width, height, 1, 0 ) )
+    layers["wallTilesS"] = maskAnd( solid, shiftMask( floor, width, height, -1, 0 ) )
+    layers["wallTilesE"] = maskAnd( solid, shiftMask( floor, width, height, 0, -1 ) )
+    layers["wallTilesW"] = maskAnd( solid, shiftMask( floor, width, height, 0, 1 ) )
+    # columns stand in the corners of the bigger rooms
+    columns = bytearray( width*height )
+    for i, j, rows, cols in rooms:
+        if ( rows >= 6 and cols >= 6 ):
+            for r, c in ( ( i, j ), ( i, j + cols - 2 ), ( i + rows - 2, j ), ( i + rows - 2, j + cols - 2 ) ):
+                columns[r*width + c] = 1
+    layers["columns"] = columns
+    return layers
+
+
+def encodeLayer( mask, gid, encoding ):
+    '''Text of the "data" element of a layer whose set cells hold gid'''
+    if ( encoding == "xml" ):
+        tiles = ( ' <tile gid="0"/>', ' <tile gid="%d"/>' % gid )
+        return "\n" + "\n".join( map( tiles.__getitem__, mask ) ) + "\n  "
+    if ( encoding == "csv" ):
+        return "\n" + ",".join( map( ( "0", str(gid) ).__getitem__, mask ) ) + "\n"
+    raw = b''.join( map( ( b'\x00\x00\x00\x00', struct.pack( "<I", gid ) ).__getitem__, mask ) )
+    if ( encoding == "base64-zlib" ):
+        raw = zlib.compress( raw )
+    elif ( encoding == "base64-gzip" ):
+        raw = gzip.compress( raw )
+    return "\n" + base64.b64encode( raw ).decode( "ascii" ) + "\n"
+
+
+def dataAttributes( encoding ):
+    if ( encoding == "xml" ):
+        return ""
+    if ( encoding == "csv" ):
+        return ' encoding="csv"'
+    if ( encoding == "base64" ):
+        return ' encoding="base64"'
+    return ' encoding="base64" compression="%s"' % encoding.split( "-" )[1]
+
+
+def writeSynthLevel( fileName, width, height, seed = 1, encoding = "base64-zlib" ):
+    '''Writes a synthetic level into a TMX file. Returns the layer masks'''
+    if ( encoding not in ENCODINGS ):
+        raise ValueError( "Unknown encoding: %s" % encoding )
+    layers = synthLayers( width, height, seed )
+    with open( fileName, "w" ) as tmx:
+        tmx.write( '<?xml version="1.0" encoding="UTF-8"?>\n' )
+        tmx.write( '<map version="1.0" orientation="orthogonal" width="%d" height="%d" tilewidth="32" tileheight="32">\n'
+                   % ( width, height ) )
+        tmx.write( ' <properties>\n  <property name="name" value="synth%dx%d_%d"/>\n </properties>\n'
+                   % ( width, height, seed ) )
+        for name, firstGID, prefabs in SYNTH_TILESETS:
+            tmx.write( ' <tileset firstgid="%d" name="%s" tilewidth="32" tileheight="32">\n' % ( firstGID, name ) )
+            tmx.write( '  <image source="tilesets/%s.png" width="320" height="320"/>\n' % name )
+            for tileID, prefabName in enumerate( prefabs ):
+                tmx.write( '  <tile id="%d">\n   <properties>\n' % tileID )
+                tmx.write( '    <property name="prefabName" value="%s"/>\n' % prefabName )
+                tmx.write( '   </properties>\n  </tile>\n' )
+            tmx.write( ' </tileset>\n' )
+        for name, gid in SYNTH_LAYERS:
+            tmx.write( ' <layer name="%s" width="%d" height="%d">\n' % ( name, width, height ) )
+            tmx.write( '  <data%s>' % dataAttributes( encoding ) )
+            tmx.write( encodeLayer( layers[name], gid, encoding ) )
+            tmx.write( '</data>\n </layer>\n' )
+        tmx.write( '</map>\n' )
+    return layers
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = "Writes a synthetic TMX dungeon for benchmarks" )
+    parser.add_argument( "output", help = "TMX file to write" )
+    parser.add_argument( "--size", type = int, default = 128, help = "width and height of the map in cells" )
+    parser.add_argument( "--seed", type = int, default = 1 )
+    parser.add_argument( "--encoding", choices = ENCODINGS, default = "base64-zlib" )
+    args = parser.parse_args( argv )
+    writeSynthLevel( args.output, args.size, args.size, args.seed, args.encoding )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,133 @@
+import base64
+import gzip
+import sys
+import zlib
+from array import array
+from xml.sax.saxutils import quoteattr
+
+from ReadDungeonClass import GID_TYPECODE
+from layerRegistry import LAYER_REGISTRY
+from tmxSynth import ENCODINGS, dataAttributes
+
+#====================================================
+# Writes the layer grids of a DungeonFileReader back
+# into a Tiled (TMX) file, e.g. levels built by the
+# procedural generator (see proceduralDungeon.py).
+# Layers and tilesets are named after the layer
+# registry (see layerRegistry.py), so the file reads
+# back into the same grids. The flip/rotation flags of
+# the reader (see DungeonFileReader.layerFlags) are put
+# back into the highest bits of the gid's
+#====================================================
+
+# byte-wise translation table moving the flags of a cell (0..15, see
+# FLAGS_TABLE) back into the upper four bits of the highest byte of a gid
+UNSHIFT_FLAGS_TABLE = bytes( ( b << 4 ) & 0xFF for b in range(256) )
+
+# characters an XML parser would turn into spaces in an attribute
+ATTRIBUTE_ENTITIES = { "\n": "&#10;", "\r": "&#13;", "\t": "&#9;" }
+
+
+def attribute( value ):
+    '''Quoted and escaped XML attribute value'''
+    return quoteattr( str( value ), ATTRIBUTE_ENTITIES )
+
+
+def buildTilesetIndex( tilesets ):
+    '''Tileset index (see DungeonFileReader.buildTilesetIndex) of a list
+    of (tilesetName, firstGID, prefab names of the tiles)'''
+    index = {}
+    for name, firstGID, prefabs in tilesets:
+        index[name] = { "firstgid": firstGID,
+                        "properties": dict( ( tileID, { "prefabName": prefab } ) for tileID, prefab in enumerate( prefabs ) ),
+                        "prefabs": dict( ( tileID + firstGID, prefab ) for tileID, prefab in enumerate( prefabs ) ) }
+    return index
+
+
+def layerGIDs( grid, tileset ):
+    '''gid's of all the cells of a layer grid (0 for empty cells)'''
+    gidOf = dict( ( prefab, gid ) for gid, prefab in tileset["prefabs"].items() )
+    table = [0]*len( grid.symbols )
+    for symbol in set( grid.cells ):
+        if ( symbol ):
+            name = grid.symbols.names[symbol]
+            if ( name not in gidOf ):
+                raise ValueError( "Prefab %s is not in the tileset of its layer" % name )
+            table[symbol] = gidOf[name]
+    return array( GID_TYPECODE, map( table.__getitem__, grid.cells ) )
+
+
+def mergeGIDFlags( gids, flags ):
+    '''gid's with the flip/rotation flags of every cell (bytes, one per
+    cell, see DungeonFileReader.splitGIDFlags) set again'''
+    if ( len(flags) != len(gids) ):
+        raise ValueError( "%d flags for a layer of %d cells" % ( len(flags), len(gids) ) )
+    if ( sys.byteorder == "big" ):
+        gids = array( gids.typecode, gids )
+        gids.byteswap()
+    raw = bytearray( gids.tobytes() )
+    # flags live in the highest byte of every little-endian gid
+    highest = int.from_bytes( raw[3::4], "little" ) | int.from_bytes( flags.translate( UNSHIFT_FLAGS_TABLE ), "little" )
+    raw[3::4] = highest.to_bytes( len(flags), "little" )
+    merged = array( gids.typecode )
+    merged.frombytes( raw )
+    if ( sys.byteorder == "big" ):
+        merged.byteswap()
+    return merged
+
+
+def encodeGIDs( gids, encoding ):
+    '''Text of the "data" element of a layer'''
+    if ( encoding == "xml" ):
+        return "\n" + "\n".join( ' <tile gid="%d"/>' % gid for gid in gids ) + "\n  "
+    if ( encoding == "csv" ):
+        return "\n" + ",".join( map( str, gids ) ) + "\n"
+    if ( sys.byteorder == "big" ):
+        gids = array( gids.typecode, gids )
+        gids.byteswap()
+    raw = gids.tobytes()
+    if ( encoding == "base64-zlib" ):
+        raw = zlib.compress( raw )
+    elif ( encoding == "base64-gzip" ):
+        raw = gzip.compress( raw )
+    return "\n" + base64.b64encode( raw ).decode( "ascii" ) + "\n"
+
+
+def writeDungeonTMX( reader, fileName, encoding = "base64-zlib", properties = None ):
+    '''Writes the non-empty layer grids of a dungeon into a TMX file'''
+    if ( encoding not in ENCODINGS ):
+        raise ValueError( "Unknown encoding: %s" % encoding )
+    tilesets = sorted( reader.tilesetIndex.items(), key = lambda item: item[1]["firstgid"] )
+    with open( fileName, "w", encoding = "utf-8" ) as tmx:
+        tmx.write( '<?xml version="1.0" encoding="UTF-8"?>\n' )
+        tmx.write( '<map version="1.0" orientation="orthogonal" width="%d" height="%d" tilewidth="32" tileheight="32">\n'
+                   % ( reader.mapWidth, reader.mapHeight ) )
+        if ( properties ):
+            tmx.write( ' <properties>\n' )
+            for name in sorted( properties ):
+                tmx.write( '  <property name=%s value=%s/>\n' % ( attribute( name ), attribute( properties[name] ) ) )
+            tmx.write( ' </properties>\n' )
+        for name, tileset in tilesets:
+            tmx.write( ' <tileset firstgid="%d" name=%s tilewidth="32" tileheight="32">\n' % ( tileset["firstgid"], attribute( name ) ) )
+            tmx.write( '  <image source=%s width="320" height="320"/>\n' % attribute( "tilesets/%s.png" % name ) )
+            for tileID in sorted( tileset["properties"] ):
+                tmx.write( '  <tile id="%d">\n   <properties>\n' % tileID )
+                for propertyName, value in sorted( tileset["properties"][tileID].items() ):
+                    tmx.write( '    <property name=%s value=%s/>\n' % ( attribute( propertyName ), attribute( value ) ) )
+                tmx.write( '   </properties>\n  </tile>\n' )
+            tmx.write( ' </tileset>\n' )
+        grids = reader.getGrids()
+        for spec in LAYER_REGISTRY:
+            grid = grids.get( spec.kind )
+            if ( grid is None or len(grid) == 0 or grid.occupiedCount() == 0 ):
+                continue
+            gids = layerGIDs( grid, reader.tilesetIndex[spec.tilesetName] )
+            # the flags were read from whichever name the layer had
+            flags = next( ( reader.layerFlags[name] for name in spec.layerNames if name in reader.layerFlags ), None )
+            if ( flags is not None ):
+                gids = mergeGIDFlags( gids, flags )
+            tmx.write( ' <layer name=%s width="%d" height="%d">\n' % ( attribute( spec.layerNames[0] ), grid.width, grid.height ) )
+            tmx.write( '  <data%s>' % dataAttributes( encoding ) )
+            tmx.write( encodeGIDs( gids, encoding ) )
+            tmx.write( '</data>\n </layer>\n' )
+        tmx.write( '</map>\n' )
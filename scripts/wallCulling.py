@@ -0,0 +1,56 @@
+from array import array
+
+from layerGrid import FULL_BYTE_TABLE, shiftMask
+from tilePlacement import WALL_FACING
+
+#====================================================
+# Hidden wall culling: a wall tile is only ever seen
+# from the cell it faces (see WALL_FACING in
+# tilePlacement.py), so walls facing cells without
+# floor (solid rock, the other side of a back-to-back
+# wall, outside of the map) can be dropped before the
+# level is instanced or exported
+#====================================================
+
+# wall kind -> name of the grid attribute of DungeonFileReader
+WALL_GRIDS = { "wallN": "wallGridN",
+               "wallS": "wallGridS",
+               "wallE": "wallGridE",
+               "wallW": "wallGridW" }
+
+
+def cullGrid( grid, visibleMask ):
+    '''Empties every cell of the grid whose visibleMask byte is 0.
+    Returns the number of emptied (non-empty before) cells'''
+    before = grid.occupiedCount()
+    if ( grid.cells.typecode == 'B' ):
+        keep = int.from_bytes( bytes( visibleMask ).translate( FULL_BYTE_TABLE ), "little" )
+        cells = int.from_bytes( grid.cells.tobytes(), "little" ) & keep
+        culled = array( 'B', cells.to_bytes( len(grid.cells), "little" ) )
+    else:
+        culled = array( grid.cells.typecode,
+                        ( s if v else 0 for s, v in zip( grid.cells, visibleMask ) ) )
+    grid.cells = culled
+    return before - grid.occupiedCount()
+
+
+def cullHiddenWalls( reader ):
+    '''Drops every wall of a dungeon read by DungeonFileReader which cannot
+    be seen from a walkable (floor) cell. Works on whole grids at once.
+    Returns a dictionary wallKind -> number of removed walls'''
+    removed = {}
+    floorGrid = reader.floorGrid
+    width = reader.mapWidth
+    for wallKind, gridName in WALL_GRIDS.items():
+        grid = getattr( reader, gridName )
+        if ( grid is None or len(grid) == 0 ):
+            removed[wallKind] = 0
+            continue
+        height = grid.height
+        if ( floorGrid is None or len(floorGrid) != len(grid) ):
+            floorMask = bytearray( width*height )
+        else:
+            floorMask = floorGrid.nonEmptyMask()
+        removed[wallKind] = cullGrid( grid, shiftMask( floorMask, width, height, *WALL_FACING[wallKind] ) )
+        reader.gridChanged( gridName )
+    return removed
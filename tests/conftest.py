@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.join( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ), "scripts" )
+DUNGEONS_DIR = os.path.join( os.path.dirname( SCRIPTS_DIR ), "Dungeons" )
+BUNDLED_LEVEL = os.path.join( DUNGEONS_DIR, "Brunstom", "levels", "currentLevel.tmx" )
+
+# the scripts are plain modules, not a package
+if ( SCRIPTS_DIR not in sys.path ):
+    sys.path.insert( 0, SCRIPTS_DIR )
+
+
+@pytest.fixture
+def bundledReader():
+    '''The bundled level read with the DOM loader'''
+    from ReadDungeonClass import DungeonFileReader
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( BUNDLED_LEVEL )
+    return reader
+
+
+def makeReader( layers, prefabs = None ):
+    '''A DungeonFileReader holding hand-drawn layers: layerKind -> list of
+    strings, one per row, with any character other than "." for a tile.
+    Tiles get the prefab prefabs[layerKind] (default "<layerKind>01")'''
+    from ReadDungeonClass import DungeonFileReader
+    from layerGrid import LayerGrid, PrefabSymbols
+    prefabs = prefabs or {}
+    symbols = PrefabSymbols()
+    grids = {}
+    width = height = 0
+    for layerKind, rows in layers.items():
+        height = len(rows)
+        width = len(rows[0])
+        grid = LayerGrid( width, height, symbols )
+        for i, row in enumerate( rows ):
+            for j, c in enumerate( row ):
+                if ( c != "." ):
+                    grid.setCell( i, j, prefabs.get( layerKind, layerKind + "01" ) )
+        grids[layerKind] = grid
+    reader = DungeonFileReader()
+    reader.mapWidth = width
+    reader.mapHeight = height
+    reader.setGrids( grids, symbols )
+    return reader
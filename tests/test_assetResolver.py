@@ -0,0 +1,43 @@
+import os
+
+from assetResolver import PrefabLibrary, indexFileNameFor
+
+
+def modelLibrary( root ):
+    '''A dungeons directory with two empty .blend models'''
+    dungeonsDir = root / "Dungeons"
+    for kind, model in ( ( "wall", "wall01.blend" ), ( "floor", "floor01.blend" ) ):
+        models = dungeonsDir / "Set" / kind / "models"
+        models.mkdir( parents = True )
+        ( models / model ).write_bytes( b'' )
+    return str( dungeonsDir )
+
+
+def fakeObjects( fileName ):
+    return [ os.path.splitext( os.path.basename( fileName ) )[0].replace( "01", "Tile01" ) ]
+
+
+def test_index_is_kept_out_of_the_dungeons_directory( tmp_path, monkeypatch ):
+    monkeypatch.setenv( "XDG_CACHE_HOME", str( tmp_path / "cache" ) )
+    dungeonsDir = modelLibrary( tmp_path )
+    library = PrefabLibrary( dungeonsDir, listObjects = fakeObjects )
+    assert sorted( library.scan() ) == [ "floorTile01", "wallTile01" ]
+    assert os.path.isfile( indexFileNameFor( dungeonsDir ) )
+    assert os.path.commonpath( [ indexFileNameFor( dungeonsDir ), str( tmp_path / "cache" ) ] ) == str( tmp_path / "cache" )
+    assert sorted( os.listdir( dungeonsDir ) ) == [ "Set" ]
+
+
+def test_unchanged_models_are_not_read_again( tmp_path, monkeypatch ):
+    monkeypatch.setenv( "XDG_CACHE_HOME", str( tmp_path / "cache" ) )
+    dungeonsDir = modelLibrary( tmp_path )
+    PrefabLibrary( dungeonsDir, listObjects = fakeObjects ).scan()
+    library = PrefabLibrary( dungeonsDir, listObjects = fakeObjects )
+    library.scan()
+    assert library.filesRead == 0
+    byFile, missing = library.groupByFile( [ "wallTile01", "torch01" ] )
+    assert list( byFile.values() ) == [ [ "wallTile01" ] ] and missing == [ "torch01" ]
+
+
+def test_every_directory_has_its_own_index( tmp_path, monkeypatch ):
+    monkeypatch.setenv( "XDG_CACHE_HOME", str( tmp_path / "cache" ) )
+    assert indexFileNameFor( str( tmp_path / "a" ) ) != indexFileNameFor( str( tmp_path / "b" ) )
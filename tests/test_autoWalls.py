@@ -0,0 +1,78 @@
+from autoWalls import deriveWalls, variantTable
+from conftest import makeReader
+from tilePlacement import WALL_FACING
+
+
+def wallCells( reader ):
+    grids = reader.getGrids()
+    return dict( ( kind, set( ( i, j ) for i, j, prefab in grids[kind].occupiedCells() ) ) for kind in WALL_FACING )
+
+
+def test_walls_surround_the_floor():
+    reader = makeReader( { "floor": [ "......",
+                                      ".###..",
+                                      ".#....",
+                                      "......" ] } )
+    counts = deriveWalls( reader )
+    walls = wallCells( reader )
+    # a wall lies in the cell next to the floor and faces it
+    assert walls["wallN"] == { ( 0, 1 ), ( 0, 2 ), ( 0, 3 ) }
+    assert walls["wallS"] == { ( 2, 2 ), ( 2, 3 ), ( 3, 1 ) }
+    # East walls close a room on its eastern side and face west
+    assert walls["wallE"] == { ( 1, 4 ), ( 2, 2 ) }
+    assert walls["wallW"] == { ( 1, 0 ), ( 2, 0 ) }
+    assert counts == dict( ( kind, len( cells ) ) for kind, cells in walls.items() )
+
+
+def test_floor_on_the_border_gets_no_wall_there():
+    reader = makeReader( { "floor": [ "##", "##" ] } )
+    assert deriveWalls( reader ) == { "wallN": 0, "wallS": 0, "wallE": 0, "wallW": 0 }
+
+
+def test_bundled_level_differs_by_its_two_pillars( bundledReader ):
+    '''The bundled level has 128 painted walls, 120 are derived: the
+    missing ones are the four walls of two free-standing pillars, floor
+    cells boxed in by walls in the middle of a room. The rule only puts
+    walls into cells without floor, so they can not be derived'''
+    painted = wallCells( bundledReader )
+    floor = set( ( i, j ) for i, j, prefab in bundledReader.getGrids()["floor"].occupiedCells() )
+    counts = deriveWalls( bundledReader )
+    derived = wallCells( bundledReader )
+    assert sum( len( cells ) for cells in painted.values() ) == 128
+    assert sum( counts.values() ) == 120
+    pillars = set.intersection( *painted.values() ) & floor
+    assert pillars == { ( 13, 15 ), ( 13, 18 ) }
+    for kind in WALL_FACING:
+        assert derived[kind] <= painted[kind]
+        assert painted[kind] - derived[kind] == pillars
+        assert not derived[kind] & floor
+
+
+def test_variants_follow_the_rules():
+    reader = makeReader( { "floor": [ "." * 40 ] + [ "." + "#" * 38 + "." ] * 30 + [ "." * 40 ] } )
+    rules = { "wallN": [ ( "wallTile01", 3 ), ( "wallTile02", 1 ) ] }
+    deriveWalls( reader, rules, seed = 5 )
+    grids = reader.getGrids()
+    prefabs = [ prefab for i, j, prefab in grids["wallN"].occupiedCells() ]
+    assert set( prefabs ) == { "wallTile01", "wallTile02" }
+    assert set( prefab for i, j, prefab in grids["wallS"].occupiedCells() ) == { "wallTile01" }
+    # the same seed draws the same walls
+    again = makeReader( { "floor": [ "." * 40 ] + [ "." + "#" * 38 + "." ] * 30 + [ "." * 40 ] } )
+    deriveWalls( again, rules, seed = 5 )
+    assert again.getGrids()["wallN"].toMatrix() == grids["wallN"].toMatrix()
+
+
+def test_variant_table_shares():
+    table = variantTable( [ 1, 2 ], [ 3, 1 ] )
+    assert len( table ) == 256 and table.count( 1 ) == 192 and table.count( 2 ) == 64
+
+
+def test_many_prefabs_use_16_bit_walls():
+    reader = makeReader( { "floor": [ "....", ".##.", "...." ] } )
+    for k in range( 300 ):
+        reader.prefabSymbols.add( "filler%03d" % k )
+    deriveWalls( reader, { "wallN": [ ( "filler%03d" % k, 1 ) for k in range( 280, 300 ) ] } )
+    grids = reader.getGrids()
+    assert grids["wallN"].cells.typecode == 'H'
+    assert set( ( i, j ) for i, j, prefab in grids["wallN"].occupiedCells() ) == { ( 0, 1 ), ( 0, 2 ) }
+    assert all( prefab.startswith( "filler" ) for i, j, prefab in grids["wallN"].occupiedCells() )
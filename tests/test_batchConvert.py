@@ -0,0 +1,76 @@
+import os
+
+from batchConvert import convertAll, expectedOutputs, readManifest
+from tmxSynth import writeSynthLevel
+
+
+def synthLevels( tmp_path, count = 2 ):
+    levels = []
+    for seed in range( 1, count + 1 ):
+        fileName = str( tmp_path / "levels" / ( "level%d.tmx" % seed ) )
+        os.makedirs( os.path.dirname( fileName ), exist_ok = True )
+        writeSynthLevel( fileName, 24, 16, seed = seed )
+        levels.append( fileName )
+    return levels
+
+
+def statuses( manifest ):
+    return [ summary["status"] for summary in manifest["levels"] ]
+
+
+def test_outputs_and_options_are_in_the_manifest( tmp_path ):
+    levels = synthLevels( tmp_path )
+    outputDir = str( tmp_path / "out" )
+    manifest = convertAll( levels, outputDir, workers = 1, nav = True, pvs = True )
+    assert statuses( manifest ) == [ "converted" ]*2
+    written = readManifest( outputDir )
+    assert written["options"]["nav"] and written["options"]["pvs"] and not written["options"]["lights"]
+    for summary in written["levels"]:
+        assert [ os.path.splitext( name )[1] for name in summary["outputs"] ] == [ ".glb", ".nav", ".pvs" ]
+        assert all( os.path.isfile( name ) for name in summary["outputs"] )
+
+
+def test_up_to_date_levels_are_skipped( tmp_path ):
+    levels = synthLevels( tmp_path )
+    outputDir = str( tmp_path / "out" )
+    converted = convertAll( levels, outputDir, workers = 1, nav = True )
+    skipped = convertAll( levels, outputDir, workers = 1, nav = True )
+    assert statuses( skipped ) == [ "skipped" ]*2 and skipped["workers"] == 0
+    # the summaries of the last conversion are kept
+    for before, after in zip( converted["levels"], readManifest( outputDir )["levels"] ):
+        assert after["seconds"] == before["seconds"] and after["tiles"] == before["tiles"]
+        assert dict( after, status = "converted" ) == before
+    # neither the reader nor the cache change the outputs
+    manifest = convertAll( levels, outputDir, workers = 1, nav = True, streaming = False,
+                           cacheDir = str( tmp_path / "cache" ) )
+    assert statuses( manifest ) == [ "skipped" ]*2
+
+
+def test_missing_secondary_output_converts_again( tmp_path ):
+    levels = synthLevels( tmp_path )
+    outputDir = str( tmp_path / "out" )
+    manifest = convertAll( levels, outputDir, workers = 1, nav = True, regions = True )
+    os.remove( manifest["levels"][0]["outputs"][-1] )
+    assert statuses( convertAll( levels, outputDir, workers = 1, nav = True, regions = True ) ) == [ "converted", "skipped" ]
+
+
+def test_changed_options_convert_again( tmp_path ):
+    levels = synthLevels( tmp_path )
+    outputDir = str( tmp_path / "out" )
+    convertAll( levels, outputDir, workers = 1, nav = True )
+    assert statuses( convertAll( levels, outputDir, workers = 1, nav = True, cull = False ) ) == [ "converted" ]*2
+    assert statuses( convertAll( levels, outputDir, workers = 1, nav = True, lights = True ) ) == [ "converted" ]*2
+    # fewer outputs are a change of options too
+    assert statuses( convertAll( levels, outputDir, workers = 1 ) ) == [ "converted" ]*2
+
+
+def test_expected_outputs():
+    options = { "nav": True, "lights": True, "pvs": False, "regions": True }
+    assert expectedOutputs( os.path.join( "out", "a.gltf" ), options ) == \
+        [ os.path.join( "out", name ) for name in ( "a.gltf", "a.bin", "a.nav", "a.light.png", "a.dmrg" ) ]
+
+
+def test_workers_are_clamped_to_the_levels( tmp_path ):
+    levels = synthLevels( tmp_path )
+    manifest = convertAll( levels, str( tmp_path / "out" ), workers = 8 )
+    assert manifest["workers"] == 2
@@ -0,0 +1,38 @@
+import json
+
+from benchmarkDungeon import compareResults, main, runBenchmarks
+
+
+def slowedDown( results, stage, factor ):
+    '''A copy of results with the best times of a stage multiplied'''
+    records = [ dict( record, best = record["best"]*( factor if record["stage"] == stage else 1.0 ) )
+                for record in results["records"] ]
+    return dict( results, records = records )
+
+
+def test_regressions_are_reported( tmp_path ):
+    results = runBenchmarks( [ 12 ], [ "csv", "base64-zlib" ], 1, str( tmp_path ) )
+    stages = set( record["stage"] for record in results["records"] )
+    assert len( results["records"] ) == 2*len( stages ) and "domRead" in stages
+    assert all( record["best"] > 0 and record["cells"] == 144 for record in results["records"] )
+    assert compareResults( results, results ) == []
+    regressions = compareResults( results, slowedDown( results, "placement", 2.0 ) )
+    assert sorted( ( size, encoding, stage ) for size, encoding, stage, before, after, ratio in regressions ) == \
+        [ ( 12, "base64-zlib", "placement" ), ( 12, "csv", "placement" ) ]
+    assert all( abs( ratio - 2.0 ) < 1e-9 for size, encoding, stage, before, after, ratio in regressions )
+    # below the threshold, or missing from the baseline
+    assert compareResults( results, slowedDown( results, "placement", 2.0 ), threshold = 2.5 ) == []
+    assert compareResults( { "records": [] }, results ) == []
+
+
+def test_cli_compares_with_a_baseline( tmp_path ):
+    arguments = [ "--sizes", "10", "--encodings", "csv", "--repeats", "1", "--work-dir", str( tmp_path / "work" ) ]
+    baselineName = str( tmp_path / "baseline.json" )
+    assert main( arguments + [ "-o", baselineName ] ) == 0
+    with open( baselineName ) as baselineFile:
+        baseline = json.load( baselineFile )
+    # a baseline far faster than any run is always a regression
+    with open( baselineName, "w" ) as baselineFile:
+        json.dump( slowedDown( baseline, "domRead", 1e-6 ), baselineFile )
+    assert main( arguments + [ "--compare", baselineName ] ) == 1
+    assert main( arguments + [ "--compare", baselineName, "--threshold", "1e9" ] ) == 0
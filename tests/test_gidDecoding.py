@@ -0,0 +1,86 @@
+import base64
+import gzip
+import struct
+import xml.etree.ElementTree as et
+import zlib
+
+import pytest
+
+from ReadDungeonClass import (DungeonFileReader, FLIPPED_DIAGONALLY_FLAG, FLIPPED_HORIZONTALLY_FLAG,
+                              FLIPPED_VERTICALLY_FLAG)
+from tmxSynth import ENCODINGS, writeSynthLevel
+
+GIDS = [ 0, 1, 7, 0, 101, 0x0FFFFFFF, 3, 0 ]
+
+
+def dataElement( gids, encoding, compression = None ):
+    '''A "data" element of a layer holding gids in one of the Tiled formats'''
+    data = et.Element( "data" )
+    if ( encoding == "xml" ):
+        for gid in gids:
+            et.SubElement( data, "tile", { "gid": str(gid) } if gid else {} )
+        return data
+    data.set( "encoding", encoding )
+    if ( encoding == "csv" ):
+        data.text = "\n" + ",\n".join( map( str, gids ) ) + "\n"
+        return data
+    raw = b''.join( struct.pack( "<I", gid ) for gid in gids )
+    if ( compression == "zlib" ):
+        raw = zlib.compress( raw )
+    elif ( compression == "gzip" ):
+        raw = gzip.compress( raw )
+    if ( compression is not None ):
+        data.set( "compression", compression )
+    data.text = "\n   " + base64.b64encode( raw ).decode( "ascii" ) + "\n"
+    return data
+
+
+@pytest.mark.parametrize( "encoding, compression", [ ( "xml", None ), ( "csv", None ), ( "base64", None ),
+                                                     ( "base64", "zlib" ), ( "base64", "gzip" ) ] )
+def test_decode_every_format( encoding, compression ):
+    gids = DungeonFileReader().decodeLayerData( dataElement( GIDS, encoding, compression ) )
+    assert list( gids ) == GIDS
+
+
+def test_empty_csv_layer():
+    data = et.Element( "data", { "encoding": "csv" } )
+    data.text = "\n"
+    assert list( DungeonFileReader().decodeLayerData( data ) ) == []
+
+
+def test_unsupported_formats_are_rejected():
+    reader = DungeonFileReader()
+    with pytest.raises( ValueError ):
+        reader.decodeLayerData( et.Element( "data", { "encoding": "hex" } ) )
+    data = dataElement( GIDS, "base64" )
+    data.set( "compression", "zstd" )
+    with pytest.raises( ValueError ):
+        reader.decodeLayerData( data )
+
+
+def test_flip_flags_are_split_off():
+    flagged = [ 0, 5 | FLIPPED_HORIZONTALLY_FLAG, 5 | FLIPPED_VERTICALLY_FLAG,
+                5 | FLIPPED_DIAGONALLY_FLAG | FLIPPED_HORIZONTALLY_FLAG, 5 ]
+    reader = DungeonFileReader()
+    gids, flags = reader.splitGIDFlags( reader.decodeLayerData( dataElement( flagged, "base64", "zlib" ) ) )
+    assert list( gids ) == [ 0, 5, 5, 5, 5 ]
+    assert list( flags ) == [ 0, 0x8, 0x4, 0xA, 0 ]
+
+
+def test_no_flags_gives_none():
+    reader = DungeonFileReader()
+    gids, flags = reader.splitGIDFlags( reader.decodeLayerData( dataElement( GIDS[:5], "csv" ) ) )
+    assert list( gids ) == GIDS[:5]
+    assert flags is None
+
+
+def test_all_encodings_give_the_same_grids( tmp_path ):
+    grids = []
+    for encoding in ENCODINGS:
+        fileName = str( tmp_path / ( "level_%s.tmx" % encoding ) )
+        writeSynthLevel( fileName, 40, 30, seed = 4, encoding = encoding )
+        reader = DungeonFileReader()
+        reader.readDungeonFromFile( fileName )
+        grids.append( dict( ( kind, grid.toMatrix() ) for kind, grid in reader.getGrids().items() ) )
+    assert all( g == grids[0] for g in grids[1:] )
+    assert sum( row.count( "floorTile01" ) for row in grids[0]["floor"] ) > 0
@@ -0,0 +1,113 @@
+import json
+import math
+import struct
+from array import array
+
+import pytest
+
+from conftest import BUNDLED_LEVEL
+from gltfExporter import (GLB_BIN_CHUNK, GLB_JSON_CHUNK, GLB_MAGIC, blenderToGltf, eulerToGltfQuaternion,
+                          exportDungeon, main, readObjMesh)
+from pvsBuilder import PotentialVisibility, buildPVS
+from tilePlacement import dungeonTransforms
+
+
+def loadGlb( fileName ):
+    '''(JSON, binary chunk) of a .glb file, checking its framing'''
+    with open( fileName, "rb" ) as glb:
+        data = glb.read()
+    magic, version, length = struct.unpack_from( "<III", data, 0 )
+    assert ( magic, version, length ) == ( GLB_MAGIC, 2, len(data) )
+    jsonLength, jsonType = struct.unpack_from( "<II", data, 12 )
+    assert jsonType == GLB_JSON_CHUNK and jsonLength % 4 == 0
+    gltf = json.loads( data[20:20 + jsonLength] )
+    binLength, binType = struct.unpack_from( "<II", data, 20 + jsonLength )
+    assert binType == GLB_BIN_CHUNK
+    return gltf, data[28 + jsonLength:28 + jsonLength + binLength]
+
+
+def accessorValues( gltf, buffer, index ):
+    accessor = gltf["accessors"][index]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    values = array( 'I' if accessor["componentType"] == 5125 else 'f' )
+    values.frombytes( buffer[view["byteOffset"]:view["byteOffset"] + view["byteLength"]] )
+    width = { "SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4 }[accessor["type"]]
+    assert len(values) == accessor["count"]*width
+    return list( values )
+
+
+def rotate( quaternion, vector ):
+    x, y, z, w = quaternion
+    vx, vy, vz = vector
+    # v + 2w(q x v) + 2q x (q x v)
+    cx, cy, cz = y*vz - z*vy, z*vx - x*vz, x*vy - y*vx
+    ddx, ddy, ddz = y*cz - z*cy, z*cx - x*cz, x*cy - y*cx
+    return ( vx + 2*( w*cx + ddx ), vy + 2*( w*cy + ddy ), vz + 2*( w*cz + ddz ) )
+
+
+def test_axes_and_rotations():
+    assert blenderToGltf( ( 1.0, 2.0, 3.0 ) ) == ( 1.0, 3.0, -2.0 )
+    # a quarter turn around Blender Z takes Blender X to Blender Y
+    q = eulerToGltfQuaternion( ( 0.0, 0.0, math.pi/2 ) )
+    assert rotate( q, blenderToGltf( ( 1.0, 0.0, 0.0 ) ) ) == pytest.approx( blenderToGltf( ( 0.0, 1.0, 0.0 ) ) )
+    assert eulerToGltfQuaternion( ( 0.0, 0.0, 0.0 ) ) == ( 0.0, 0.0, 0.0, 1.0 )
+
+
+def test_glb_of_the_bundled_level( tmp_path, bundledReader ):
+    fileName = str( tmp_path / "level.glb" )
+    stats = exportDungeon( bundledReader, fileName )
+    gltf, buffer = loadGlb( fileName )
+    assert len(buffer) == gltf["buffers"][0]["byteLength"] == stats["bytes"]
+    for view in gltf["bufferViews"]:
+        assert view["byteOffset"] % 4 == 0 and view["byteOffset"] + view["byteLength"] <= len(buffer)
+    # one instanced node per prefab, one instance per tile
+    expected = {}
+    for layerKind, transforms in dungeonTransforms( bundledReader ).items():
+        for prefabName, location, rotation in transforms:
+            expected.setdefault( prefabName, [] ).append( blenderToGltf( location ) )
+    nodes = dict( ( node["name"], node ) for node in gltf["nodes"] if "mesh" in node )
+    assert sorted( nodes ) == sorted( expected )
+    assert stats["tiles"] == sum( len(locations) for locations in expected.values() )
+    for prefabName, node in nodes.items():
+        attributes = node["extensions"]["EXT_mesh_gpu_instancing"]["attributes"]
+        translations = accessorValues( gltf, buffer, attributes["TRANSLATION"] )
+        assert translations == pytest.approx( [ c for location in expected[prefabName] for c in location ], abs = 1e-4 )
+        assert len( accessorValues( gltf, buffer, attributes["ROTATION"] ) ) == 4*len(expected[prefabName])
+        primitive = gltf["meshes"][node["mesh"]]["primitives"][0]
+        vertexCount = gltf["accessors"][primitive["attributes"]["POSITION"]]["count"]
+        assert max( accessorValues( gltf, buffer, primitive["indices"] ) ) < vertexCount
+    root = gltf["nodes"][gltf["scenes"][0]["nodes"][0]]
+    assert sorted( root["children"] ) == sorted( gltf["nodes"].index( node ) for node in nodes.values() )
+
+
+def test_gltf_writes_the_buffer_next_to_it( tmp_path, bundledReader ):
+    fileName = tmp_path / "level.gltf"
+    stats = exportDungeon( bundledReader, str( fileName ) )
+    with open( fileName ) as gltfFile:
+        gltf = json.load( gltfFile )
+    assert gltf["buffers"][0]["uri"] == "level.bin"
+    assert ( tmp_path / "level.bin" ).stat().st_size == gltf["buffers"][0]["byteLength"] == stats["bytes"]
+
+
+def test_obj_prefabs_replace_the_placeholders( tmp_path, bundledReader ):
+    prefabName = bundledReader.floorGrid.symbols.name( bundledReader.floorGrid.cells[
+        next( bundledReader.floorGrid.occupiedIndices() )] )
+    with open( tmp_path / ( prefabName + ".obj" ), "w" ) as objFile:
+        objFile.write( "v 0 0 0\nv 1 0 0\nv 1 0 1\nv 0 0 1\nv 0.5 1 0.5\n"
+                       "vt 0 0\nvt 1 1\nvn 0 1 0\n"
+                       "f 1/1/1 2/1/1 3/2/1 4/2/1\nf 1//1 3//1 5//1\n" )
+    mesh = readObjMesh( prefabName, str( tmp_path / ( prefabName + ".obj" ) ) )
+    assert mesh.indices == [ 0, 1, 2, 0, 2, 3, 4, 5, 6 ]
+    # V is flipped (OBJ starts at the bottom, glTF at the top)
+    assert mesh.uvs[:6] == [ 0.0, 1.0, 0.0, 1.0, 1.0, 0.0 ]
+    fileName = str( tmp_path / "level.glb" )
+    exportDungeon( bundledReader, fileName, prefabDir = str( tmp_path ) )
+    gltf, buffer = loadGlb( fileName )
+    mesh = next( m for m in gltf["meshes"] if m["name"] == prefabName )
+    assert gltf["accessors"][mesh["primitives"][0]["attributes"]["POSITION"]]["count"] == 7
+
+
+def test_cli_builds_the_pvs_with_workers( tmp_path, bundledReader, capsys ):
+    output = str( tmp_path / "level.glb" )
+    assert main( [ BUNDLED_LEVEL, "-o", output, "--no-cull", "--pvs", "-j", "2" ] ) == 0
+    assert PotentialVisibility.load( str( tmp_path / "level.pvs" ) ).bits == buildPVS( bundledReader ).bits
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from ReadDungeonClass import DungeonFileReader
+from conftest import BUNDLED_LEVEL
+from instrumentation import NULL_PROFILER, NULL_STAGE, StageProfiler
+
+
+def test_nested_stages_and_counters():
+    finished = []
+    profiler = StageProfiler( callback = finished.append )
+    profiler.count( "files" )
+    with profiler.stage( "read" ):
+        profiler.count( "bytes", 100 )
+        for layer in ( "floor", "wallN" ):
+            with profiler.stage( "decode", layer ):
+                profiler.count( "cells", 12, layer )
+                profiler.count( "cells", 3, layer )
+        profiler.count( "bytes", 20 )
+    # inner stages finish first
+    assert [ ( r["stage"], r["layer"] ) for r in profiler.records ] == [ ( "decode", "floor" ), ( "decode", "wallN" ), ( "read", None ) ]
+    assert finished == profiler.records and not profiler.stack
+    read = profiler.records[-1]
+    assert read["counters"] == { "bytes": 120 } and profiler.records[0]["counters"] == { "cells.floor": 15 }
+    assert read["seconds"] >= profiler.records[0]["seconds"] + profiler.records[1]["seconds"]
+    assert profiler.counters == { "files": 1 }
+    assert all( r["peakBytes"] is None for r in profiler.records )
+
+
+def test_stage_is_recorded_when_it_fails():
+    profiler = StageProfiler()
+    with pytest.raises( KeyError ):
+        with profiler.stage( "outer" ):
+            with profiler.stage( "inner" ):
+                raise KeyError( "missing" )
+    assert [ r["stage"] for r in profiler.records ] == [ "inner", "outer" ] and not profiler.stack
+
+
+def test_report_format( tmp_path ):
+    profiler = StageProfiler( traceMemory = True )
+    try:
+        for k in range( 2 ):
+            with profiler.stage( "build" ):
+                with profiler.stage( "allocate", "floor" ):
+                    block = bytearray( 1 << 20 )
+                    profiler.count( "blocks", 1, "floor" )
+                del block
+    finally:
+        profiler.stop()
+    report = profiler.report()
+    assert sorted( report ) == [ "counters", "stages", "totals" ]
+    assert report["stages"] == profiler.records
+    assert sorted( report["stages"][0] ) == [ "counters", "layer", "peakBytes", "seconds", "stage" ]
+    assert report["counters"] == { "blocks.floor": 2 }
+    assert sorted( report["totals"] ) == [ "allocate", "build" ]
+    for name in ( "allocate", "build" ):
+        total = report["totals"][name]
+        records = [ r for r in report["stages"] if r["stage"] == name ]
+        assert total["calls"] == 2 and total["seconds"] == pytest.approx( sum( r["seconds"] for r in records ) )
+        # the megabyte allocated in the inner stage counts for the outer one too
+        assert total["peakBytes"] == max( r["peakBytes"] for r in records ) and total["peakBytes"] >= 1 << 20
+    fileName = str( tmp_path / "profile.json" )
+    profiler.save( fileName )
+    with open( fileName ) as reportFile:
+        assert json.load( reportFile ) == json.loads( json.dumps( report ) )
+
+
+def test_null_profiler_records_nothing():
+    # the same stage object every time: no allocation, no clock reads
+    assert NULL_PROFILER.stage( "read" ) is NULL_STAGE and NULL_PROFILER.stage( "decode", "floor" ) is NULL_STAGE
+    with NULL_PROFILER.stage( "read" ) as stage:
+        NULL_PROFILER.count( "cells", 10, "floor" )
+    assert stage is NULL_STAGE and not NULL_PROFILER.enabled
+    assert vars( NULL_PROFILER ) == {} and vars( NULL_STAGE ) == {}
+    reader = DungeonFileReader()
+    assert reader.profiler is NULL_PROFILER
+    reader.readDungeonFromFile( BUNDLED_LEVEL )
+    assert vars( NULL_PROFILER ) == {}
+
+
+def test_reader_stages_are_recorded():
+    profiler = StageProfiler()
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( BUNDLED_LEVEL, profiler = profiler )
+    report = profiler.report()
+    assert report["stages"][-1]["stage"] == "read"
+    assert set( r["layer"] for r in report["stages"] if r["stage"] == "resolve" ) == set( reader.getGrids() )
+    floor = reader.getGrids()["floor"]
+    assert report["counters"]["cells.floor"] == len( floor )
+    assert report["counters"]["occupiedCells.floor"] == floor.occupiedCount()
@@ -0,0 +1,86 @@
+from array import array
+
+from layerGrid import LayerGrid, PrefabSymbols, maskAnd, maskNot, maskOr, shiftMask
+
+
+def makeGrid( width, height, cells ):
+    symbols = PrefabSymbols()
+    grid = LayerGrid( width, height, symbols )
+    for i, j, prefabName in cells:
+        grid.setCell( i, j, prefabName )
+    return grid
+
+
+def test_symbols_start_with_none():
+    symbols = PrefabSymbols()
+    assert symbols.name( 0 ) == "None"
+    assert symbols.add( "floorTile01" ) == 1
+    assert symbols.add( "floorTile01" ) == 1
+    assert symbols.get( "missing" ) is None
+    assert len(symbols) == 2
+
+
+def test_empty_grid_has_one_cell_per_position():
+    grid = LayerGrid( 7, 3, PrefabSymbols() )
+    assert len(grid) == 21
+    assert grid.cells.typecode == 'B'
+    assert grid.occupiedCount() == 0
+
+
+def test_sixteen_bit_grid_has_one_cell_per_position():
+    grid = LayerGrid( 10, 10, list( range( 300 ) ) )
+    assert grid.cells.typecode == 'H'
+    assert len(grid) == 100
+    assert not any( grid.cells )
+
+
+def test_set_cell_promotes_to_sixteen_bits():
+    symbols = PrefabSymbols()
+    grid = LayerGrid( 20, 20, symbols )
+    for k in range( 300 ):
+        grid.setCell( k//20, k % 20, "prefab%03d" % k )
+    assert grid.cells.typecode == 'H'
+    assert len(grid) == 400
+    assert grid.cell( 14, 19 ) == "prefab299"
+    assert grid.cell( 19, 19 ) == "None"
+    assert grid.occupiedCount() == 300
+    assert grid.counts()["prefab299"] == 1
+    assert grid.cellsWithPrefab( "prefab256" ) == [ ( 12, 16 ) ]
+    assert list( grid.nonEmptyMask() ) == [1]*300 + [0]*100
+    assert len( list( grid.occupiedCells() ) ) == 300
+
+
+def test_queries_on_byte_grid():
+    grid = makeGrid( 4, 3, [ ( 0, 1, "a" ), ( 1, 1, "a" ), ( 2, 3, "b" ) ] )
+    assert list( grid.occupiedCells() ) == [ ( 0, 1, "a" ), ( 1, 1, "a" ), ( 2, 3, "b" ) ]
+    assert grid.cellsWithPrefab( "a" ) == [ ( 0, 1 ), ( 1, 1 ) ]
+    assert grid.cellsWithPrefab( "c" ) == []
+    assert grid.counts() == { "a": 2, "b": 1 }
+    assert grid.toMatrix()[2] == [ "None", "None", "None", "b" ]
+
+
+def test_masks():
+    width, height = 3, 3
+    mask = bytearray( [ 0, 0, 0,
+                        0, 1, 0,
+                        0, 0, 0 ] )
+    # cells whose eastern neighbour is set
+    assert shiftMask( mask, width, height, 0, 1 ) == bytearray( [ 0, 0, 0, 1, 0, 0, 0, 0, 0 ] )
+    # cells whose northern neighbour is set
+    assert shiftMask( mask, width, height, -1, 0 ) == bytearray( [ 0, 0, 0, 0, 0, 0, 0, 1, 0 ] )
+    # no wrapping from the end of a row to the next one
+    edge = bytearray( [ 0, 0, 1, 0, 0, 0, 0, 0, 0 ] )
+    assert shiftMask( edge, width, height, 0, -1 ) == bytearray( 9 )
+    other = bytearray( [ 1, 0, 0, 0, 1, 0, 0, 0, 1 ] )
+    assert maskAnd( mask, other ) == mask
+    assert maskOr( mask, edge ) == bytearray( [ 0, 0, 1, 0, 1, 0, 0, 0, 0 ] )
+    assert maskNot( mask ) == bytearray( [ 1, 1, 1, 1, 0, 1, 1, 1, 1 ] )
+
+
+def test_preset_cells_are_kept():
+    cells = array( 'B', [ 0, 1, 1, 0 ] )
+    symbols = PrefabSymbols()
+    symbols.add( "x" )
+    grid = LayerGrid( 2, 2, symbols, cells )
+    assert grid.cells is cells
+    assert grid.occupiedCount() == 2
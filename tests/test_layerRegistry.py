@@ -0,0 +1,86 @@
+import pytest
+
+from ReadDungeonClass import DungeonFileReader
+from layerRegistry import LAYER_REGISTRY, LAYER_SPECS, LayerSpec, layerNameIndex, registerLayer
+from levelCache import LevelCache
+from tilePlacement import dungeonTransforms
+from tmxSynth import writeSynthLevel
+
+
+@pytest.fixture
+def registry():
+    '''Restores the registry changed by a test'''
+    saved = ( list( LAYER_REGISTRY ), dict( LAYER_SPECS ) )
+    yield
+    LAYER_REGISTRY[:] = saved[0]
+    LAYER_SPECS.clear()
+    LAYER_SPECS.update( saved[1] )
+
+
+def levelWithLayer( fileName, layerName, cells, width = 12, height = 10 ):
+    '''A synthetic level with an extra csv layer holding gid 1 in cells'''
+    writeSynthLevel( fileName, width, height, seed = 4, encoding = "csv" )
+    gids = [ "1" if ( k//width, k%width ) in cells else "0" for k in range( width*height ) ]
+    layer = ' <layer name="%s" width="%d" height="%d">\n  <data encoding="csv">%s</data>\n </layer>\n' \
+            % ( layerName, width, height, ",".join( gids ) )
+    with open( fileName ) as level:
+        text = level.read()
+    with open( fileName, "w" ) as level:
+        level.write( text.replace( "</map>", layer + "</map>" ) )
+
+
+def test_kinds_are_unique_and_indexed():
+    kinds = [ spec.kind for spec in LAYER_REGISTRY ]
+    assert len( kinds ) == len( set( kinds ) )
+    assert all( LAYER_SPECS[spec.kind] is spec for spec in LAYER_REGISTRY )
+
+
+def test_layer_name_index_keeps_the_first_spec():
+    first = LayerSpec( "a", ( "shared", "onlyA" ), "floorTiles", "floor", "floor" )
+    second = LayerSpec( "b", ( "shared", ), "floorTiles", "floor", "floor" )
+    index = layerNameIndex( [ first, second ] )
+    assert index == { "shared": first, "onlyA": first }
+    assert layerNameIndex()["wallsN"] is LAYER_SPECS["wallN"]
+
+
+def test_register_replaces_a_kind_in_place( registry ):
+    position = LAYER_REGISTRY.index( LAYER_SPECS["column"] )
+    spec = LayerSpec( "column", ( "pillars", ), "columnTiles", "column", "column" )
+    registerLayer( spec )
+    assert LAYER_REGISTRY[position] is spec and LAYER_SPECS["column"] is spec
+    assert sum( 1 for s in LAYER_REGISTRY if s.kind == "column" ) == 1
+
+
+@pytest.mark.parametrize( "streaming", [ False, True ] )
+def test_registered_layer_is_read_and_placed( registry, tmp_path, streaming ):
+    fileName = str( tmp_path / "level.tmx" )
+    cells = { ( 1, 2 ), ( 4, 7 ), ( 9, 0 ) }
+    levelWithLayer( fileName, "rugs", cells )
+    registerLayer( LayerSpec( "rug", ( "rugTiles", "rugs" ), "floorTiles", "floor", "floor" ) )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, streaming = streaming )
+    grid = reader.getGrids()["rug"]
+    assert set( ( i, j ) for i, j, prefab in grid.occupiedCells() ) == cells
+    assert set( prefab for i, j, prefab in grid.occupiedCells() ) == { "floorTile01" }
+    locations = sorted( location for prefab, location, rotation in dungeonTransforms( reader )["rug"] )
+    assert locations == sorted( ( j*reader.floorTileSize, -i*reader.floorTileSize, 0.0 ) for i, j in cells )
+
+
+def test_unregistered_layer_is_ignored( tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    levelWithLayer( fileName, "rugs", { ( 1, 2 ) } )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName )
+    assert "rug" not in reader.getGrids()
+
+
+def test_registered_layer_misses_the_cache( registry, tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    levelWithLayer( fileName, "rugs", { ( 1, 2 ) } )
+    cache = LevelCache( str( tmp_path / "cache" ) )
+    DungeonFileReader().readDungeonFromFile( fileName, cache = cache )
+    registerLayer( LayerSpec( "rug", ( "rugTiles", "rugs" ), "floorTiles", "floor", "floor" ) )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, cache = cache )
+    assert cache.statistics()["misses"] == 2
+    assert [ ( i, j ) for i, j, prefab in reader.getGrids()["rug"].occupiedCells() ] == [ ( 1, 2 ) ]
@@ -0,0 +1,91 @@
+import os
+import re
+
+from ReadDungeonClass import DungeonFileReader
+from binaryTables import writeTableFile
+from layerGrid import NO_PREFAB
+from levelCache import CACHE_FORMAT_VERSION, CACHE_MAGIC, LevelCache
+from tmxSynth import writeSynthLevel
+
+FLIPPED_HORIZONTALLY = 0x80000000
+
+
+def flippedLevel( fileName ):
+    '''A csv synthetic level with a few horizontally flipped floor tiles'''
+    writeSynthLevel( fileName, 24, 16, seed = 2, encoding = "csv" )
+    with open( fileName ) as level:
+        text = level.read()
+    text = re.sub( r'(?<=[,\n])1(?=[,\n])', str( FLIPPED_HORIZONTALLY | 1 ), text, count = 5 )
+    with open( fileName, "w" ) as level:
+        level.write( text )
+
+
+def readState( reader ):
+    return ( dict( ( kind, grid.toMatrix() ) for kind, grid in reader.getGrids().items() ),
+             dict( ( name, bytes( flags ) ) for name, flags in reader.layerFlags.items() ),
+             reader.mapWidth, reader.mapHeight, reader.prefabSymbols.names )
+
+
+def test_cache_hit_equals_a_fresh_parse( tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    flippedLevel( fileName )
+    fresh = DungeonFileReader()
+    fresh.readDungeonFromFile( fileName )
+    assert fresh.layerFlags
+
+    cache = LevelCache( str( tmp_path / "cache" ) )
+    DungeonFileReader().readDungeonFromFile( fileName, cache = cache )
+    cached = DungeonFileReader()
+    cached.readDungeonFromFile( fileName, cache = cache )
+    stats = cache.statistics()
+    assert ( stats["hits"], stats["misses"], stats["stores"] ) == ( 1, 1, 1 )
+    assert readState( cached ) == readState( fresh )
+
+
+def test_cache_hit_replaces_the_previous_level( tmp_path ):
+    flipped = str( tmp_path / "flipped.tmx" )
+    flippedLevel( flipped )
+    plain = str( tmp_path / "plain.tmx" )
+    writeSynthLevel( plain, 24, 16, seed = 2, encoding = "csv" )
+    cache = LevelCache( str( tmp_path / "cache" ) )
+    DungeonFileReader().readDungeonFromFile( plain, cache = cache )
+
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( flipped )
+    reader.readDungeonFromFile( plain, cache = cache )
+    assert reader.layerFlags == {}
+
+
+def test_edited_level_misses( tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    writeSynthLevel( fileName, 24, 16, seed = 2, encoding = "csv" )
+    cache = LevelCache( str( tmp_path / "cache" ) )
+    DungeonFileReader().readDungeonFromFile( fileName, cache = cache )
+    flippedLevel( fileName )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, cache = cache )
+    assert cache.statistics()["misses"] == 2
+    assert reader.layerFlags
+
+
+def test_bad_entries_miss( tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    writeSynthLevel( fileName, 24, 16, seed = 2, encoding = "csv" )
+    cache = LevelCache( str( tmp_path / "cache" ) )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, cache = cache )
+    entryName = cache.entryName( cache.key( fileName ) )
+    # truncated
+    with open( entryName, "r+b" ) as entry:
+        entry.truncate( os.path.getsize( entryName ) - 10 )
+    assert not cache.readEntry( DungeonFileReader(), entryName )
+    # a wrong number of cells, a length which is not a whole number of cells
+    header = { "width": 24, "height": 16, "symbols": [ NO_PREFAB ], "tilesetIndex": {}, "flags": [] }
+    for typecode, length in ( ( 'B', 24*15 ), ( 'H', 24*16*2 - 1 ) ):
+        layers = [ { "kind": "floor", "typecode": typecode, "height": 16, "length": length } ]
+        writeTableFile( entryName, CACHE_MAGIC, CACHE_FORMAT_VERSION, dict( header, layers = layers ), layers, [ bytes( length ) ] )
+        assert not cache.readEntry( DungeonFileReader(), entryName )
+    # a miss is parsed again and stored
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, cache = cache )
+    assert cache.statistics()["misses"] == 2 and reader.mapWidth == 24
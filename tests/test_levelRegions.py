@@ -0,0 +1,148 @@
+import os
+import random
+import shutil
+
+import pytest
+
+import binaryTables
+from conftest import BUNDLED_LEVEL, makeReader
+from layerGrid import NO_PREFAB, LayerGrid
+from levelRegions import LevelRegions, openLevelRegions, regionFileName, writeRegionFile
+
+
+def randomReader( seed, width = 37, height = 29, prefabCount = 5 ):
+    '''A level with random prefabs in the floor and wall layers and a
+    ceiling filled with a single prefab'''
+    rng = random.Random( seed )
+    reader = makeReader( { "floor": [ "." * width ] * height, "wallN": [ "." * width ] * height,
+                           "ceiling": [ "#" * width ] * height } )
+    grids = reader.getGrids()
+    for kind, density in ( ( "floor", 0.6 ), ( "wallN", 0.1 ) ):
+        for i in range( height ):
+            for j in range( width ):
+                if ( rng.random() < density ):
+                    grids[kind].setCell( i, j, "%sTile%02d" % ( kind, rng.randrange( prefabCount ) ) )
+    return reader
+
+
+def gridsOf( reader ):
+    return dict( ( kind, grid ) for kind, grid in reader.getGrids().items() if grid is not None )
+
+
+def writeRegions( tmp_path, reader, tileSize ):
+    fileName = str( tmp_path / "level.dmrg" )
+    stats = writeRegionFile( reader, fileName, tileSize )
+    return fileName, stats
+
+
+@pytest.mark.parametrize( "tileSize", ( 1, 8, 64 ) )
+def test_cells_match_the_grids( tmp_path, tileSize ):
+    reader = randomReader( tileSize )
+    fileName, stats = writeRegions( tmp_path, reader, tileSize )
+    grids = gridsOf( reader )
+    with LevelRegions( fileName ) as regions:
+        assert ( regions.width, regions.height ) == ( 37, 29 )
+        assert sorted( regions.layerKinds() ) == sorted( grids )
+        for y in range( reader.mapHeight ):
+            for x in range( reader.mapWidth ):
+                assert regions.cell( x, y ) == dict( ( kind, grid.cell( y, x ) ) for kind, grid in grids.items() )
+        assert regions.layerCell( "floor", -1, 0 ) == NO_PREFAB and regions.layerCell( "floor", 37, 0 ) == NO_PREFAB
+        assert regions.cell( 0, 0, [ "wallS", "floor" ] ) == { "floor": grids["floor"].cell( 0, 0 ) }
+
+
+@pytest.mark.parametrize( "window", ( ( 0, 0, 37, 29 ), ( 5, 3, 20, 11 ), ( -4, -2, 9, 40 ), ( 30, 25, 45, 33 ), ( 50, 50, 60, 60 ) ) )
+def test_region_and_occupied_cells( tmp_path, window ):
+    reader = randomReader( 1 )
+    fileName, stats = writeRegions( tmp_path, reader, 8 )
+    grids = gridsOf( reader )
+    x0, y0, x1, y1 = window
+    inside = [ ( x, y ) for y in range( y0, y1 ) for x in range( x0, x1 ) if 0 <= x < 37 and 0 <= y < 29 ]
+    with LevelRegions( fileName ) as regions:
+        windows = regions.region( *window )
+        for kind, grid in grids.items():
+            assert ( windows[kind].width, windows[kind].height ) == ( x1 - x0, y1 - y0 )
+            for y in range( y0, y1 ):
+                for x in range( x0, x1 ):
+                    expected = grid.cell( y, x ) if ( x, y ) in inside else NO_PREFAB
+                    assert windows[kind].cell( y - y0, x - x0 ) == expected
+        occupied = sorted( regions.occupiedCells( *window ) )
+    expected = sorted( ( kind, x, y, grid.cell( y, x ) ) for kind, grid in grids.items() for x, y in inside if grid.cell( y, x ) != NO_PREFAB )
+    assert occupied == expected
+
+
+def test_identical_tiles_are_stored_once( tmp_path ):
+    reader = makeReader( { "floor": [ "." * 32 ] * 32, "ceiling": [ "#" * 32 ] * 32 } )
+    reader.getGrids()["floor"].setCell( 3, 3, "floor01" )
+    fileName, stats = writeRegions( tmp_path, reader, 8 )
+    # 16 ceiling tiles, all alike, and a single floor tile
+    assert stats["tiles"] == 32 and stats["storedTiles"] == 2
+    with LevelRegions( fileName ) as regions:
+        assert list( regions.occupiedCells( 0, 0, 32, 32, [ "floor" ] ) ) == [ ( "floor", 3, 3, "floor01" ) ]
+        assert sum( 1 for cell in regions.occupiedCells( 0, 0, 32, 32, [ "ceiling" ] ) ) == 32*32
+    assert os.path.getsize( fileName ) == stats["bytes"]
+
+
+def test_16_bit_layer( tmp_path ):
+    reader = makeReader( { "floor": [ "#.", ".#" ], "wallN": [ "#.", ".." ] } )
+    grid = reader.getGrids()["floor"]
+    for k in range( 300 ):
+        grid.setCell( 1, 1, "filler%03d" % k )
+    assert grid.cells.typecode == 'H' and reader.getGrids()["wallN"].cells.typecode == 'B'
+    fileName, stats = writeRegions( tmp_path, reader, 8 )
+    with LevelRegions( fileName ) as regions:
+        assert regions.cell( 1, 1 ) == { "floor": "filler299", "wallN": NO_PREFAB }
+        assert regions.region( 0, 0, 2, 2 )["floor"].cell( 1, 1 ) == "filler299"
+        assert sorted( regions.occupiedCells( 0, 0, 2, 2 ) ) == [ ( "floor", 0, 0, "floor01" ), ( "floor", 1, 1, "filler299" ),
+                                                                    ( "wallN", 0, 0, "wallN01" ) ]
+
+
+def test_bad_files_are_rejected( tmp_path ):
+    fileName = str( tmp_path / "bad.dmrg" )
+    for content in ( b'', b'XXXX' + bytes( 60 ) ):
+        with open( fileName, "wb" ) as regions:
+            regions.write( content )
+        with pytest.raises( ValueError ):
+            LevelRegions( fileName )
+
+
+def test_empty_and_mismatched_layers( tmp_path ):
+    reader = makeReader( { "floor": [ "#.", ".#" ] } )
+    grids = dict( ( kind, grid ) for kind, grid in reader.getGrids().items() if grid is not None )
+    # a layer missing from the map is an empty grid
+    grids["ceiling"] = LayerGrid( 2, 0, reader.prefabSymbols )
+    reader.setGrids( grids, reader.prefabSymbols )
+    fileName, stats = writeRegions( tmp_path, reader, 8 )
+    with LevelRegions( fileName ) as regions:
+        assert regions.layerKinds() == [ "floor" ]
+    grids["ceiling"] = LayerGrid( 2, 1, reader.prefabSymbols )
+    reader.setGrids( grids, reader.prefabSymbols )
+    with pytest.raises( ValueError ):
+        writeRegions( tmp_path, reader, 8 )
+
+
+def test_failed_write_leaves_no_file( tmp_path, monkeypatch ):
+    def failingHeader( *arguments ):
+        raise OSError( "disk full" )
+    monkeypatch.setattr( binaryTables, "writeHeader", failingHeader )
+    with pytest.raises( OSError ):
+        writeRegions( tmp_path, randomReader( 0 ), 8 )
+    assert os.listdir( str( tmp_path ) ) == []
+
+
+def test_open_writes_the_region_file_when_needed( tmp_path, bundledReader ):
+    level = str( tmp_path / "level.tmx" )
+    shutil.copy( BUNDLED_LEVEL, level )
+    regionsName = regionFileName( level )
+    with openLevelRegions( level, 16 ) as regions:
+        assert os.path.isfile( regionsName )
+        floor = bundledReader.getGrids()["floor"]
+        assert sorted( ( x, y ) for kind, x, y, prefab in regions.occupiedCells( 0, 0, regions.width, regions.height, [ "floor" ] ) ) == \
+            sorted( ( j, i ) for i, j, prefab in floor.occupiedCells() )
+    # an up to date region file is reused, an older one is rewritten
+    os.utime( regionsName, ( 1000, 1000 ) )
+    os.utime( level, ( 500, 500 ) )
+    openLevelRegions( level ).close()
+    assert os.path.getmtime( regionsName ) == 1000
+    os.utime( level, ( 2000, 2000 ) )
+    openLevelRegions( level ).close()
+    assert os.path.getmtime( regionsName ) > 2000
@@ -0,0 +1,120 @@
+import heapq
+import math
+import random
+
+import pytest
+
+from conftest import makeReader
+from lightBaker import LightGrid, LightParameters, bakeLights
+from navigation import buildNavGraph
+
+WALL_KINDS = ( "wallN", "wallS", "wallE", "wallW" )
+
+
+def randomReader( seed, width = 20, height = 14 ):
+    rng = random.Random( seed )
+    def rows( density ):
+        return [ "".join( "#" if rng.random() < density else "." for j in range( width ) ) for i in range( height ) ]
+    layers = { "floor": rows( 0.8 ), "column": rows( 0.05 ) }
+    for kind in WALL_KINDS:
+        layers[kind] = rows( 0.1 )
+    return makeReader( layers )
+
+
+def expectedLevels( reader, lights, parameters ):
+    '''Brute force: Dijkstra over the whole navigation graph from every
+    light standing on floor, then the fading formula'''
+    graph = buildNavGraph( reader )
+    total = [ 0.0 ]*len( graph.walkable )
+    for i, j in lights:
+        distances = { graph.index( ( i, j ) ): 0.0 }
+        heap = [ ( 0.0, graph.index( ( i, j ) ) ) ]
+        while ( heap ):
+            distance, k = heapq.heappop( heap )
+            if ( distance > distances[k] ):
+                continue
+            for n, step in graph.neighbours( k, True ):
+                if ( distance + step < distances.get( n, math.inf ) ):
+                    distances[n] = distance + step
+                    heapq.heappush( heap, ( distance + step, n ) )
+        for k, distance in distances.items():
+            if ( distance < parameters.radius ):
+                total[k] += parameters.intensity*( 1.0 - distance/parameters.radius )**parameters.falloff
+    return [ min( 255, int( round( ( parameters.ambient + value )*255 ) ) ) if graph.walkable[k] else 0
+             for k, value in enumerate( total ) ]
+
+
+def test_light_fades_along_a_corridor():
+    reader = makeReader( { "floor": [ "#" * 12 ] } )
+    parameters = LightParameters( radius = 8.0, falloff = 2.0, ambient = 0.05 )
+    lightGrid = bakeLights( reader, [ ( 0, 0 ) ], parameters )
+    assert lightGrid.level( ( 0, 0 ) ) == 255
+    for distance in range( 1, 12 ):
+        fading = ( 1.0 - distance/8.0 )**2 if distance < 8 else 0.0
+        assert lightGrid.level( ( 0, distance ) ) == int( round( ( 0.05 + fading )*255 ) )
+
+
+def test_walls_stop_the_light():
+    # the East wall in the third cell faces the second one: it closes the
+    # corridor between them
+    reader = makeReader( { "floor": [ "#" * 6 ], "wallE": [ "..#..." ] } )
+    lightGrid = bakeLights( reader, [ ( 0, 0 ) ], LightParameters( ambient = 0.0 ) )
+    assert all( lightGrid.level( ( 0, j ) ) for j in range( 2 ) )
+    assert not any( lightGrid.level( ( 0, j ) ) for j in range( 2, 6 ) )
+
+
+def test_no_light_outside_the_floor():
+    reader = makeReader( { "floor": [ "##.", "##." ] } )
+    lightGrid = bakeLights( reader, [ ( 0, 0 ) ] )
+    assert lightGrid.level( ( 0, 2 ) ) == 0 and lightGrid.level( ( 1, 2 ) ) == 0
+    with pytest.raises( ValueError ):
+        bakeLights( reader, [ ( 2, 0 ) ] )
+
+
+@pytest.mark.parametrize( "seed", range( 4 ) )
+def test_matches_brute_force( seed ):
+    reader = randomReader( seed )
+    graph = buildNavGraph( reader )
+    rng = random.Random( seed )
+    lights = rng.sample( [ graph.cell( k ) for k in range( len( graph.walkable ) ) if graph.walkable[k] ], 4 )
+    parameters = LightParameters( radius = 6.0, intensity = 0.6, falloff = 1.5 )
+    lightGrid = bakeLights( reader, lights, parameters, graph = graph )
+    assert list( lightGrid.levels ) == expectedLevels( reader, lights, parameters )
+    assert bakeLights( reader, lights, parameters, workers = 2 ).levels == lightGrid.levels
+
+
+def test_torch_on_a_wall_lights_the_floor_it_faces():
+    # a torch on the North wall above the corridor
+    reader = makeReader( { "floor": [ "....", "####" ], "wallN": [ ".#..", "...." ], "torch": [ ".#..", "...." ] } )
+    lightGrid = bakeLights( reader, parameters = LightParameters( radius = 4.0, falloff = 1.0, ambient = 0.0 ) )
+    assert lightGrid.level( ( 0, 1 ) ) == 0
+    # lit from half a cell away
+    assert lightGrid.level( ( 1, 1 ) ) == int( round( ( 1.0 - 0.5/4.0 )*255 ) )
+    assert lightGrid.level( ( 1, 3 ) ) == int( round( ( 1.0 - 2.5/4.0 )*255 ) )
+    # without the torch layer only the ambient light is left
+    assert list( bakeLights( reader, useTorchLayer = False ).levels ) == [ 0 ]*4 + [ 13 ]*4
+
+
+def test_save_and_load( tmp_path ):
+    lightGrid = bakeLights( randomReader( 7 ), [ ( 3, 3 ) ] )
+    fileName = str( tmp_path / "level.light.png" )
+    lightGrid.save( fileName )
+    loaded = LightGrid.load( fileName )
+    assert ( loaded.width, loaded.height ) == ( lightGrid.width, lightGrid.height )
+    assert loaded.levels == lightGrid.levels
+
+
+def test_vertex_levels_average_the_cells_around():
+    rng = random.Random( 2 )
+    width, height = 7, 5
+    lightGrid = LightGrid( width, height, bytearray( rng.randrange( 256 ) for k in range( width*height ) ) )
+    def level( i, j ):
+        return lightGrid.level( ( min( max( i, 0 ), height - 1 ), min( max( j, 0 ), width - 1 ) ) )
+    expected = []
+    for r in range( height + 1 ):
+        for c in range( width + 1 ):
+            # across first, rounded down, then down the rows, rounded up
+            above = ( level( r - 1, c - 1 ) + level( r - 1, c ) )//2
+            below = ( level( r, c - 1 ) + level( r, c ) )//2
+            expected.append( ( above + below + 1 )//2 )
+    assert list( lightGrid.vertexLevels() ) == expected
@@ -0,0 +1,156 @@
+import heapq
+import math
+import random
+
+import pytest
+
+from conftest import makeReader
+from navigation import DIAGONAL_STEPS, STRAIGHT_STEPS, UNREACHABLE, NavGraph, buildNavGraph
+
+WALL_KINDS = ( "wallN", "wallS", "wallE", "wallW" )
+
+
+def randomReader( seed, width = 24, height = 18, floorDensity = 0.7, wallDensity = 0.15 ):
+    '''A random level: floor cells, random walls of every kind and columns'''
+    rng = random.Random( seed )
+    def rows( density ):
+        return [ "".join( "#" if rng.random() < density else "." for j in range( width ) ) for i in range( height ) ]
+    layers = { "floor": rows( floorDensity ), "column": rows( wallDensity ) }
+    for kind in WALL_KINDS:
+        layers[kind] = rows( wallDensity )
+    return makeReader( layers )
+
+
+def walkableCells( graph ):
+    return [ graph.cell( k ) for k in range( len( graph.walkable ) ) if graph.walkable[k] ]
+
+
+def pathCost( graph, path ):
+    '''Cost of a path, checking that every step follows an open edge'''
+    cost = 0.0
+    for a, b in zip( path, path[1:] ):
+        steps = dict( ( ( n - graph.index( a ) ), c ) for n, c in graph.neighbours( graph.index( a ), diagonal = True ) )
+        offset = graph.index( b ) - graph.index( a )
+        assert offset in steps, "no edge from %s to %s" % ( a, b )
+        cost += steps[offset]
+    return cost
+
+
+def dijkstra( graph, start, diagonal ):
+    '''Brute force cost of the shortest path to every cell'''
+    costs = { graph.index( start ): 0.0 }
+    heap = [ ( 0.0, graph.index( start ) ) ]
+    while ( heap ):
+        cost, k = heapq.heappop( heap )
+        if ( cost > costs[k] ):
+            continue
+        for n, step in graph.neighbours( k, diagonal ):
+            if ( cost + step < costs.get( n, math.inf ) ):
+                costs[n] = cost + step
+                heapq.heappush( heap, ( cost + step, n ) )
+    return costs
+
+
+def test_walls_block_their_edge():
+    # the East wall of the left cell and the West wall of the right cell
+    # both lie on the edge between them
+    for kind, row in ( ( "wallE", ".#" ), ( "wallW", "#." ) ):
+        graph = buildNavGraph( makeReader( { "floor": [ "##" ], kind: [ row ] } ) )
+        assert graph.edges[0] == 0 and graph.edges[1] == 0
+        assert not graph.connected( ( 0, 0 ), ( 0, 1 ) )
+    graph = buildNavGraph( makeReader( { "floor": [ "##" ], "wallN": [ ".#" ] } ) )
+    assert graph.connected( ( 0, 0 ), ( 0, 1 ) )
+
+
+def test_column_blocks_the_diagonal_through_its_corner():
+    floor = [ "##", "##" ]
+    open2x2 = buildNavGraph( makeReader( { "floor": floor } ) )
+    assert open2x2.findPath( ( 0, 0 ), ( 1, 1 ), diagonal = True ) == [ ( 0, 0 ), ( 1, 1 ) ]
+    blocked = buildNavGraph( makeReader( { "floor": floor, "column": [ "#.", ".." ] } ) )
+    assert len( blocked.findPath( ( 0, 0 ), ( 1, 1 ), diagonal = True ) ) == 3
+    # a column stands in the south-eastern corner of its cell, shared by
+    # all four cells: the other diagonal is blocked too
+    assert len( blocked.findPath( ( 0, 1 ), ( 1, 0 ), diagonal = True ) ) == 3
+
+
+def test_components_match_reachability():
+    for seed in range( 5 ):
+        graph = buildNavGraph( randomReader( seed ) )
+        for start in walkableCells( graph )[:10]:
+            reached = set( graph.cell( k ) for k, d in enumerate( graph.distanceField( [ start ] ) ) if d != UNREACHABLE )
+            same = set( cell for cell in walkableCells( graph ) if graph.connected( start, cell ) )
+            assert reached == same
+
+
+@pytest.mark.parametrize( "seed", range( 8 ) )
+def test_jump_points_and_a_star_find_paths_of_the_same_length( seed ):
+    graph = buildNavGraph( randomReader( seed ) )
+    rng = random.Random( seed )
+    cells = walkableCells( graph )
+    for trial in range( 25 ):
+        start, goal = rng.choice( cells ), rng.choice( cells )
+        distance = graph.distanceField( [ goal ] )[graph.index( start )]
+        aStar = graph.findPath( start, goal )
+        jumps = graph.jumpPointPath( start, goal )
+        if ( distance == UNREACHABLE ):
+            assert aStar is None and jumps is None
+            continue
+        for path in ( aStar, jumps ):
+            assert path[0] == start and path[-1] == goal
+            assert len( path ) - 1 == distance
+            assert pathCost( graph, path ) == distance
+            assert all( abs( a[0] - b[0] ) + abs( a[1] - b[1] ) == 1 for a, b in zip( path, path[1:] ) )
+
+
+@pytest.mark.parametrize( "seed", range( 4 ) )
+def test_diagonal_a_star_is_optimal( seed ):
+    graph = buildNavGraph( randomReader( seed ) )
+    rng = random.Random( seed )
+    cells = walkableCells( graph )
+    for trial in range( 10 ):
+        start = rng.choice( cells )
+        costs = dijkstra( graph, start, diagonal = True )
+        for goal in rng.sample( cells, 5 ):
+            path = graph.findPath( start, goal, diagonal = True )
+            if ( graph.index( goal ) not in costs ):
+                assert path is None
+            else:
+                assert pathCost( graph, path ) == pytest.approx( costs[graph.index( goal )] )
+
+
+def test_edges_are_symmetric():
+    graph = buildNavGraph( randomReader( 11 ) )
+    for k in range( len( graph.edges ) ):
+        for bit, di, dj in STRAIGHT_STEPS + DIAGONAL_STEPS:
+            if ( graph.edges[k] & bit ):
+                n = k + di*graph.width + dj
+                back = [ b for b, bi, bj in STRAIGHT_STEPS + DIAGONAL_STEPS if ( bi, bj ) == ( -di, -dj ) ][0]
+                assert graph.edges[n] & back
+
+
+def test_path_from_field_leads_to_the_nearest_source():
+    graph = buildNavGraph( randomReader( 3 ) )
+    cells = walkableCells( graph )
+    sources = cells[:3]
+    distances = graph.addField( "exit", sources )
+    for start in cells[::7]:
+        path = graph.pathFromField( "exit", start )
+        if ( distances[graph.index( start )] == UNREACHABLE ):
+            assert path is None
+        else:
+            assert path[-1] in sources and len( path ) - 1 == distances[graph.index( start )]
+
+
+def test_save_and_load( tmp_path, bundledReader ):
+    graph = buildNavGraph( bundledReader )
+    graph.addField( "start", walkableCells( graph )[:1] )
+    fileName = str( tmp_path / "level.nav" )
+    graph.save( fileName )
+    loaded = NavGraph.load( fileName )
+    assert ( loaded.width, loaded.height ) == ( graph.width, graph.height )
+    assert loaded.edges == graph.edges and loaded.walkable == bytearray( graph.walkable )
+    assert loaded.components == graph.components and loaded.fields == graph.fields
+    with open( fileName, "r+b" ) as navFile:
+        navFile.write( b'XXXX' )
+    with pytest.raises( ValueError ):
+        NavGraph.load( fileName )
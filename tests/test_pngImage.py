@@ -0,0 +1,150 @@
+import random
+import struct
+import zlib
+
+import pytest
+
+from pngImage import PNG_SIGNATURE, Image, readPNG, withChannels, writePNG
+
+
+def randomImage( width, height, channels, seed = 0 ):
+    rng = random.Random( seed )
+    return Image( width, height, channels, bytearray( rng.randrange( 256 ) for k in range( width*height*channels ) ) )
+
+
+def writeRawPNG( fileName, width, height, colourType, rows, filters, depth = 8, extra = (), interlace = 0 ):
+    '''A PNG file written by hand: rows of already filtered bytes, each
+    with its filter type'''
+    def chunk( chunkType, body ):
+        return struct.pack( ">I", len(body) ) + chunkType + body + struct.pack( ">I", zlib.crc32( chunkType + body ) )
+    data = b''.join( bytes( [ kind ] ) + bytes( row ) for kind, row in zip( filters, rows ) )
+    with open( fileName, "wb" ) as png:
+        png.write( PNG_SIGNATURE )
+        png.write( chunk( b'IHDR', struct.pack( ">IIBBBBB", width, height, depth, colourType, 0, 0, interlace ) ) )
+        for chunkType, body in extra:
+            png.write( chunk( chunkType, body ) )
+        png.write( chunk( b'IDAT', zlib.compress( data ) ) )
+        png.write( chunk( b'IEND', b'' ) )
+
+
+@pytest.mark.parametrize( "channels", ( 1, 2, 3, 4 ) )
+def test_write_and_read( tmp_path, channels ):
+    image = randomImage( 13, 7, channels, seed = channels )
+    fileName = str( tmp_path / "image.png" )
+    writePNG( fileName, image )
+    loaded = readPNG( fileName )
+    # gray comes back as RGB, gray and alpha as RGBA
+    assert ( loaded.width, loaded.height ) == ( 13, 7 )
+    assert loaded.pixels == withChannels( image, loaded.channels ).pixels
+    assert loaded.channels == ( 3 if channels in ( 1, 3 ) else 4 )
+
+
+def test_up_filter_is_undone( tmp_path ):
+    image = randomImage( 9, 6, 3 )
+    rows = [ image.row( 0 ) ] + [ bytes( ( a - b ) & 0xFF for a, b in zip( image.row( y ), image.row( y - 1 ) ) )
+                                  for y in range( 1, image.height ) ]
+    fileName = str( tmp_path / "up.png" )
+    writeRawPNG( fileName, 9, 6, 2, rows, [ 2 ]*6 )
+    assert readPNG( fileName ).pixels == image.pixels
+    # None and Up rows mixed
+    rows[3] = image.row( 3 )
+    rows[4] = bytes( ( a - b ) & 0xFF for a, b in zip( image.row( 4 ), image.row( 3 ) ) )
+    writeRawPNG( fileName, 9, 6, 2, rows, [ 2, 2, 2, 0, 2, 2 ] )
+    assert readPNG( fileName ).pixels == image.pixels
+
+
+def test_palette_with_transparency_and_4_bits( tmp_path ):
+    palette = bytes( [ 255, 0, 0, 0, 255, 0, 0, 0, 255 ] )
+    # 3 pixels per row: indexes 0 1 / 2 0 / 1 2 in 4 bits, padded
+    rows = [ bytes( [ 0x01, 0x20 ] ), bytes( [ 0x12, 0x00 ] ) ]
+    fileName = str( tmp_path / "palette.png" )
+    writeRawPNG( fileName, 3, 2, 3, rows, [ 0, 0 ], depth = 4, extra = ( ( b'PLTE', palette ), ( b'tRNS', b'\x80' ) ) )
+    loaded = readPNG( fileName )
+    red, green, blue = ( 255, 0, 0, 128 ), ( 0, 255, 0, 255 ), ( 0, 0, 255, 255 )
+    assert loaded.channels == 4
+    assert list( loaded.pixels ) == list( red + green + blue + green + blue + red )
+
+
+def paeth( left, up, upLeft ):
+    p = left + up - upLeft
+    pa, pb, pc = abs( p - left ), abs( p - up ), abs( p - upLeft )
+    return left if ( pa <= pb and pa <= pc ) else ( up if pb <= pc else upLeft )
+
+
+def filterRows( rows, filters, bytesPerPixel ):
+    '''Reference PNG filtering of rows of raw bytes, straight from the
+    specification'''
+    filtered = []
+    previous = bytes( len(rows[0]) ) if rows else b''
+    for row, kind in zip( rows, filters ):
+        out = []
+        for i, value in enumerate( row ):
+            left = row[i - bytesPerPixel] if i >= bytesPerPixel else 0
+            upLeft = previous[i - bytesPerPixel] if i >= bytesPerPixel else 0
+            predictor = ( 0, left, previous[i], ( left + previous[i] )//2, paeth( left, previous[i], upLeft ) )[kind]
+            out.append( ( value - predictor ) & 0xFF )
+        filtered.append( bytes( out ) )
+        previous = row
+    return filtered
+
+
+@pytest.mark.parametrize( "channels, colourType", ( ( 1, 0 ), ( 3, 2 ), ( 4, 6 ) ) )
+def test_every_filter_is_undone( tmp_path, channels, colourType ):
+    image = randomImage( 11, 10, channels, seed = 5 )
+    rows = [ image.row( y ) for y in range( image.height ) ]
+    filters = [ y % 5 for y in range( image.height ) ]
+    fileName = str( tmp_path / "filtered.png" )
+    writeRawPNG( fileName, 11, 10, colourType, filterRows( rows, filters, channels ), filters )
+    assert readPNG( fileName ).pixels == withChannels( image, 3 if channels < 4 else 4 ).pixels
+    # a whole image of each filter
+    for kind in range( 5 ):
+        writeRawPNG( fileName, 11, 10, colourType, filterRows( rows, [ kind ]*10, channels ), [ kind ]*10 )
+        assert readPNG( fileName ).pixels == withChannels( image, 3 if channels < 4 else 4 ).pixels
+
+
+def test_16_bit_paeth( tmp_path ):
+    image = randomImage( 5, 4, 6, seed = 3 )
+    rows = [ image.row( y ) for y in range( image.height ) ]
+    fileName = str( tmp_path / "deep.png" )
+    writeRawPNG( fileName, 5, 4, 2, filterRows( rows, [ 4 ]*4, 6 ), [ 4 ]*4, depth = 16 )
+    assert readPNG( fileName ).pixels == image.pixels[0::2]
+
+
+@pytest.mark.parametrize( "width, height", ( ( 13, 11 ), ( 1, 1 ), ( 3, 9 ), ( 8, 8 ) ) )
+def test_interlaced( tmp_path, width, height ):
+    image = randomImage( width, height, 3, seed = width )
+    passes = ( ( 0, 0, 8, 8 ), ( 4, 0, 8, 8 ), ( 0, 4, 4, 8 ), ( 2, 0, 4, 4 ), ( 0, 2, 2, 4 ), ( 1, 0, 2, 2 ), ( 0, 1, 1, 2 ) )
+    rows = []
+    filters = []
+    for x0, y0, dx, dy in passes:
+        passRows = [ b''.join( bytes( image.pixels[( y*width + x )*3:( y*width + x )*3 + 3] ) for x in range( x0, width, dx ) )
+                     for y in range( y0, height, dy ) ]
+        if ( not passRows or not passRows[0] ):
+            continue
+        passFilters = [ ( y + x0 ) % 5 for y in range( len(passRows) ) ]
+        rows.extend( filterRows( passRows, passFilters, 3 ) )
+        filters.extend( passFilters )
+    fileName = str( tmp_path / "interlaced.png" )
+    writeRawPNG( fileName, width, height, 2, rows, filters, interlace = 1 )
+    assert readPNG( fileName ).pixels == image.pixels
+
+
+def test_truncated_data( tmp_path ):
+    fileName = str( tmp_path / "short.png" )
+    writeRawPNG( fileName, 4, 4, 2, [ bytes( 12 ) ]*3, [ 0 ]*3 )
+    with pytest.raises( ValueError, match = "truncated" ):
+        readPNG( fileName )
+
+
+def test_channel_conversions():
+    gray = Image( 2, 1, 1, bytearray( [ 0, 200 ] ) )
+    assert list( withChannels( gray, 3 ).pixels ) == [ 0, 0, 0, 200, 200, 200 ]
+    assert list( withChannels( gray, 2 ).pixels ) == [ 0, 255, 200, 255 ]
+    grayAlpha = Image( 2, 1, 2, bytearray( [ 7, 100, 200, 50 ] ) )
+    assert list( withChannels( grayAlpha, 4 ).pixels ) == [ 7, 7, 7, 100, 200, 200, 200, 50 ]
+    assert list( withChannels( grayAlpha, 1 ).pixels ) == [ 7, 200 ]
+    colour = Image( 4, 1, 4, bytearray( [ 255, 255, 255, 9, 255, 0, 0, 8, 0, 255, 0, 7, 0, 0, 0, 6 ] ) )
+    # BT.601 luma: white stays white
+    assert list( withChannels( colour, 2 ).pixels ) == [ 255, 9, 77, 8, 149, 7, 0, 6 ]
+    assert list( withChannels( colour, 3 ).pixels ) == [ 255, 255, 255, 255, 0, 0, 0, 255, 0, 0, 0, 0 ]
+    assert withChannels( colour, 4 ) is colour
@@ -0,0 +1,130 @@
+import os
+import random
+
+import pytest
+
+from conftest import makeReader
+from layerGrid import NO_PREFAB
+from navigation import DIAGONAL_STEPS, STRAIGHT_STEPS, buildNavGraph
+from pvsBuilder import PotentialVisibility, PVSParameters, buildPVS, sightLine
+from tilePlacement import WALL_FACING
+
+STEPS = dict( ( bit, ( di, dj ) ) for bit, di, dj in STRAIGHT_STEPS + DIAGONAL_STEPS )
+STRAIGHT_BITS = dict( ( ( di, dj ), bit ) for bit, di, dj in STRAIGHT_STEPS )
+
+
+def randomReader( seed, width = 16, height = 12 ):
+    rng = random.Random( seed )
+    def rows( density ):
+        return [ "".join( "#" if rng.random() < density else "." for j in range( width ) ) for i in range( height ) ]
+    layers = { "floor": rows( 0.75 ), "column": rows( 0.05 ) }
+    for kind in WALL_FACING:
+        layers[kind] = rows( 0.08 )
+    return makeReader( layers )
+
+
+def stepOpen( reader, graph, cell, bit ):
+    '''Whether sight steps from a cell in a direction, straight from the
+    navigation graph and the column layer'''
+    i, j = cell
+    if ( not ( 0 <= i < graph.height and 0 <= j < graph.width ) ):
+        return False
+    di, dj = STEPS[bit]
+    if ( di == 0 or dj == 0 ):
+        return bool( graph.edges[graph.index( cell )] & bit )
+    vertical, horizontal = STRAIGHT_BITS[( di, 0 )], STRAIGHT_BITS[( 0, dj )]
+    way = ( ( stepOpen( reader, graph, cell, vertical ) and stepOpen( reader, graph, ( i + di, j ), horizontal ) ) or
+            ( stepOpen( reader, graph, cell, horizontal ) and stepOpen( reader, graph, ( i, j + dj ), vertical ) ) )
+    # a column stands in the south-eastern corner of its cell
+    column = reader.getGrids()["column"].cell( i + min( di, 0 ), j + min( dj, 0 ) )
+    return way and column == NO_PREFAB
+
+
+def bruteForcePVS( reader, parameters ):
+    '''Visible chunk pairs: every line from every floor cell walked step
+    by step, then the walls facing the cells seen'''
+    graph = buildNavGraph( reader )
+    grids = reader.getGrids()
+    size = parameters.chunkSize
+    pad = parameters.reach()*size
+    pairs = set()
+    for source in [ graph.cell( k ) for k in range( len( graph.walkable ) ) if graph.walkable[k] ]:
+        chunk = ( source[0]//size, source[1]//size )
+        seen = set( [ source ] )
+        for di in range( -pad, pad + 1 ):
+            for dj in range( -pad, pad + 1 ):
+                cell = source
+                for bit in sightLine( di, dj ):
+                    if ( not stepOpen( reader, graph, cell, bit ) ):
+                        break
+                    cell = ( cell[0] + STEPS[bit][0], cell[1] + STEPS[bit][1] )
+                    seen.add( cell )
+        for ( i, j ) in list( seen ):
+            for wallKind, ( di, dj ) in WALL_FACING.items():
+                wall = ( i - di, j - dj )
+                # only the walls within reach of the chunk are looked at
+                if ( not ( 0 <= wall[0] < graph.height and 0 <= wall[1] < graph.width ) or
+                     not ( chunk[0]*size - pad <= wall[0] < ( chunk[0] + 1 )*size + pad ) or
+                     not ( chunk[1]*size - pad <= wall[1] < ( chunk[1] + 1 )*size + pad ) ):
+                    continue
+                if ( grids[wallKind].cell( *wall ) != NO_PREFAB ):
+                    seen.add( wall )
+        for i, j in seen:
+            pairs.add( ( chunk, ( i//size, j//size ) ) )
+            pairs.add( ( ( i//size, j//size ), chunk ) )
+    return pairs
+
+
+def visiblePairs( pvs ):
+    return set( ( ( ci, cj ), other ) for ci in range( pvs.chunkRows ) for cj in range( pvs.chunkColumns )
+                for other in pvs.visibleChunks( ( ci, cj ) ) )
+
+
+@pytest.mark.parametrize( "wallKind", sorted( WALL_FACING ) )
+def test_wall_across_a_chunk_border_is_seen( wallKind ):
+    '''A closed 4x4 room filling the middle chunk of a 3x3 chunk map, with
+    one wall in the next chunk facing a floor cell of the room'''
+    floor = [ "." * 12 ] * 4 + [ "...." + "####" + "...." ] * 4 + [ "." * 12 ] * 4
+    di, dj = WALL_FACING[wallKind]
+    # the faced cell is in the room, on its border, the wall just across it
+    faced = { ( 1, 0 ): ( 4, 5 ), ( -1, 0 ): ( 7, 5 ), ( 0, -1 ): ( 5, 7 ), ( 0, 1 ): ( 5, 4 ) }[( di, dj )]
+    wall = ( faced[0] - di, faced[1] - dj )
+    rows = [ "".join( "#" if ( i, j ) == wall else "." for j in range( 12 ) ) for i in range( 12 ) ]
+    parameters = PVSParameters( chunkSize = 4, radius = 8 )
+    alone = buildPVS( makeReader( { "floor": floor } ), parameters )
+    assert alone.visibleChunks( ( 1, 1 ) ) == [ ( 1, 1 ) ]
+    pvs = buildPVS( makeReader( { "floor": floor, wallKind: rows } ), parameters )
+    wallChunk = ( wall[0]//4, wall[1]//4 )
+    assert wallChunk != ( 1, 1 )
+    assert sorted( pvs.visibleChunks( ( 1, 1 ) ) ) == sorted( [ ( 1, 1 ), wallChunk ] )
+    assert pvs.chunkVisible( wallChunk, ( 1, 1 ) )
+
+
+@pytest.mark.parametrize( "seed", range( 3 ) )
+@pytest.mark.parametrize( "chunkSize, radius", ( ( 4, 8 ), ( 3, 5 ), ( 1, 3 ) ) )
+def test_matches_brute_force( seed, chunkSize, radius ):
+    reader = randomReader( seed )
+    parameters = PVSParameters( chunkSize, radius )
+    pvs = buildPVS( reader, parameters )
+    assert visiblePairs( pvs ) == bruteForcePVS( reader, parameters )
+
+
+def test_workers_and_save_load( tmp_path ):
+    reader = randomReader( 5 )
+    parameters = PVSParameters( 4, 8 )
+    pvs = buildPVS( reader, parameters )
+    assert buildPVS( reader, parameters, workers = 2 ).bits == pvs.bits
+    fileName = str( tmp_path / "level.pvs" )
+    pvs.save( fileName )
+    loaded = PotentialVisibility.load( fileName )
+    assert ( loaded.width, loaded.height, loaded.chunkSize, loaded.reach ) == ( pvs.width, pvs.height, 4, 2 )
+    assert loaded.bits == pvs.bits
+    # written under a temporary name and renamed
+    assert os.listdir( str( tmp_path ) ) == [ "level.pvs" ]
+    with open( fileName, "r+b" ) as pvsFile:
+        pvsFile.write( b'XXXX' )
+    with pytest.raises( ValueError ):
+        PotentialVisibility.load( fileName )
+    PotentialVisibility( pvs.width, pvs.height + 4, 4, 2, pvs.bits ).save( fileName )
+    with pytest.raises( ValueError ):
+        PotentialVisibility.load( fileName )
@@ -0,0 +1,70 @@
+import xml.etree.ElementTree as et
+
+import pytest
+
+from ReadDungeonClass import DungeonFileReader
+from conftest import BUNDLED_LEVEL
+from tmxSynth import ENCODINGS, writeSynthLevel
+
+
+def readBoth( fileName ):
+    '''The grids (kind -> list of lists) and flags read by the DOM and the streaming loaders'''
+    results = []
+    for streaming in ( False, True ):
+        reader = DungeonFileReader()
+        reader.readDungeonFromFile( fileName, streaming = streaming )
+        grids = dict( ( kind, grid.toMatrix() ) for kind, grid in reader.getGrids().items() )
+        results.append( ( grids, reader.layerFlags, reader.mapWidth, reader.mapHeight ) )
+    return results
+
+
+def test_bundled_level_reads_the_same():
+    dom, stream = readBoth( BUNDLED_LEVEL )
+    assert dom == stream
+
+
+@pytest.mark.parametrize( "encoding", ENCODINGS )
+def test_synthetic_level_reads_the_same( tmp_path, encoding ):
+    fileName = str( tmp_path / "level.tmx" )
+    writeSynthLevel( fileName, 48, 32, seed = 2, encoding = encoding )
+    dom, stream = readBoth( fileName )
+    assert dom == stream
+
+
+def test_first_layer_of_a_kind_is_read( tmp_path ):
+    fileName = str( tmp_path / "level.tmx" )
+    width, height = 12, 10
+    writeSynthLevel( fileName, width, height, seed = 3, encoding = "csv" )
+    full = ",".join( [ "1" ]*( width*height ) )
+    extra = ''.join( ' <layer name="%s" width="%d" height="%d">\n  <data encoding="csv">%s</data>\n </layer>\n'
+                     % ( name, width, height, full ) for name in ( "floorTiles", "floor" ) )
+    with open( fileName ) as tmx:
+        text = tmx.read()
+    with open( fileName, "w" ) as tmx:
+        tmx.write( text.replace( "</map>", extra + "</map>" ) )
+    dom, stream = readBoth( fileName )
+    assert dom == stream
+    floor = dom[0]["floor"]
+    # the synthetic floor, not the full layers appended after it
+    assert len(floor) == height
+    assert sum( row.count( "floorTile01" ) for row in floor ) < width*height
+
+
+def test_data_at_root_depth_does_not_crash( tmp_path ):
+    fileName = str( tmp_path / "odd.tmx" )
+    with open( fileName, "w" ) as tmx:
+        tmx.write( '<data encoding="csv">1,2</data>' )
+    reader = DungeonFileReader()
+    reader.streamDungeonFromFile( fileName )
+    assert reader.layerGIDs == {}
+
+
+def test_truncated_file_raises_parse_error( tmp_path ):
+    fileName = str( tmp_path / "truncated.tmx" )
+    with open( BUNDLED_LEVEL ) as tmx:
+        text = tmx.read()
+    with open( fileName, "w" ) as tmx:
+        tmx.write( text[:len(text)//2] )
+    for streaming in ( False, True ):
+        with pytest.raises( et.ParseError ):
+            DungeonFileReader().readDungeonFromFile( fileName, streaming = streaming )
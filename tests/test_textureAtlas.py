@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from instrumentation import StageProfiler
+from pngImage import Image, readPNG, writePNG
+from textureAtlas import (ATLAS_LAYOUT_NAME, AtlasParameters, buildAtlases, doubleImage, gutterRows, halveImage,
+                          packSlots, resizeImage)
+
+
+def solidImage( width, height, pixel ):
+    return Image( width, height, len(pixel), bytearray( bytes( pixel )*( width*height ) ) )
+
+
+def atlasPixel( image, x, y ):
+    start = ( y*image.width + x )*image.channels
+    return tuple( image.pixels[start:start + image.channels] )
+
+
+def test_halve_double_and_resize():
+    image = Image( 2, 2, 1, bytearray( [ 10, 20, 30, 41 ] ) )
+    assert list( halveImage( image ).pixels ) == [ 25 ]
+    doubled = doubleImage( image )
+    assert ( doubled.width, doubled.height ) == ( 4, 4 )
+    assert list( doubled.pixels ) == [ 10, 10, 20, 20 ]*2 + [ 30, 30, 41, 41 ]*2
+    assert resizeImage( doubled, 2, 2 ).pixels == image.pixels
+    with pytest.raises( ValueError ):
+        resizeImage( image, 3, 2 )
+
+
+def test_gutter_wraps_or_clamps():
+    image = Image( 2, 2, 1, bytearray( [ 1, 2, 3, 4 ] ) )
+    assert [ list( row ) for row in gutterRows( image, 1 ) ] == [ [ 4, 3, 4, 3 ], [ 2, 1, 2, 1 ], [ 4, 3, 4, 3 ], [ 2, 1, 2, 1 ] ]
+    assert [ list( row ) for row in gutterRows( image, 1, "clamp" ) ] == [ [ 1, 1, 2, 2 ], [ 1, 1, 2, 2 ], [ 3, 3, 4, 4 ], [ 3, 3, 4, 4 ] ]
+
+
+def test_slots_do_not_overlap():
+    sizes = [ ( 32, 32 ), ( 16, 48 ), ( 64, 16 ), ( 16, 16 ), ( 48, 32 ) ]
+    width, height, positions = packSlots( sizes, 256 )
+    rectangles = [ ( x, y, x + w, y + h ) for ( x, y ), ( w, h ) in zip( positions, sizes ) ]
+    for a in range( len(rectangles) ):
+        assert rectangles[a][2] <= width and rectangles[a][3] <= height
+        for b in range( a ):
+            ax0, ay0, ax1, ay1 = rectangles[a]
+            bx0, by0, bx1, by1 = rectangles[b]
+            assert ax1 <= bx0 or bx1 <= ax0 or ay1 <= by0 or by1 <= ay0
+    assert packSlots( sizes, 32 ) is None
+
+
+def test_atlas_holds_every_texture( tmp_path ):
+    textures = { "red": ( 8, 8, ( 255, 0, 0 ) ), "gray": ( 16, 16, ( 90, ) ), "clear": ( 8, 8, ( 0, 0, 255, 128 ) ) }
+    textureSets = {}
+    for name, ( width, height, pixel ) in textures.items():
+        fileName = str( tmp_path / ( name + "D.png" ) )
+        writePNG( fileName, solidImage( width, height, pixel ) )
+        textureSets[name] = { "D": fileName }
+    parameters = AtlasParameters( mipLevels = 2 )
+    atlasDir = str( tmp_path / "atlases" )
+    layout = buildAtlases( textureSets, atlasDir, parameters )
+    atlas = readPNG( os.path.join( layout["dir"], layout["files"]["D"] ) )
+    assert atlas.channels == 4 and ( atlas.width, atlas.height ) == ( layout["width"], layout["height"] )
+    expected = { "red": ( 255, 0, 0, 255 ), "gray": ( 90, 90, 90, 255 ), "clear": ( 0, 0, 255, 128 ) }
+    for name, ( x, y, w, h ) in layout["slots"].items():
+        assert ( w, h ) == textures[name][:2]
+        assert x % 4 == parameters.gutter % 4
+        # the texture and its gutter
+        for px, py in ( ( x, y ), ( x + w - 1, y + h - 1 ), ( x - parameters.gutter, y - 1 ), ( x + w, y + h + parameters.gutter - 1 ) ):
+            assert atlasPixel( atlas, px, py ) == expected[name]
+        scaleU, scaleV, offsetU, offsetV = layout["uv"][name]
+        assert ( offsetU*atlas.width, offsetV*atlas.height ) == ( x, y )
+        assert ( ( scaleU + offsetU )*atlas.width, ( scaleV + offsetV )*atlas.height ) == ( x + w, y + h )
+    # the same textures come from the cache
+    profiler = StageProfiler()
+    again = buildAtlases( textureSets, atlasDir, parameters, profiler )
+    assert again == layout and profiler.counters["atlasCacheHit"] == 1
+    with open( os.path.join( layout["dir"], ATLAS_LAYOUT_NAME ) ) as layoutFile:
+        assert json.load( layoutFile )["slots"] == layout["slots"]
+
+
+def test_textures_are_halved_to_fit( tmp_path ):
+    fileName = str( tmp_path / "bigD.png" )
+    writePNG( fileName, solidImage( 64, 64, ( 10, 20, 30 ) ) )
+    layout = buildAtlases( { "big": { "D": fileName } }, str( tmp_path / "atlases" ), AtlasParameters( mipLevels = 1, maxTextureSize = 16 ) )
+    assert layout["halvings"] == 2 and layout["slots"]["big"][2:] == [ 16, 16 ]
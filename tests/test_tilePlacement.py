@@ -0,0 +1,127 @@
+import random
+
+import pytest
+
+from conftest import makeReader
+from layerGrid import LayerGrid, PrefabSymbols
+from tilePlacement import (FLOOR_TILE_SIZE, QUAD_NORMALS, dungeonChunkTransforms, dungeonTransforms, layerCellTransforms,
+                           layerQuads, layerTransforms)
+
+
+def randomGrid( seed, width = 23, height = 17, prefabCount = 3, density = 0.8 ):
+    '''A grid of a few prefabs, in blobs so that there are big rectangles'''
+    rng = random.Random( seed )
+    grid = LayerGrid( width, height, PrefabSymbols() )
+    for i in range( height ):
+        for j in range( width ):
+            if ( rng.random() < density ):
+                grid.setCell( i, j, "tile%02d" % ( ( i//4 + j//5 + ( rng.random() < 0.1 ) ) % prefabCount ) )
+    return grid
+
+
+def occupied( grid ):
+    return dict( ( ( i, j ), prefab ) for i, j, prefab in grid.occupiedCells() )
+
+
+def quadCells( grid, quad ):
+    '''Cells of the grid whose centres lie inside a quad'''
+    prefabName, corners, normal, ( columns, rows ) = quad
+    xs = [ x for x, y, z in corners ]
+    ys = [ y for x, y, z in corners ]
+    return set( ( i, j ) for i in range( grid.height ) for j in range( grid.width )
+                if min( xs ) < j*FLOOR_TILE_SIZE < max( xs ) and min( ys ) < -i*FLOOR_TILE_SIZE < max( ys ) )
+
+
+def cross( a, b, c ):
+    u = [ q - p for p, q in zip( a, b ) ]
+    v = [ q - p for p, q in zip( a, c ) ]
+    return ( u[1]*v[2] - u[2]*v[1], u[2]*v[0] - u[0]*v[2], u[0]*v[1] - u[1]*v[0] )
+
+
+@pytest.mark.parametrize( "seed", range( 6 ) )
+def test_rectangles_cover_every_cell_once( seed ):
+    grid = randomGrid( seed )
+    if ( seed % 2 ):
+        for k in range( 300 ):
+            grid.symbols.add( "filler%03d" % k )
+        grid.setCell( 0, 0, "filler299" )
+        assert grid.cells.typecode == 'H'
+    cells = occupied( grid )
+    covered = {}
+    for i, j, rows, columns, prefabName in grid.rectangles():
+        for a in range( rows ):
+            for b in range( columns ):
+                assert ( i + a, j + b ) not in covered
+                covered[( i + a, j + b )] = prefabName
+    assert covered == cells
+
+
+@pytest.mark.parametrize( "layerKind", sorted( QUAD_NORMALS ) )
+@pytest.mark.parametrize( "minCells", ( 1, 2, 6 ) )
+def test_quads_and_tiles_cover_the_layer( layerKind, minCells ):
+    grid = randomGrid( minCells )
+    cells = occupied( grid )
+    quads, transforms = layerQuads( grid, layerKind, minCells = minCells )
+    covered = {}
+    for quad in quads:
+        prefabName, corners, normal, ( columns, rows ) = quad
+        assert columns*rows >= minCells and normal == QUAD_NORMALS[layerKind]
+        inside = quadCells( grid, quad )
+        assert len( inside ) == columns*rows
+        for cell in inside:
+            assert cell not in covered
+            covered[cell] = prefabName
+        # counter-clockwise seen from the side the quad faces
+        assert sum( c*n for c, n in zip( cross( *corners[:3] ), normal ) ) > 0
+        assert len( set( z for x, y, z in corners ) ) == 1
+    for prefabName, ( x, y, z ), rotation in transforms:
+        cell = ( round( -y/FLOOR_TILE_SIZE ), round( x/FLOOR_TILE_SIZE ) )
+        assert cell not in covered
+        covered[cell] = prefabName
+    assert covered == cells
+    if ( minCells == 1 ):
+        assert not transforms
+
+
+def test_small_rectangles_stay_tiles():
+    grid = randomGrid( 3, density = 0.3 )
+    quads, transforms = layerQuads( grid, "floor", minCells = grid.width*grid.height + 1 )
+    assert not quads
+    assert sorted( transforms ) == sorted( layerTransforms( grid, "floor" ) )
+
+
+def test_walls_are_not_merged():
+    with pytest.raises( ValueError ):
+        layerQuads( randomGrid( 0 ), "wallN" )
+
+
+@pytest.mark.parametrize( "chunkSize", ( 1, 5, 16 ) )
+def test_chunks_hold_the_tiles_of_their_cells( chunkSize ):
+    rng = random.Random( chunkSize )
+    def rows( density ):
+        return [ "".join( "#" if rng.random() < density else "." for j in range( 13 ) ) for i in range( 11 ) ]
+    reader = makeReader( { "floor": rows( 0.8 ), "wallN": rows( 0.2 ), "ceilingBar": rows( 0.2 ) },
+                         { "ceilingBar": "ceilingBar01" } )
+    chunks = dungeonChunkTransforms( reader, chunkSize )
+    expected = {}
+    for layerKind, grid in reader.getGrids().items():
+        if ( grid is not None ):
+            for i, j, prefabName, location, rotation in layerCellTransforms( grid, layerKind ):
+                expected.setdefault( ( i//chunkSize, j//chunkSize ), [] ).append( ( prefabName, location, rotation ) )
+    assert chunks == expected
+    # no tile lost or repeated, the chunks of a map edge are partial
+    assert sorted( tile for tiles in chunks.values() for tile in tiles ) == \
+        sorted( tile for tiles in dungeonTransforms( reader ).values() for tile in tiles )
+    assert all( ci <= 10//chunkSize and cj <= 12//chunkSize for ci, cj in chunks )
+
+
+def test_chunk_borders():
+    cells = [ ( 0, 0 ), ( 3, 3 ), ( 3, 4 ), ( 4, 3 ), ( 4, 4 ), ( 9, 9 ) ]
+    floor = [ "".join( "#" if ( i, j ) in cells else "." for j in range( 10 ) ) for i in range( 10 ) ]
+    chunks = dungeonChunkTransforms( makeReader( { "floor": floor } ), 4 )
+    def chunkCells( key ):
+        return sorted( ( round( -y/FLOOR_TILE_SIZE ), round( x/FLOOR_TILE_SIZE ) ) for prefab, ( x, y, z ), rotation in chunks[key] )
+    assert sorted( chunks ) == [ ( 0, 0 ), ( 0, 1 ), ( 1, 0 ), ( 1, 1 ), ( 2, 2 ) ]
+    assert chunkCells( ( 0, 0 ) ) == [ ( 0, 0 ), ( 3, 3 ) ] and chunkCells( ( 0, 1 ) ) == [ ( 3, 4 ) ]
+    assert chunkCells( ( 1, 0 ) ) == [ ( 4, 3 ) ] and chunkCells( ( 1, 1 ) ) == [ ( 4, 4 ) ]
+    assert chunkCells( ( 2, 2 ) ) == [ ( 9, 9 ) ]
@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as et
+from array import array
+
+from ReadDungeonClass import DungeonFileReader, GID_TYPECODE
+from layerGrid import NO_PREFAB
+
+
+def tilesetElement( name, firstGID, tiles ):
+    '''A "tileset" element of tiles (tileID, prefab name or None for a tile
+    without one)'''
+    tileset = et.Element( "tileset", { "firstgid": str( firstGID ), "name": name } )
+    for tileID, prefab in tiles:
+        properties = et.SubElement( et.SubElement( tileset, "tile", { "id": str( tileID ) } ), "properties" )
+        et.SubElement( properties, "property", { "name": "kind", "value": name } )
+        if ( prefab is not None ):
+            et.SubElement( properties, "property", { "name": "prefabName", "value": prefab } )
+    return tileset
+
+
+# the wall tileset starts right after the last floor tile, the column
+# tileset has holes and a tile without a prefab
+TILESETS = [ tilesetElement( "floorTiles", 1, [ ( 0, "floor01" ), ( 1, "floor02" ), ( 2, "floor03" ) ] ),
+             tilesetElement( "wallTiles", 4, [ ( 0, "wall01" ), ( 1, "wall02" ) ] ),
+             tilesetElement( "columnTiles", 100, [ ( 0, "column01" ), ( 3, None ), ( 5, "column02" ) ] ) ]
+
+
+def test_index_of_several_tilesets():
+    index = DungeonFileReader().buildTilesetIndex( TILESETS )
+    assert dict( ( name, tileset["firstgid"] ) for name, tileset in index.items() ) == \
+        { "floorTiles": 1, "wallTiles": 4, "columnTiles": 100 }
+    assert index["floorTiles"]["prefabs"] == { 1: "floor01", 2: "floor02", 3: "floor03" }
+    assert index["wallTiles"]["prefabs"] == { 4: "wall01", 5: "wall02" }
+    assert index["columnTiles"]["prefabs"] == { 100: "column01", 105: "column02" }
+    assert index["columnTiles"]["properties"][3] == { "kind": "columnTiles" }
+
+
+def test_prefab_names_at_the_boundaries():
+    reader = DungeonFileReader()
+    for tilesets in ( TILESETS, list( TILESETS ) ):
+        # from the index of the reader's own tilesets, or from a new one
+        reader.tilesets = TILESETS
+        reader.tilesetIndex = reader.buildTilesetIndex( TILESETS )
+        assert reader.getPrefabName( tilesets, "floorTiles", 0 ) == "floor01"
+        assert reader.getPrefabName( tilesets, "floorTiles", 2 ) == "floor03"
+        assert reader.getPrefabName( tilesets, "floorTiles", 3 ) == "None"
+        assert reader.getPrefabName( tilesets, "wallTiles", 0 ) == "wall01"
+        assert reader.getPrefabName( tilesets, "wallTiles", 1 ) == "wall02"
+        assert reader.getPrefabName( tilesets, "columnTiles", 5 ) == "column02"
+        assert [ reader.getPrefabName( tilesets, "columnTiles", tileID ) for tileID in ( 1, 3, 6 ) ] == [ "None" ]*3
+        assert reader.getPrefabName( tilesets, "ceilingTiles", 0 ) == "None"
+    assert reader.getTileProperties( "floorTiles", 3 ) == { "kind": "floorTiles", "prefabName": "floor03" }
+    assert reader.getTileProperties( "wallTiles", 4 ) == { "kind": "wallTiles", "prefabName": "wall01" }
+    assert reader.getTileProperties( "wallTiles", 3 ) == {} and reader.getTileProperties( "columnTiles", 99 ) == {}
+
+
+def test_layers_resolve_only_their_own_tileset():
+    reader = DungeonFileReader()
+    reader.tilesetIndex = reader.buildTilesetIndex( TILESETS )
+    reader.mapWidth = 4
+    gids = array( GID_TYPECODE, [ 0, 1, 3, 4, 5, 6, 99, 100, 103, 105, 106, 2 ] )
+    expected = { "floorTiles": [ "floor01", "floor03" ] + [ NO_PREFAB ]*8 + [ "floor02" ],
+                 "wallTiles": [ NO_PREFAB ]*2 + [ "wall01", "wall02" ] + [ NO_PREFAB ]*7,
+                 "columnTiles": [ NO_PREFAB ]*6 + [ "column01", NO_PREFAB, "column02", NO_PREFAB, NO_PREFAB ] }
+    for name, cells in expected.items():
+        grid = reader.resolveLayerGrid( gids, name )
+        assert ( grid.width, grid.height ) == ( 4, 3 )
+        assert [ grid.cell( k//4, k % 4 ) for k in range( 12 ) ] == [ NO_PREFAB ] + cells
@@ -0,0 +1,32 @@
+import pytest
+
+from ReadDungeonClass import DungeonFileReader
+from layerRegistry import layerNameIndex
+from tmxSynth import ENCODINGS, SYNTH_LAYERS, SYNTH_TILESETS, writeSynthLevel
+
+# gid -> prefab name of the synthetic tilesets
+PREFABS = dict( ( firstGID + tileID, prefab ) for name, firstGID, prefabs in SYNTH_TILESETS
+                for tileID, prefab in enumerate( prefabs ) )
+
+
+@pytest.mark.parametrize( "encoding", ENCODINGS )
+@pytest.mark.parametrize( "streaming", ( False, True ) )
+def test_written_layers_read_back( tmp_path, encoding, streaming ):
+    fileName = str( tmp_path / "level.tmx" )
+    width, height = 37, 23
+    masks = writeSynthLevel( fileName, width, height, seed = 5, encoding = encoding )
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, streaming = streaming )
+    assert ( reader.mapWidth, reader.mapHeight ) == ( width, height ) and not reader.layerFlags
+    specs = layerNameIndex()
+    grids = reader.getGrids()
+    for name, gid in SYNTH_LAYERS:
+        mask = masks[name]
+        assert any( mask )
+        expected = dict( ( ( k//width, k % width ), PREFABS[gid] ) for k in range( width*height ) if mask[k] )
+        assert dict( ( ( i, j ), prefab ) for i, j, prefab in grids[specs[name].kind].occupiedCells() ) == expected
+
+
+def test_unknown_encoding( tmp_path ):
+    with pytest.raises( ValueError ):
+        writeSynthLevel( str( tmp_path / "level.tmx" ), 8, 8, encoding = "base64-lzma" )
@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as et
+
+import pytest
+
+from ReadDungeonClass import DungeonFileReader
+from conftest import makeReader
+from proceduralDungeon import generateDungeon
+from tmxSynth import ENCODINGS
+from tmxWriter import buildTilesetIndex, writeDungeonTMX
+
+
+def gridMatrices( reader ):
+    return dict( ( kind, grid.toMatrix() ) for kind, grid in reader.getGrids().items()
+                 if grid is not None and grid.occupiedCount() )
+
+
+def readBack( fileName, streaming = False ):
+    reader = DungeonFileReader()
+    reader.readDungeonFromFile( fileName, streaming = streaming )
+    return reader
+
+
+@pytest.mark.parametrize( "encoding", ENCODINGS )
+def test_bundled_level_round_trip( tmp_path, bundledReader, encoding ):
+    fileName = str( tmp_path / "level.tmx" )
+    writeDungeonTMX( bundledReader, fileName, encoding )
+    for streaming in ( False, True ):
+        reader = readBack( fileName, streaming )
+        assert ( reader.mapWidth, reader.mapHeight ) == ( bundledReader.mapWidth, bundledReader.mapHeight )
+        assert gridMatrices( reader ) == gridMatrices( bundledReader )
+
+
+def test_procedural_level_round_trip( tmp_path ):
+    dungeon = generateDungeon( 48, 40, seed = 3 )
+    fileName = str( tmp_path / "procedural.tmx" )
+    writeDungeonTMX( dungeon, fileName )
+    assert gridMatrices( readBack( fileName ) ) == gridMatrices( dungeon )
+
+
+def test_attributes_are_escaped( tmp_path ):
+    prefab = 'floor "A" & <B>'
+    reader = makeReader( { "floor": [ "#.", ".#" ] }, { "floor": prefab } )
+    reader.tilesetIndex = buildTilesetIndex( [ ( "floorTiles", 1, [ prefab ] ) ] )
+    properties = { "name": 'Level <1> & "2"', "notes": "first line\nsecond\tline" }
+    fileName = str( tmp_path / "escaped.tmx" )
+    writeDungeonTMX( reader, fileName, "csv", properties )
+    root = et.parse( fileName ).getroot()
+    assert dict( ( p.get( "name" ), p.get( "value" ) ) for p in root.find( "properties" ) ) == properties
+    assert gridMatrices( readBack( fileName ) ) == gridMatrices( reader )
+
+
+def test_prefab_missing_from_its_tileset( tmp_path ):
+    reader = makeReader( { "floor": [ "#" ] } )
+    reader.tilesetIndex = buildTilesetIndex( [ ( "floorTiles", 1, [ "otherTile" ] ) ] )
+    with pytest.raises( ValueError ):
+        writeDungeonTMX( reader, str( tmp_path / "bad.tmx" ) )
+
+
+@pytest.mark.parametrize( "encoding", ENCODINGS )
+def test_flipped_tiles_round_trip( tmp_path, encoding ):
+    reader = makeReader( { "floor": [ "###.", ".###" ], "wallN": [ "#...", "...#" ] } )
+    reader.tilesetIndex = buildTilesetIndex( [ ( "floorTiles", 1, [ "floor01" ] ), ( "wallTiles", 101, [ "wallN01" ] ) ] )
+    # horizontally, vertically, diagonally flipped and all three, read
+    # from the other name of the floor layer
+    floorFlags = bytes( [ 8, 4, 2, 0, 0, 14, 0, 1 ] )
+    reader.layerFlags = { "floor": floorFlags, "wallTilesN": bytes( [ 0 ]*7 + [ 8 ] ) }
+    fileName = str( tmp_path / "flipped.tmx" )
+    writeDungeonTMX( reader, fileName, encoding )
+    for streaming in ( False, True ):
+        loaded = readBack( fileName, streaming )
+        assert gridMatrices( loaded ) == gridMatrices( reader )
+        assert loaded.layerFlags == { "floorTiles": floorFlags, "wallTilesN": reader.layerFlags["wallTilesN"] }
+    reader.layerFlags = { "floorTiles": floorFlags[1:] }
+    with pytest.raises( ValueError ):
+        writeDungeonTMX( reader, fileName, encoding )
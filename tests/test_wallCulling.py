@@ -0,0 +1,78 @@
+from conftest import makeReader
+from tilePlacement import WALL_FACING
+from wallCulling import WALL_GRIDS, cullHiddenWalls
+
+
+def bruteForceVisible( reader ):
+    '''wallKind -> set of (row, column) of the walls facing a floor cell'''
+    floor = reader.floorGrid
+    visible = {}
+    for wallKind, gridName in WALL_GRIDS.items():
+        grid = getattr( reader, gridName )
+        di, dj = WALL_FACING[wallKind]
+        visible[wallKind] = set( ( i, j ) for i, j, prefabName in grid.occupiedCells()
+                                 if 0 <= i + di < grid.height and 0 <= j + dj < grid.width
+                                 and floor.cell( i + di, j + dj ) != "None" )
+    return visible
+
+
+def wallCells( reader ):
+    return dict( ( wallKind, set( ( i, j ) for i, j, p in getattr( reader, gridName ).occupiedCells() ) )
+                 for wallKind, gridName in WALL_GRIDS.items() )
+
+
+def test_hand_drawn_walls():
+    # one room of 2x2 cells, every wall layer also has tiles in the rock
+    # and on the map border. An East wall stands right of the room and
+    # faces west, a West wall left of it and faces east (see WALL_FACING)
+    reader = makeReader( { "floor": [ ".....",
+                                      ".##..",
+                                      ".##..",
+                                      "....." ],
+                           "wallN": [ ".##.#",
+                                      ".....",
+                                      ".....",
+                                      "##..." ],
+                           "wallS": [ "#....",
+                                      ".....",
+                                      ".....",
+                                      ".##.#" ],
+                           "wallE": [ ".....",
+                                      "#...#",
+                                      "#..#.",
+                                      "....." ],
+                           "wallW": [ ".....",
+                                      "...#.",
+                                      "#..##",
+                                      "....#" ] } )
+    removed = cullHiddenWalls( reader )
+    assert wallCells( reader ) == { "wallN": { ( 0, 1 ), ( 0, 2 ) },
+                                    "wallS": { ( 3, 1 ), ( 3, 2 ) },
+                                    "wallE": { ( 2, 3 ) },
+                                    "wallW": { ( 2, 0 ) } }
+    assert removed == { "wallN": 3, "wallS": 2, "wallE": 3, "wallW": 4 }
+
+
+def test_bundled_level_matches_brute_force( bundledReader ):
+    before = dict( ( kind, len(cells) ) for kind, cells in wallCells( bundledReader ).items() )
+    expected = bruteForceVisible( bundledReader )
+    removed = cullHiddenWalls( bundledReader )
+    assert wallCells( bundledReader ) == expected
+    assert removed == dict( ( kind, before[kind] - len(expected[kind]) ) for kind in before )
+    # the matrices are rebuilt from the culled grids
+    assert sum( row.count( "None" ) for row in bundledReader.wallLayerN ) == \
+        bundledReader.wallGridN.width*bundledReader.wallGridN.height - len(expected["wallN"])
+
+
+def test_sixteen_bit_grids_are_culled():
+    reader = makeReader( { "floor": [ "...", ".#.", "..." ],
+                           "wallN": [ ".#.", "...", ".#." ],
+                           "wallS": [ "...", "...", "..." ],
+                           "wallE": [ "...", "...", "..." ],
+                           "wallW": [ "...", "...", "..." ] } )
+    for k in range( 300 ):
+        reader.prefabSymbols.add( "filler%03d" % k )
+    from array import array
+    reader.wallGridN.cells = array( 'H', reader.wallGridN.cells )
+    assert cullHiddenWalls( reader )["wallN"] == 1
+    assert wallCells( reader )["wallN"] == { ( 0, 1 ) }